@@ -0,0 +1,34 @@
+# Times market_stats.compute over a market of synthetic listings spread across every offset.
+#
+#   python bench/market_stats.py --listings 100000
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from lloidbot import market_stats
+from lloidbot.turnips import Turnip, all_offsets
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--listings', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    offsets = list(all_offsets)
+    listings = [Turnip('global', i, f"host{i}", 'DODOX', random.choice(offsets), None, None,
+        [random.randint(30, 600) if random.random() < 0.7 else None for _ in range(12)] + [None, None])
+        for i in range(args.listings)]
+
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        market_stats.compute(listings)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{args.listings:,} listings: {best * 1000:.1f} ms")
+
+if __name__ == '__main__':
+    main()
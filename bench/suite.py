@@ -0,0 +1,272 @@
+# Microbenchmarks for the market, queue, QueueManager and SocialManager hot paths at a few
+# scales, all in memory so they run anywhere. Results can be saved as a JSON baseline and later
+# runs compared against it; anything slower than the baseline by more than the threshold is
+# flagged, and the run exits with status 1.
+#
+#   python bench/suite.py --save bench/baseline.json
+#   python bench/suite.py --compare bench/baseline.json --threshold 0.2
+#   python bench/suite.py --scales 10 1000 --only queue.
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from lloidbot import turnips
+from lloidbot.turnips import StalkMarket, listing_columns
+from lloidbot.queue_manager import QueueManager
+from lloidbot.social_manager import SocialManager
+
+LINE = 1000 # guests per host in the queue benchmarks, so bigger scales mean more hosts, not endless lines
+
+def fresh_market():
+    return StalkMarket(sqlite3.connect(':memory:'))
+
+# Puts n listings straight into the table, dated `weeks_ago` weeks back, without going through declare.
+def fill(market, n, weeks_ago=0):
+    now = turnips.current_datetime(0)
+    week = turnips.week_number(now) - weeks_ago
+    placeholders = ",".join("?" * (len(listing_columns.split(", ")) + 1))
+    market.db.executemany(f"insert into turnips({listing_columns}, latest_week) values ({placeholders})",
+        [(turnips.default_chan, i, f"host{i}", 'D0D0X', i % 24 - 11, None, str(now)) + tuple(random.randint(30, 600) for _ in range(14)) + (week,)
+            for i in range(n)])
+    market.db.commit()
+
+# A market with open listings and n guests lined up behind them, LINE to a host.
+def lined_up(n):
+    market = fresh_market()
+    hosts = max(1, -(-n // LINE))
+    for owner in range(hosts):
+        market.declare(owner, f"host{owner}", 100, 'D0D0X', 0)
+    for guest in range(n):
+        market.request(LINE * 1000 + guest, guest % hosts)
+    return market, hosts
+
+# Each benchmark is (setup, run): setup(n) builds whatever the run needs, and run(state) does n
+# operations' worth of work (or one, for the bulk ones) and returns how many operations it did.
+def market_declare():
+    def run(market):
+        for i in range(market.n):
+            market.declare(i, f"host{i}", 100, 'D0D0X', 0)
+        return market.n
+    def setup(n):
+        market = fresh_market()
+        market.n = n
+        return market
+    return setup, run
+
+def market_get():
+    def setup(n):
+        market = fresh_market()
+        for i in range(n):
+            market.declare(i, f"host{i}", 100, 'D0D0X', 0)
+        market.n = n
+        return market
+    def run(market):
+        for i in range(market.n):
+            market.get(i)
+        return market.n
+    return setup, run
+
+def market_get_all():
+    def setup(n):
+        market = fresh_market()
+        fill(market, n)
+        return market
+    def run(market):
+        market.get_all()
+        return 1
+    return setup, run
+
+def market_wipe_old_prices():
+    def setup(n):
+        market = fresh_market()
+        fill(market, n, weeks_ago=1)
+        return market
+    def run(market):
+        market.wipe_old_prices()
+        return 1
+    return setup, run
+
+def queue_request():
+    def setup(n):
+        market = fresh_market()
+        hosts = max(1, -(-n // LINE))
+        for owner in range(hosts):
+            market.declare(owner, f"host{owner}", 100, 'D0D0X', 0)
+        return market, n, hosts
+    def run(state):
+        market, n, hosts = state
+        for guest in range(n):
+            market.request(LINE * 1000 + guest, guest % hosts)
+        return n
+    return setup, run
+
+def queue_forfeit():
+    def setup(n):
+        market, _ = lined_up(n)
+        guests = [LINE * 1000 + g for g in range(n)]
+        random.Random(0).shuffle(guests)
+        return market, guests
+    def run(state):
+        market, guests = state
+        for guest in guests:
+            market.forfeit(guest)
+        return len(guests)
+    return setup, run
+
+def queue_next():
+    def setup(n):
+        return lined_up(n)
+    def run(state):
+        market, hosts = state
+        done = 0
+        for owner in range(hosts):
+            while market.next(owner)[1] == turnips.Status.SUCCESS:
+                done += 1
+        return done
+    return setup, run
+
+def queue_close():
+    def setup(n):
+        return lined_up(n)
+    def run(state):
+        market, hosts = state
+        for owner in range(hosts):
+            market.close(owner)
+        return hosts
+    return setup, run
+
+def queue_manager_declare():
+    def setup(n):
+        return QueueManager(fresh_market()), n
+    def run(state):
+        manager, n = state
+        for i in range(n):
+            manager.declare(i, f"host{i}", 100, 'D0D0X', 0)
+        return n
+    return setup, run
+
+def queue_manager_visitor_request_queue():
+    def setup(n):
+        manager = QueueManager(fresh_market())
+        hosts = max(1, -(-n // LINE))
+        for owner in range(hosts):
+            manager.declare(owner, f"host{owner}", 100, 'D0D0X', 0)
+        return manager, n, hosts
+    def run(state):
+        manager, n, hosts = state
+        for guest in range(n):
+            manager.visitor_request_queue(LINE * 1000 + guest, guest % hosts)
+        return n
+    return setup, run
+
+def social_manager_post_listing():
+    def setup(n):
+        return SocialManager(QueueManager(fresh_market())), n
+    def run(state):
+        social, n = state
+        for i in range(n):
+            social.post_listing(i, f"host{i}", "selling", 100, 'D0D0X', 0)
+        return n
+    return setup, run
+
+BENCHMARKS = {
+    'market.declare': market_declare,
+    'market.get': market_get,
+    'market.get_all': market_get_all,
+    'market.wipe_old_prices': market_wipe_old_prices,
+    'queue.request': queue_request,
+    'queue.forfeit': queue_forfeit,
+    'queue.next': queue_next,
+    'queue.close': queue_close,
+    'queue_manager.declare': queue_manager_declare,
+    'queue_manager.visitor_request_queue': queue_manager_visitor_request_queue,
+    'social_manager.post_listing': social_manager_post_listing,
+}
+
+# Best of at least `repeat` runs, each on freshly set up state. Quick benchmarks keep going until
+# they've run for `min_time` in total, so the small scales aren't all timer noise.
+def measure(benchmark, n, repeat, min_time=0.25):
+    setup, run = benchmark()
+    best = None
+    runs, total = 0, 0
+    while runs < repeat or (total < min_time and runs < 1000):
+        runs += 1
+        random.seed(n)
+        state = setup(n)
+        gc.collect()
+        gc.disable() # like timeit, so a collection triggered by setup's garbage doesn't land in the timing
+        try:
+            start = time.perf_counter()
+            ops = run(state)
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        total += elapsed
+        if best is None or elapsed < best[0]:
+            best = (elapsed, ops)
+    elapsed, ops = best
+    return {'seconds': elapsed, 'ops': ops, 'per_op': elapsed / max(ops, 1)}
+
+def run_suite(scales, repeat, only=None):
+    results = {}
+    for name, benchmark in BENCHMARKS.items():
+        if only is not None and not any(name.startswith(o) for o in only):
+            continue
+        for n in scales:
+            key = f"{name}[{n}]"
+            results[key] = measure(benchmark, n, repeat)
+            print(f"{key:48} {results[key]['per_op'] * 1e6:12.2f} us/op {results[key]['seconds']:10.4f} s", flush=True)
+    return results
+
+# Returns [(key, baseline per_op, current per_op, ratio)] for everything that got slower by more
+# than `threshold` (0.2 = 20%). Benchmarks missing from either side are skipped.
+def regressions(baseline, current, threshold):
+    slower = []
+    for key, result in current.items():
+        if key not in baseline:
+            continue
+        ratio = result['per_op'] / baseline[key]['per_op'] if baseline[key]['per_op'] > 0 else float('inf')
+        if ratio > 1 + threshold:
+            slower.append((key, baseline[key]['per_op'], result['per_op'], ratio))
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', type=int, nargs='+', default=[10, 1000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='+', help='Only run benchmarks whose names start with one of these.')
+    parser.add_argument('--save', help='Write the results to this JSON file as a baseline.')
+    parser.add_argument('--compare', help='Compare against the baseline in this JSON file.')
+    parser.add_argument('--threshold', type=float, default=0.2, help='How much slower than the baseline counts as a regression.')
+    args = parser.parse_args()
+
+    results = run_suite(args.scales, args.repeat, args.only)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'machine': platform.platform(),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+        print(f"Saved {len(results)} results to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        slower = regressions(baseline, results, args.threshold)
+        for key, before, after, ratio in slower:
+            print(f"REGRESSION {key}: {before * 1e6:.2f} -> {after * 1e6:.2f} us/op ({ratio:.2f}x)")
+        if len(slower) > 0:
+            sys.exit(1)
+        print(f"No regressions over {args.threshold:.0%} against {args.compare}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# How many codes a turnip rush gets handed out per second of real time with the servers split
+# over 1, 2, 4... worker processes, the way worker mode splits them (see lloidbot/workers.py). Each
+# worker plays out its servers' share of the rush on a virtual clock (see lloidbot/simulation), as
+# fast as it can, and they all share one SQLite database file in WAL mode. Workers can't go faster
+# than there are cores to run them on, so the cores available are printed alongside.
+#
+#   python bench/worker_throughput.py --workers 1 2 4 --guilds 8 --hosts 400 --guests 8000
+import argparse
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from lloidbot.simulation.workload import Workload, simulate
+from lloidbot.workers import shard_of, shards_for
+
+# Guild ids that land on shards 0, 1, 2... of `count`.
+def guild_ids(count):
+    return [shard << 22 for shard in range(count)]
+
+# One worker's share: its servers, and the hosts and guests that go with them.
+def run_worker(index, workers, args, path, ready, results):
+    logging.getLogger('lloid').setLevel(logging.ERROR)
+    mine = shards_for(index, workers, args.guilds)
+    guilds = [g for g in guild_ids(args.guilds) if shard_of(g, args.guilds) in mine]
+    share = len(guilds) / args.guilds
+    workload = Workload(hosts=round(args.hosts * share), guests=round(args.guests * share), hours=args.hours,
+        guild_ids=guilds, seed=args.seed + index)
+    ready.wait()
+    started = time.perf_counter()
+    report = simulate(workload, path, shared=True)
+    results.put((index, report.codes, started, time.perf_counter()))
+
+def run(workers, args):
+    context = multiprocessing.get_context('spawn')
+    directory = tempfile.mkdtemp()
+    try:
+        ready, results = context.Barrier(workers), context.Queue()
+        path = os.path.join(directory, 'bench.db')
+        processes = [context.Process(target=run_worker, args=(i, workers, args, path, ready, results)) for i in range(workers)]
+        for p in processes:
+            p.start()
+        finished = [results.get() for _ in processes]
+        for p in processes:
+            p.join()
+    finally:
+        shutil.rmtree(directory)
+    codes = sum(f[1] for f in finished)
+    wall = max(f[3] for f in finished) - min(f[2] for f in finished)
+    return codes, wall
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--guilds', type=int, default=8)
+    parser.add_argument('--hosts', type=int, default=400)
+    parser.add_argument('--guests', type=int, default=8000)
+    parser.add_argument('--hours', type=float, default=2.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if max(args.workers) > args.guilds:
+        parser.error("There have to be at least as many guilds as workers.")
+
+    print(f"{args.hosts} hosts and {args.guests} guests over {args.hours:g} virtual hours in {args.guilds} servers, "
+        f"{len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()} cores available")
+    baseline = None
+    for workers in args.workers:
+        codes, wall = run(workers, args)
+        rate = codes / wall
+        baseline = baseline or rate
+        print(f"{workers} workers: {codes} codes in {wall:.2f}s, {rate:.0f} codes/s ({rate / baseline:.2f}x)")
+
+if __name__ == '__main__':
+    main()
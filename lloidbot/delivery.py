@@ -0,0 +1,76 @@
+import asyncio
+import collections
+import logging
+import random
+import time
+import discord
+
+logger = logging.getLogger('lloid')
+
+# One try at getting a code to a guest.
+Attempt = collections.namedtuple('Attempt', ['at', 'guest', 'owner', 'attempt', 'outcome'])
+
+# Delivers codes to guests, retrying failed sends in the background instead of holding up the
+# host's line. The first attempt happens right away; if Discord errors out, the delivery is
+# retried with exponential backoff (plus some jitter, so a burst of failures doesn't retry in
+# lockstep) until it goes through or we run out of attempts. Guests who don't accept DMs are
+# not retried.
+#
+# Every attempt is recorded, so it's possible to see how often deliveries fail and whether the
+# retries actually help.
+class DeliveryQueue:
+    def __init__(self, max_attempts=4, base_delay=30, max_delay=300, history=1000):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.attempts = collections.deque(maxlen=history)
+        self.outcomes = collections.Counter()
+        self.pending = {} # (guest, owner) -> handle of the scheduled retry
+
+    # `send` is a zero-argument callable returning the awaitable that sends the code, so that a
+    # retry sends whatever the code is by then. Returns what `send` returned, or None if the
+    # first attempt failed (in which case it will be retried) or the guest doesn't accept DMs.
+    async def deliver(self, guest, owner, send):
+        self.cancel(guest, owner)
+        return await self.attempt(guest, owner, send, 1)
+
+    async def attempt(self, guest, owner, send, attempt):
+        self.pending.pop((guest, owner), None)
+        try:
+            result = await send()
+            self.record(guest, owner, attempt, 'sent')
+            return result
+        except discord.Forbidden:
+            logger.warning(f"Guest {guest} doesn't seem to be allowing DMs. Skipping them.")
+            self.record(guest, owner, attempt, 'forbidden')
+        except discord.HTTPException as ex:
+            if attempt >= self.max_attempts:
+                logger.error(f"Giving up on sending {owner}'s code to {guest} after {attempt} attempts. Error was {ex}")
+                self.record(guest, owner, attempt, 'gave_up')
+            else:
+                delay = self.backoff(attempt)
+                logger.warning(f"Failed to send {owner}'s code to {guest}. Trying again in {delay:.0f}s. Error was {ex}")
+                self.record(guest, owner, attempt, 'failed')
+                self.pending[(guest, owner)] = asyncio.get_event_loop().call_later(delay,
+                    lambda: asyncio.ensure_future(self.attempt(guest, owner, send, attempt + 1)))
+        return None
+
+    def backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay * (0.5 + random.random() / 2)
+
+    def cancel(self, guest, owner):
+        handle = self.pending.pop((guest, owner), None)
+        if handle is not None:
+            handle.cancel()
+
+    def cancel_owner(self, owner):
+        for key in [k for k in self.pending if k[1] == owner]:
+            self.cancel(*key)
+
+    def record(self, guest, owner, attempt, outcome):
+        self.attempts.append(Attempt(time.time(), guest, owner, attempt, outcome))
+        self.outcomes[outcome] += 1
+
+    def stats(self):
+        return {'pending': len(self.pending), **self.outcomes}
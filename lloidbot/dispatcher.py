@@ -0,0 +1,154 @@
+import asyncio
+import enum
+import itertools
+import logging
+
+logger = logging.getLogger('lloid')
+
+# Outbound messages, most urgent first. During a rush a code DM should never be stuck behind
+# someone's etiquette blurb or a listing edit.
+class Priority(enum.IntEnum):
+    DODO_CODE = 0
+    BOARDING_WARNING = 1
+    QUEUE_CONFIRMATION = 2
+    LISTING_EDIT = 3
+    NOTIFICATION = 4 # bulk notifications, eg: telling a line that the host closed
+
+class TokenBucket:
+    EPSILON = 1e-6 # loop timers may fire a hair early, and refills pick up float error; treat this close to a token as one
+
+    def __init__(self, rate, capacity):
+        self.rate = rate # tokens per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = None
+
+    def refill(self, now):
+        if self.updated is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Seconds until a token is available (0 if one is available right now).
+    def delay(self, now):
+        self.refill(now)
+        if self.tokens >= 1 - TokenBucket.EPSILON:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self.refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+# Funnels every outgoing message through a priority queue drained by a few workers.
+# Each route (a DM channel, a text channel) has its own token bucket, on top of a global one,
+# roughly mirroring Discord's rate limits. A message whose route is out of tokens is set aside
+# until it has one, rather than blocking a worker, so other routes keep flowing.
+#
+# Within a priority, servers take turns: each message is tagged with its server's next round,
+# and the queue is ordered by round before arrival, so a server sending 500 notifications only
+# gets one message out per round while another server's single code DM goes in the next one.
+# The global bucket is still shared, since Discord's global limit is per bot, not per server.
+#
+# Callers await send(), which returns whatever the action returned or raises whatever it raised,
+# so error handling around a send works the same as if it had been made directly.
+class OutboundDispatcher:
+    def __init__(self, workers=4, route_rate=1.0, route_burst=5, global_rate=50.0, global_burst=50):
+        self.workers = workers
+        self.route_rate = route_rate
+        self.route_burst = route_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.buckets = {} # route -> TokenBucket
+        self.queue = None
+        self.tasks = []
+        self.counter = itertools.count()
+        self.rounds = {p: 0 for p in Priority} # the round of the last message sent at each priority
+        self.last_round = {} # (priority, guild) -> round of that server's last queued message
+        self.depth = {p: 0 for p in Priority} # includes messages waiting on a token bucket
+        self.sent = {p: 0 for p in Priority}
+        self.total_latency = {p: 0.0 for p in Priority}
+        self.max_latency = {p: 0.0 for p in Priority}
+
+    def start(self):
+        self.queue = asyncio.PriorityQueue()
+        self.tasks = [asyncio.ensure_future(self.work()) for _ in range(self.workers)]
+
+    def stop(self):
+        for t in self.tasks:
+            t.cancel()
+        self.tasks = []
+
+    def now(self):
+        return asyncio.get_event_loop().time()
+
+    # `action` is a zero-argument callable returning the awaitable that actually sends the
+    # message, eg: lambda: user.send("hi"). `guild` is the server it's on behalf of, if any;
+    # messages that aren't for any server share a turn of their own.
+    async def send(self, priority, route, action, guild=None):
+        future = asyncio.get_event_loop().create_future()
+        self.depth[priority] += 1
+        turn = max(self.rounds[priority], self.last_round.get((priority, guild), 0)) + 1
+        self.last_round[(priority, guild)] = turn
+        self.queue.put_nowait((priority, turn, next(self.counter), guild, route, action, future, self.now()))
+        return await future
+
+    async def work(self):
+        while True:
+            item = await self.queue.get()
+            priority, turn, _, guild, route, action, future, enqueued = item
+            if future.done(): # the caller gave up on it
+                self.depth[priority] -= 1
+                self.finish_turn(priority, turn, guild)
+                continue
+
+            now = self.now()
+            bucket = self.bucket(route)
+            delay = max(bucket.delay(now), self.global_bucket.delay(now))
+            if delay > 0:
+                asyncio.get_event_loop().call_later(delay, self.queue.put_nowait, item)
+                continue
+            bucket.take(now)
+            self.global_bucket.take(now)
+
+            self.depth[priority] -= 1
+            self.finish_turn(priority, turn, guild)
+            try:
+                result = await action()
+                if not future.done():
+                    future.set_result(result)
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                if not future.done():
+                    future.set_exception(ex)
+
+            latency = self.now() - enqueued
+            self.sent[priority] += 1
+            self.total_latency[priority] += latency
+            self.max_latency[priority] = max(self.max_latency[priority], latency)
+
+    # Moves the priority on to the round of the message leaving the queue, and forgets the server
+    # if that was the last message it had queued.
+    def finish_turn(self, priority, turn, guild):
+        self.rounds[priority] = max(self.rounds[priority], turn)
+        if self.last_round.get((priority, guild)) == turn:
+            del self.last_round[(priority, guild)]
+
+    def bucket(self, route):
+        if route not in self.buckets:
+            if len(self.buckets) > 10000:
+                now = self.now()
+                self.buckets = {r: b for r, b in self.buckets.items() if not b.is_full(now)}
+            self.buckets[route] = TokenBucket(self.route_rate, self.route_burst)
+        return self.buckets[route]
+
+    def stats(self):
+        return {p.name: {
+                    'depth': self.depth[p],
+                    'sent': self.sent[p],
+                    'mean_latency': self.total_latency[p] / self.sent[p] if self.sent[p] > 0 else 0.0,
+                    'max_latency': self.max_latency[p],
+                } for p in Priority}
@@ -0,0 +1,43 @@
+import asyncio
+import logging
+import discord
+
+logger = logging.getLogger('lloid')
+
+# How many DMs a single fan-out will have in flight at once. Set from DM_CONCURRENCY.
+concurrency_limit = 10
+
+# What happened when the same message was sent to a group of users.
+class FanOutResult:
+    def __init__(self):
+        self.sent = []
+        self.forbidden = [] # users who don't accept DMs from us
+        self.failed = [] # users we couldn't reach for any other reason
+
+    def __len__(self):
+        return len(self.sent) + len(self.forbidden) + len(self.failed)
+
+    def __str__(self):
+        return f"{len(self.sent)} sent, {len(self.forbidden)} not accepting DMs, {len(self.failed)} failed"
+
+# Sends `content` to every user in `user_ids` concurrently, with at most `concurrency` sends
+# in flight. One recipient being slow or refusing DMs doesn't hold up or break the others;
+# their outcome is just recorded in the result. `guild` is the server the message is on behalf of.
+async def fan_out(bot, user_ids, content, concurrency=None, guild=None):
+    result = FanOutResult()
+    semaphore = asyncio.Semaphore(concurrency or concurrency_limit)
+
+    async def send(user_id):
+        async with semaphore:
+            try:
+                user = await bot.resolve_user(user_id)
+                await bot.dm(user, content, guild=guild)
+                result.sent.append(user_id)
+            except discord.Forbidden:
+                result.forbidden.append(user_id)
+            except discord.HTTPException as ex:
+                logger.warning(f"Couldn't DM {user_id}: {ex}")
+                result.failed.append(user_id)
+
+    await asyncio.gather(*[send(u) for u in user_ids])
+    return result
@@ -0,0 +1,115 @@
+from collections import OrderedDict
+
+# A Fenwick (binary indexed) tree of 0/1 flags, used to count how many guests are still in
+# line ahead of a given sequence number in O(log n).
+class Fenwick:
+    def __init__(self, size):
+        self.size = size
+        self.tree = [0] * (size + 1)
+
+    def add(self, i, delta):
+        i += 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, i): # sum of the flags in [0, i)
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    @staticmethod
+    def of_ones(count, size):
+        # Builds a tree whose first `count` flags are set, in O(size).
+        f = Fenwick(size)
+        for i in range(1, size + 1):
+            f.tree[i] += 1 if i <= count else 0
+            parent = i + (i & -i)
+            if parent <= size:
+                f.tree[parent] += f.tree[i]
+        return f
+
+# The line of guests waiting to visit a single owner's island.
+# This is backed by an OrderedDict (a hash map threaded through a doubly linked list), so
+# joining the back of the line, leaving from anywhere in it, getting called in from the
+# front, and checking whether someone is in line are all constant time no matter how many
+# people have reacted to a listing.
+# Every guest is also stamped with an increasing sequence number that is tracked in a
+# Fenwick tree, so "what's my position" can be answered in O(log n) even while people
+# forfeit from the middle of the line. Sequence numbers are compacted whenever they run
+# past the tree's capacity, which keeps the amortized cost of joining the line constant.
+# Iterating over it yields (guest, owner) tuples in line order, which is the shape the rest
+# of the bot has always worked with.
+class GuestQueue:
+    MIN_CAPACITY = 16
+
+    def __init__(self, owner):
+        self.owner = owner
+        self.entries = OrderedDict() # guest -> sequence number
+        self.next_seq = 0
+        self.ranks = Fenwick(GuestQueue.MIN_CAPACITY)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        for guest in self.entries:
+            yield (guest, self.owner)
+
+    def __contains__(self, guest):
+        return guest in self.entries
+
+    def append(self, guest):
+        if guest in self.entries:
+            return False
+        if self.next_seq >= self.ranks.size:
+            self.compact()
+        self.entries[guest] = self.next_seq
+        self.ranks.add(self.next_seq, 1)
+        self.next_seq += 1
+        return True
+
+    def remove(self, guest):
+        if guest not in self.entries:
+            return False
+        self.ranks.add(self.entries.pop(guest), -1)
+        return True
+
+    def popleft(self):
+        if len(self.entries) == 0:
+            return None
+        guest, seq = self.entries.popitem(last=False)
+        self.ranks.add(seq, -1)
+        return (guest, self.owner)
+
+    def peek(self):
+        return next(iter(self.entries), None)
+
+    # Returns the number of guests ahead of this one (so 0 means they're next), or None if
+    # they aren't in this line.
+    def position(self, guest):
+        seq = self.entries.get(guest)
+        if seq is None:
+            return None
+        return self.ranks.prefix(seq)
+
+    def guests(self):
+        return list(self.entries)
+
+    def clear(self):
+        remaining = list(self.entries)
+        self.entries.clear()
+        self.next_seq = 0
+        self.ranks = Fenwick(GuestQueue.MIN_CAPACITY)
+        return remaining
+
+    def compact(self):
+        # Renumber everyone still in line from 0, leaving at least as much headroom as
+        # there are people in line so the next compaction is O(n) appends away.
+        for seq, guest in enumerate(self.entries):
+            self.entries[guest] = seq
+        self.next_seq = len(self.entries)
+        capacity = max(GuestQueue.MIN_CAPACITY, 2 * (self.next_seq + 1))
+        self.ranks = Fenwick.of_ones(self.next_seq, capacity)
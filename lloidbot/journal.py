@@ -0,0 +1,201 @@
+import asyncio
+import enum
+import json
+import logging
+import sqlite3
+
+logger = logging.getLogger('lloid')
+
+# Everything the bot needs to pick up where it left off after a restart: who's in which line,
+# which message is each host's listing, pauses, cooldown deadlines and so on. Each change is
+# appended to a journal table as it happens; every so often the journal is folded into a single
+# snapshot row so that it doesn't grow forever and startup only has to replay a short tail.
+#
+# It also keeps track of every listing message the bot has posted and not yet deleted, so that
+# startup only has to clean those up instead of trawling the whole channel history.
+#
+# When writes go to the database thread, they're held in memory and written in batches rather
+# than one at a time, so that a rush of reactions doesn't queue up an fsync each ahead of
+# everything else waiting on that thread, and so that the database is only locked for as long as
+# it takes to write a batch (other workers share it; see workers.py). A crash can lose the last
+# `commit_delay` seconds of changes.
+class Entry(enum.Enum):
+    OPENED = 'opened' # guild
+    POSTED = 'posted' # message, channel
+    REQUESTED = 'requested'
+    FORFEITED = 'forfeited'
+    DISPENSED = 'dispensed'
+    CLOSED = 'closed'
+    PAUSES = 'pauses' # requested, paused
+    DEADLINE = 'deadline' # at: unix time the current cooldown ends, or None
+    DESCRIPTION = 'description' # text
+    DONE = 'done'
+    DELETED = 'deleted' # message
+
+# How many guests who were sent a code are remembered, so that they can say they're done. Only
+# the last few are ever still on an island, so the oldest are forgotten past this.
+DEPARTED_LIMIT = 1000
+
+def depart(departed, guest, owner):
+    departed.pop(guest, None)
+    departed[guest] = owner
+    while len(departed) > DEPARTED_LIMIT:
+        del departed[next(iter(departed))]
+
+# Once a host closes, their guests saying they're done doesn't let anyone in any more.
+def forget_departures(departed, owner):
+    for guest in [g for g, o in departed.items() if o == owner]:
+        del departed[guest]
+
+def empty_state():
+    return {
+        'listings': {}, # owner -> listing (see new_listing)
+        'departed': {}, # guest -> owner whose island they were most recently sent to
+        'messages': {}, # id of every listing message that's still up -> its channel id
+    }
+
+def new_listing():
+    return {
+        'guild': None,
+        'message': None,
+        'channel': None,
+        'guests': {}, # guest -> None, in line order
+        'requested_pauses': 0,
+        'paused': False,
+        'deadline': None,
+        'description': None,
+    }
+
+def apply(state, kind, owner=None, guest=None, data=None):
+    listings = state['listings']
+    if kind == Entry.OPENED:
+        listings[owner] = new_listing()
+        listings[owner]['guild'] = (data or {}).get('guild')
+        return
+    elif kind == Entry.CLOSED:
+        listings.pop(owner, None)
+        forget_departures(state['departed'], owner)
+        return
+    elif kind == Entry.DONE:
+        state['departed'].pop(guest, None)
+        return
+    elif kind == Entry.DELETED:
+        state['messages'].pop(data['message'], None)
+        return
+    elif kind == Entry.POSTED:
+        state['messages'][data['message']] = data['channel']
+
+    listing = listings.get(owner)
+    if listing is None:
+        return
+    if kind == Entry.REQUESTED:
+        listing['guests'][guest] = None
+    elif kind == Entry.FORFEITED:
+        listing['guests'].pop(guest, None)
+    elif kind == Entry.DISPENSED:
+        listing['guests'].pop(guest, None)
+        depart(state['departed'], guest, owner)
+    elif kind == Entry.POSTED:
+        listing['message'] = data['message']
+        listing['channel'] = data['channel']
+    elif kind == Entry.PAUSES:
+        listing['requested_pauses'] = data['requested']
+        listing['paused'] = data['paused']
+    elif kind == Entry.DEADLINE:
+        listing['deadline'] = data['at']
+    elif kind == Entry.DESCRIPTION:
+        listing['description'] = data['text']
+
+# JSON can't have integer keys, so the snapshot stores the dicts above as lists of pairs.
+def dump(state):
+    return json.dumps({
+        'listings': [[owner, dict(listing, guests=list(listing['guests']))] for owner, listing in state['listings'].items()],
+        'departed': list(state['departed'].items()),
+        'messages': list(state['messages'].items()),
+    })
+
+def parse(text):
+    raw = json.loads(text)
+    state = empty_state()
+    for owner, listing in raw['listings']:
+        listing['guests'] = dict.fromkeys(listing['guests'])
+        state['listings'][owner] = listing
+    state['departed'] = {guest: owner for guest, owner in raw['departed']}
+    state['messages'] = {message: channel for message, channel in raw.get('messages', [])}
+    return state
+
+class StateJournal:
+    def __init__(self, db: sqlite3.Connection, executor=None, compact_every=1000, commit_every=100, commit_delay=0.25):
+        self.db = db
+        self.executor = executor # if given, writes are handed to it instead of done inline
+        self.compact_every = compact_every
+        self.commit_every = commit_every # with an executor, write after this many changes...
+        self.commit_delay = commit_delay # ...or this many seconds after the first unwritten one
+        self.appended = 0
+        self.pending = [] # changes not yet handed to the executor
+        self.commit_handle = None
+        self.metrics = None # times each write, if set
+        self.db.execute("create table if not exists journal(seq integer primary key autoincrement, kind, owner, guest, data)")
+        self.db.execute("create table if not exists journal_snapshot(id integer primary key check (id = 0), upto, state)")
+        self.db.commit()
+
+    def record(self, kind, owner=None, guest=None, **data):
+        if self.executor is None:
+            write = self.write if self.metrics is None else self.metrics.timed('journal', self.write)
+            write([(kind, owner, guest, data)])
+            return
+        self.pending.append((kind, owner, guest, data))
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if len(self.pending) >= self.commit_every or loop is None:
+            self.flush()
+        elif self.commit_handle is None:
+            self.commit_handle = loop.call_later(self.commit_delay, self.flush)
+
+    # Hands everything recorded so far to the executor, to be written in one go.
+    def flush(self):
+        if self.commit_handle is not None:
+            self.commit_handle.cancel()
+            self.commit_handle = None
+        if self.executor is None or len(self.pending) == 0:
+            return
+        batch, self.pending = self.pending, []
+        write = self.write if self.metrics is None else self.metrics.timed('journal', self.write)
+        self.executor.submit(write, batch).add_done_callback(self.check_write)
+
+    def check_write(self, future):
+        if future.exception() is not None:
+            logger.error(f"Couldn't write to the state journal: {future.exception()}")
+
+    def write(self, batch):
+        self.db.executemany("insert into journal(kind, owner, guest, data) values (?,?,?,?)",
+            [(kind.value, owner, guest, json.dumps(data) if data else None) for kind, owner, guest, data in batch])
+        self.db.commit()
+        self.appended += len(batch)
+        if self.appended >= self.compact_every:
+            self.compact()
+
+    def replay(self):
+        row = self.db.execute("select upto, state from journal_snapshot where id = 0").fetchone()
+        upto, state = (row[0], parse(row[1])) if row is not None else (0, empty_state())
+        for seq, kind, owner, guest, data in self.db.execute("select seq, kind, owner, guest, data from journal where seq > ? order by seq", (upto,)):
+            apply(state, Entry(kind), owner, guest, json.loads(data) if data else None)
+            upto = seq
+        return upto, state
+
+    def load(self):
+        _, state = self.replay()
+        return state
+
+    # Other workers may be appending or compacting at the same time, so the snapshot is read and
+    # replaced under a write lock; otherwise an older snapshot could overwrite a newer one.
+    def compact(self):
+        self.db.execute("begin immediate")
+        upto, state = self.replay()
+        self.db.execute("replace into journal_snapshot(id, upto, state) values (0, ?, ?)", (upto, dump(state)))
+        self.db.execute("delete from journal where seq <= ?", (upto,))
+        self.db.commit()
+        self.appended = 0
+        logger.info(f"Compacted the state journal up to entry {upto}")
@@ -2,8 +2,15 @@ import inspect
 import discord
 from discord.utils import get
 from discord.ext import commands
-import sqlite3
 import lloidbot.turnips as turnips
+from lloidbot.storage import AsyncMarket
+from lloidbot.partition import Partition, parse_announce_ids, chan_for
+from lloidbot import fanout, prediction, market_stats, metrics
+from lloidbot.dispatcher import OutboundDispatcher, Priority
+from lloidbot.delivery import DeliveryQueue
+from lloidbot.journal import StateJournal, Entry, depart, forget_departures
+from lloidbot.trace import TraceRecorder
+from lloidbot.workers import Workers, message_payload, shards_for, supervise
 import asyncio
 import sys
 from dotenv import load_dotenv
@@ -13,11 +20,12 @@ import sentry_sdk
 import logging
 import argparse
 import typing
+import time
+import datetime
 
 queue = []
 queue_interval_minutes = 10
 queue_interval = 60 * queue_interval_minutes
-poll_sleep_interval = 5
 logger = logging.getLogger('lloid')
 
 class GeneralCommands(commands.Cog):
@@ -27,22 +35,17 @@ class GeneralCommands(commands.Cog):
     @commands.command()
     async def queueinfo(self, ctx):
         guest = ctx.message.author.id
-        if guest not in self.bot.market.queue.requesters:
+        partition = self.bot.line_of(guest)
+        if partition is None:
             await ctx.send("You don't seem to be queued up for anything. "
             "It could also be that the code got sent to you just now. Please check your DMs.")
             return
-        owner = self.bot.market.queue.requesters[guest]
-        q = self.bot.market.queue.queues[owner]
-        qsize = len(q)
-        index = -1
-        try:
-            index = [qq[0] for qq in q].index(guest)
-        except:
-            pass
+        position = partition.market.queue.position(guest)
 
-        if index < 0:
+        if position is None:
             await ctx.send("You don't seem to be queued up for anything.")
         else:
+            owner, index, qsize = position
             index += 1
 
             addendum = "Position 1 means you're next, and will be receiving a DM to notify you to get ready. Please note that if the host lets multiple people in at once, you may get the warning notification and the code at the same time."
@@ -51,10 +54,32 @@ class GeneralCommands(commands.Cog):
 
             await ctx.send(f"Your position in the queue is {index} in a queue of {qsize} people. {addendum}\n")
             if owner in self.bot.is_paused and self.bot.is_paused[owner]:
-                wait = (1+self.bot.requested_pauses[owner])*queue_interval_minutes
+                wait = max(1, round(self.bot.remaining_wait(owner) / 60))
                 await ctx.send(f"Just so you know, the host asked me to hold off on giving out codes for roughly another {wait} minutes or so, so don't be surprised if your queue number doesn't change for a while. "
                     "They can cancel this waiting period at any time, so you won't necessarily be waiting that long.")
     
+    @commands.command()
+    async def market(self, ctx):
+        partition = self.bot.partition_for(ctx)
+        if partition is None:
+            await ctx.send("I don't track a market here.")
+            return
+        stats = market_stats.compute(partition.market.listings.values(), open_owners=partition.market.queue.queues)
+        week = turnips.week_number(turnips.current_datetime(0))
+        bests = await partition.market.run(partition.market.weekly_bests, week - 4)
+        await ctx.send(f">>> {market_stats.describe(stats, market_stats.week_over_week(bests))}")
+
+    @commands.command()
+    async def stats(self, ctx):
+        if ctx.author.id not in self.bot.admins:
+            await ctx.send("Sorry, that's only for the people running me.")
+            return
+        if self.bot.metrics is None:
+            await ctx.send("Metrics are turned off. Set METRICS_PORT to turn them on.")
+            return
+        self.bot.metrics.collect()
+        await ctx.send(f">>> {metrics.describe(self.bot.metrics)}")
+
 class DMCommands(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
@@ -65,47 +90,59 @@ class DMCommands(commands.Cog):
 
     @commands.command()
     async def close(self, ctx):
-        if ctx.author.id not in self.bot.market.queue.queues:
+        partition = self.bot.hosting.get(ctx.author.id)
+        if partition is None or ctx.author.id not in partition.market.queue.queues:
             await ctx.send("You don't seem to have a market open.")
             return
+        self.bot.traced('close', ctx.author.id)
         await ctx.send("Thanks for responsibly closing your doors! I'll give my condolences to the people still in line, if any.")
-        denied, status = self.bot.market.close(ctx.author.id)
+        denied, status = partition.market.close(ctx.author.id)
         if status == turnips.Status.SUCCESS:
-            for d in denied:
-                await self.bot.get_user(d).send("Apologies, but it looks like the person you were waiting for closed up.")
+            del self.bot.hosting[ctx.author.id]
+            self.bot.loop.create_task(self.bot.notify(denied,
+                "Apologies, but it looks like the person you were waiting for closed up.", f"{ctx.author.name} closing", partition.guild_id))
             await self.bot.associated_message[ctx.author.id].delete()
+            self.bot.journal.record(Entry.DELETED, message=self.bot.associated_message[ctx.author.id].id)
             del self.bot.associated_user[self.bot.associated_message[ctx.author.id].id]
             del self.bot.associated_message[ctx.author.id]
             if ctx.author.id in self.bot.requested_pauses:
                 del self.bot.requested_pauses[ctx.author.id]
+            self.bot.cancel_cooldown(partition, ctx.author.id)
+            self.bot.deliveries.cancel_owner(ctx.author.id)
 
     @commands.command()
     async def done(self, ctx):
         guest = ctx.author.id
+        self.bot.traced('done', guest)
         owner = self.bot.recently_departed.pop(guest, None)
+        if owner is not None:
+            self.bot.journal.record(Entry.DONE, guest=guest)
 
         if owner in self.bot.is_paused and self.bot.is_paused[owner]:
             await ctx.send("Thanks for the heads-up! "
             "The queue is actually paused at the moment, so the host will be the one to let the next person in.")
             return
-        if owner is not None and owner in self.bot.sleepers:
+        partition = self.bot.hosting.get(owner)
+        if partition is not None and owner in partition.scheduler:
             logger.info("Visitor done, cancelling timer")
-            self.bot.sleepers[owner].cancel()
+            self.bot.cancel_cooldown(partition, owner)
             logger.info("Timer cancelled, thanking visitor")
             await ctx.send("Thanks for the heads-up! Letting the next person in now.")
         elif owner is not None:
             owner_name = self.bot.get_user(owner).name
-            logger.info(f"Visitor marked themselves as done, but owner {owner_name} was not in sleepers")
+            logger.info(f"Visitor marked themselves as done, but owner {owner_name} had no timer running")
             await ctx.send("Thanks for the heads-up! Letting the next person in now.")
 
     @commands.command()
     async def next(self, ctx):
-        if self.bot.market.has_listing(ctx.message.author.id):
+        partition = self.bot.hosting.get(ctx.message.author.id)
+        if partition is not None and partition.market.has_listing(ctx.message.author.id):
+            self.bot.traced('next', ctx.message.author.id)
             await ctx.send("Okay, letting the next person in.")
             self.bot.requested_pauses[ctx.message.author.id] = 0
-            if ctx.message.author.id in self.bot.sleepers:
-                self.bot.sleepers[ctx.message.author.id].cancel()
-            else:
+            self.bot.save_pauses(ctx.message.author.id)
+            self.bot.wake(ctx.message.author.id)
+            if not self.bot.cancel_cooldown(partition, ctx.message.author.id):
                 owner_name = self.bot.get_user(ctx.message.author.id).name
                 logger.debug(f"{owner_name} tried sending in the next one, but there were no timers to cancel.")
             return
@@ -114,14 +151,23 @@ class DMCommands(commands.Cog):
     
     @commands.command()
     async def pause(self, ctx):
-        if ctx.author.id in self.bot.market.queue.queues:
-            if self.bot.market.has_listing(ctx.author.id):
+        partition = self.bot.hosting.get(ctx.author.id)
+        if partition is not None and ctx.author.id in partition.market.queue.queues:
+            if partition.market.has_listing(ctx.author.id):
+                self.bot.traced('pause', ctx.author.id)
                 await ctx.send(f"Okay, extending waiting period by another {queue_interval // 60} minutes. "
                 "You can cancel this by letting the next person in with **next**.\n")
                 self.bot.is_paused[ctx.author.id] = True
-                if ctx.author.id not in self.bot.requested_pauses:
-                    self.bot.requested_pauses[ctx.author.id] = 0
-                self.bot.requested_pauses[ctx.author.id] += 1
+                # If a cooldown is already running, just push its deadline back. Otherwise the
+                # dispensing loop will pick up the pause the next time it comes around.
+                if partition.scheduler.extend(ctx.author.id, queue_interval):
+                    self.bot.save_deadline(ctx.author.id)
+                else:
+                    if ctx.author.id not in self.bot.requested_pauses:
+                        self.bot.requested_pauses[ctx.author.id] = 0
+                    self.bot.requested_pauses[ctx.author.id] += 1
+                    self.bot.wake(ctx.author.id)
+                self.bot.save_pauses(ctx.author.id)
                 return
             else:
                 await ctx.send("If you want to move to the back of the line, unqueue and requeue. "
@@ -133,48 +179,56 @@ class DMCommands(commands.Cog):
         if not re.match(r'[A-HJ-NP-Y0-9]{5}', dodo, re.IGNORECASE):
             await ctx.send(f"This dodo code appears to be invalid. Please make sure to check the length and characters used.")
             return
+        if abs(price) > turnips.Turnip.MAX_PRICE:
+            await ctx.send(f"That price is a bit much, even for a placeholder. Please pick one under {turnips.Turnip.MAX_PRICE:,}.")
+            return
+
+        partition = self.bot.hosting.get(ctx.author.id) or self.bot.host_partition(ctx.author.id)
+        if partition is None:
+            names = ", ".join(f"**{name}**" for name in self.bot.server_names(ctx.author.id))
+            await ctx.send(f"You're in more than one server I announce listings in ({names}). "
+                "Please tell me which one to post in with **server** followed by the server's name, then try again.")
+            return
 
-        res = self.bot.market.declare(ctx.author.id, ctx.author.name, price, dodo, tz)
+        self.bot.traced('host', ctx.author.id, guild=partition.guild_id, name=ctx.author.name, price=price, dodo=dodo, tz=tz, desc=description)
+        res = await partition.market.declare(ctx.author.id, ctx.author.name, price, dodo, tz)
         if res == turnips.Status.ALREADY_OPEN:
             desc = ""
             if description is not None and description.strip() != "":
                 self.bot.descriptions[ctx.author.id] = description
+                self.bot.journal.record(Entry.DESCRIPTION, ctx.author.id, text=description)
                 desc = f"\n**{ctx.author.name}** adds: {description}"
             await ctx.send("Updated your info. Anyone still in line will get the updated codes, but if anyone got your old code while you were busy creating a new one, they'll need to reach out to you privately.")
  
             if ctx.author.id in self.bot.associated_message:
                 msg = self.bot.associated_message[ctx.author.id]
-                turnip = self.bot.market.get(ctx.author.id)
-                await msg.edit(content=
+                turnip = await partition.market.get(ctx.author.id)
+                await self.bot.outbound.send(Priority.LISTING_EDIT, ('channel', msg.channel.id), guild=partition.guild_id, action=lambda: msg.edit(content=
                     f">>> **{ctx.author.name}** has turnips selling for **{price}**. "
                     f'Local time: **{turnip.current_time().strftime("%a, %I:%M %p")}**. '
-                    f"React to this message with 🦝 to be queued up for a code. {desc}")
+                    f"{self.bot.forecast(turnip)} "
+                    f"React to this message with 🦝 to be queued up for a code. {desc}"))
         elif res == turnips.Status.SUCCESS:
-            if ctx.author.id in self.bot.sleepers:
-                logger.info("Owner has previous outstanding timers. Cancelling them now.")
-                self.bot.sleepers[ctx.author.id].cancel()
+            self.bot.hosting[ctx.author.id] = partition
+            if self.bot.cancel_cooldown(partition, ctx.author.id):
+                logger.info("Owner had a previous outstanding timer. Cancelled it.")
             self.bot.requested_pauses[ctx.author.id] = 0
+            self.bot.save_pauses(ctx.author.id)
             await ctx.send("Okay! Please be responsible and message \"**close**\" to indicate when you've closed. "
             "You can update the dodo code with the normal syntax. \n\n"
             f"Messaging me \"**pause**\" will extend the cooldown timer by {queue_interval // 60} minutes each time. This stacks, so if you want me to wait {queue_interval // 30} minutes, just message me pause twice, and so on.\n\n"
             "You can also let the next person in and reset the timer to normal by messaging me \"**next**\".\n"
             "To edit the listing, simply send the same command with the updated info. If all you're changing is your dodo code, `host price xdodo` will suffice. Nobody will have to requeue to receive updated codes, but they'll have to reach out to you if you changed your code after they received an old one.")
             
-            turnip = self.bot.market.get(ctx.author.id)
+            turnip = await partition.market.get(ctx.author.id)
             
-            desc = ""
             if description is not None and description.strip() != "":
                 self.bot.descriptions[ctx.author.id] = description
-                desc = f"\n**{ctx.author.name}** adds: {description}"
+                self.bot.journal.record(Entry.DESCRIPTION, ctx.author.id, text=description)
 
-            msg = await self.bot.report_channel.send(f">>> **{turnip.name}** has turnips selling for **{turnip.current_price()}**. "
-            f'Local time: **{turnip.current_time().strftime("%a, %I:%M %p")}**. '
-            f"React to this message with 🦝 to be queued up for a code. {desc}")
-            await msg.add_reaction('🦝')
-            self.bot.associated_user[msg.id] = ctx.author.id
-            self.bot.associated_message[ctx.author.id] = msg
+            await self.bot.post_listing(partition, turnip, description)
 
-            self.bot.loop.create_task(self.bot.queue_manager(ctx.author.id))
+            self.bot.loop.create_task(self.bot.queue_manager(partition, ctx.author.id))
         elif res == turnips.Status.TIMEZONE_REQUIRED:
             await ctx.send(("This seems to be your first time setting turnips, "
             "so you'll need to provide both a dodo code and a GMT offset (just a positive or negative integer). "
@@ -190,6 +244,28 @@ class DMCommands(commands.Cog):
         elif res == turnips.Status.CLOSED:
             logger.info("This message should no longer be reachable (status = closed)")
     
+    @commands.command()
+    async def predict(self, ctx):
+        partition = self.bot.hosting.get(ctx.author.id) or self.bot.host_partition(ctx.author.id)
+        turnip = await partition.market.get(ctx.author.id) if partition is not None else None
+        if turnip is None or turnip.gmtoffset is None or all(p is None for p in turnip.history):
+            await ctx.send("I don't have any of your prices for this week yet. Tell me with **host** and I'll take a guess.")
+            return
+        interval, _ = turnips.compute_current_interval(turnip.gmtoffset)
+        await ctx.send(f"Here's my best guess at how your week will go:\n>>> {prediction.describe(prediction.predict(turnip.history), turnips.intervals[interval] + 1)}")
+
+    @commands.command()
+    async def server(self, ctx, *, name = None):
+        partitions = self.bot.mutual_partitions(ctx.author.id)
+        matches = [p for p in partitions if name is not None and p.channel.guild.name.lower() == name.strip().lower()]
+        if len(matches) == 0:
+            names = ", ".join(f"**{n}**" for n in self.bot.server_names(ctx.author.id))
+            await ctx.send(f"Which server? You can pick from: {names}")
+            return
+        self.bot.preferred_guild[ctx.author.id] = matches[0].guild_id
+        await ctx.send(f"Okay! Your listings will be posted in **{matches[0].channel.guild.name}**. "
+            "This takes effect the next time you open; a listing that's already open stays where it is.")
+
     @host.error
     async def host_error(self, ctx, error):
         logger.info(f"Invalid command received: {ctx.message.content}")
@@ -206,19 +282,44 @@ Explanation:
 `Brewster is in town selling infinite durability axes` is a description you want to attach. You aren't required to provide one.
             """)
 
-class Lloid(commands.Bot):
+class Lloid(commands.AutoShardedBot):
     Successful = 0
     AlreadyClosed = 1
     QueueEmpty = 2
 
-    def __init__(self):
-        super().__init__(command_prefix=self.get_prefix, case_insensitive=True)
-
+    # `options` go to discord.py, eg: shard_ids and shard_count for a worker's share of the shards.
+    def __init__(self, **options):
+        intents = discord.Intents.default()
+        intents.members = True # to know which of our servers a host is in
+        intents.message_content = True
+        super().__init__(command_prefix=self.get_prefix, case_insensitive=True, intents=intents, **options)
+        self.trace = None # a TraceRecorder, if TRACE_FILE is set
+        self.metrics = None # a Metrics, if METRICS_PORT is set
+        self.metrics_port = None
+        self.admins = set() # ids of the users allowed to use admin commands, from ADMIN_IDS
+        self.legacy_guild = None # id of the server that takes over the listings from before there were several, from LEGACY_GUILD_ID
+        self.workers = None # the other worker processes, if WORKERS is set (see workers.py)
+        self.remote_guilds = {} # user -> [guild id, name] of the servers they share with other workers, as of their last command
+
+    async def setup_hook(self):
         # Automatically discover cogs
         members = inspect.getmembers(sys.modules[__name__], inspect.isclass)
         for _, Member in members:
             if issubclass(Member, commands.Cog):
-                self.add_cog(Member(self))
+                await self.add_cog(Member(self))
+        if self.metrics is not None and self.metrics_port is not None:
+            await self.metrics.serve(self.metrics_port)
+        if self.workers is not None:
+            await self.workers.start()
+
+    # Commits whatever the journal has batched up before disconnecting.
+    async def close(self):
+        if getattr(self, 'journal', None) is not None and self.journal.executor is not None:
+            self.journal.flush()
+            await asyncio.get_event_loop().run_in_executor(self.journal.executor, lambda: None)
+        if self.workers is not None:
+            await self.workers.stop()
+        await super().close()
 
     async def get_prefix(self, message):
         if not message.guild:
@@ -252,81 +353,354 @@ Explanation:
         logger.info('Logged on as {0}!'.format(self.user))
         if self.initialized is None or not self.initialized:
             logger.info("Initializing.")
+            started = time.perf_counter()
             self.initialized = True
-            self.report_channel = self.get_channel(int(os.getenv("ANNOUNCE_ID")))
-            self.chan = 'global'
-            self.db = sqlite3.connect("test.db") 
-            self.market = turnips.StalkMarket(self.db)
-            self.associated_user = {} # message id -> id of the user the message is about
-            self.associated_message = {} # reverse mapping of the above
-            self.sleepers = {}
-            self.recently_departed = {}
-            self.requested_pauses = {} # owner -> int representing number of requested pauses remaining 
-            self.is_paused = {} # owner -> boolean
-            self.descriptions = {} # owner -> description
-
-            deleted = await self.report_channel.purge(check=lambda m: m.author==self.user)
-            num_del = len(deleted)
-            logger.info(f"Initialized. Deleted {num_del} old messages.")
+            self.partitions = {} # guild id -> Partition
+            self.hosting = {} # owner -> Partition their listing is open in
+            self.preferred_guild = {} # owner -> guild id they asked to post in
+            self.db, executor = await AsyncMarket.connect("test.db", shared=self.workers is not None)
+            for channel_id in parse_announce_ids(os.getenv("ANNOUNCE_ID")):
+                channel = self.get_channel(channel_id)
+                if channel is None and self.workers is not None:
+                    logger.info(f"Announce channel {channel_id} isn't on this worker's shards, or can't be seen; skipping it")
+                    continue
+                elif channel is None:
+                    logger.error(f"Can't see announce channel {channel_id}, skipping it")
+                    continue
+                chan = chan_for(channel.guild.id)
+                adopt = turnips.default_chan if channel.guild.id == self.legacy_guild else None
+                self.add_partition(channel, await AsyncMarket.on(self.db, executor, chan, adopt))
+            loop = asyncio.get_event_loop()
+            self.journal = await loop.run_in_executor(executor, StateJournal, self.db, executor)
+            self.journal.metrics = self.metrics
+            self.init_state()
+
+            state = await loop.run_in_executor(executor, self.journal.load)
+            await self.restore(state)
+            await self.wipe_old_prices() # catches up on any week that started while we were down
+
+            self.loop.create_task(self.weekly_reset())
+
+            num_del = await self.delete_stale_listings({m: c for m, c in state['messages'].items() if m not in self.associated_user})
+            logger.info(f"Initialized in {time.perf_counter() - started:.2f}s. Deleted {num_del} old messages.")
         logger.info(f"Sample data to verify data integrity: {self.associated_user}")
 
-    async def on_raw_reaction_add(self, payload, allow_new=None):
-        channel = self.get_channel(payload.channel_id)
-        message = await channel.fetch_message(payload.message_id)
-        user = await self.fetch_user(payload.user_id)
+    def add_partition(self, channel, market):
+        partition = Partition(channel.guild.id, channel, market)
+        market.metrics = self.metrics
+        market.queue.add_listener(lambda event, owner, guest: self.on_queue_event(partition, event, owner, guest))
+        self.partitions[channel.guild.id] = partition
+        logger.info(f"Announcing listings for {channel.guild.name} in #{channel.name}, stored under {market.chan}")
+        return partition
+
+    # Everything besides the partitions and the journal that the handlers below rely on.
+    def init_state(self):
+        self.associated_user = {} # message id -> id of the user the message is about
+        self.associated_message = {} # reverse mapping of the above
+        self.recently_departed = {}
+        self.requested_pauses = {} # owner -> number of requested pauses not yet added to a cooldown
+        self.is_paused = {} # owner -> boolean
+        self.descriptions = {} # owner -> description
+        self.wakeups = {} # owner -> asyncio.Event set whenever their dispensing loop has something to do
+        self.outbound = OutboundDispatcher()
+        self.outbound.start()
+        self.deliveries = DeliveryQueue()
+
+    def forecast(self, turnip):
+        interval, _ = turnips.compute_current_interval(turnip.gmtoffset)
+        return prediction.summary(prediction.predict(turnip.history), turnips.intervals[interval] + 1)
+
+    # The partition a command is about: the server it was sent in, or for DMs, the sender's.
+    def partition_for(self, ctx):
+        if ctx.guild is not None:
+            return self.partitions.get(ctx.guild.id)
+        return self.hosting.get(ctx.author.id) or self.host_partition(ctx.author.id) or next(iter(self.partitions.values()), None)
+
+    # The partitions of the servers that both we and the user are in.
+    def mutual_partitions(self, user_id):
+        return [p for p in self.partitions.values() if p.channel.guild.get_member(user_id) is not None]
+
+    # The names of the servers both we and the user are in, including other workers' servers.
+    def server_names(self, user_id):
+        return [p.channel.guild.name for p in self.mutual_partitions(user_id)] + [name for _, name in self.remote_guilds.get(user_id, [])]
+
+    # Where a new listing from the owner should go: the server they picked with the server
+    # command, or the only one they share with us. None if it's ambiguous.
+    def host_partition(self, owner):
+        if owner in self.preferred_guild and self.preferred_guild[owner] in self.partitions:
+            return self.partitions[self.preferred_guild[owner]]
+        elsewhere = len(self.remote_guilds.get(owner, []))
+        if len(self.partitions) == 1 and elsewhere == 0:
+            return next(iter(self.partitions.values()))
+        mutual = self.mutual_partitions(owner)
+        return mutual[0] if len(mutual) == 1 and elsewhere == 0 else None
+
+    def remember_remote_guilds(self, user_id, guilds):
+        if len(guilds) > 0:
+            self.remote_guilds[user_id] = guilds
+        else:
+            self.remote_guilds.pop(user_id, None)
+
+    # The partition whose line the guest is waiting in, if any. A guest can only be in one line.
+    def line_of(self, guest):
+        for partition in self.partitions.values():
+            if guest in partition.market.queue.requesters:
+                return partition
+        return None
+
+    async def post_listing(self, partition, turnip, description=None):
+        desc = ""
+        if description is not None and description.strip() != "":
+            desc = f"\n**{turnip.name}** adds: {description}"
+
+        channel = partition.channel
+        msg = await self.outbound.send(Priority.LISTING_EDIT, ('channel', channel.id), guild=partition.guild_id, action=lambda: channel.send(
+            f">>> **{turnip.name}** has turnips selling for **{turnip.current_price()}**. "
+            f'Local time: **{turnip.current_time().strftime("%a, %I:%M %p")}**. '
+            f"{self.forecast(turnip)} "
+            f"React to this message with 🦝 to be queued up for a code. {desc}"))
+        await self.outbound.send(Priority.LISTING_EDIT, ('channel', channel.id), lambda: msg.add_reaction('🦝'), partition.guild_id)
+        self.associated_user[msg.id] = turnip.id
+        self.associated_message[turnip.id] = msg
+        self.journal.record(Entry.POSTED, turnip.id, message=msg.id, channel=channel.id)
+        return msg
+
+    async def restore(self, state):
+        # Puts every open listing back the way it was before the restart: the line, pauses, the
+        # listing message (reposting it if it's gone), and the cooldown with whatever time it had left.
+        for owner, listing in state['listings'].items():
+            partition = self.partitions.get(listing['guild'])
+            if partition is None and listing['channel'] is not None and self.get_channel(listing['channel']) is not None:
+                partition = self.partitions.get(self.get_channel(listing['channel']).guild.id)
+            if partition is None and self.workers is not None and listing['guild'] is not None and not self.workers.owns(listing['guild']):
+                continue # another worker's
+            elif partition is None:
+                logger.warning(f"Listing for {owner} was in a server we no longer announce in; dropping it.")
+                continue
+            self.hosting[owner] = partition
+            partition.market.queue.restore(owner, listing['guests'])
+            self.requested_pauses[owner] = listing['requested_pauses']
+            self.is_paused[owner] = listing['paused']
+            if listing['description'] is not None:
+                self.descriptions[owner] = listing['description']
+
+            msg = None
+            if listing['message'] is not None:
+                try:
+                    msg = await self.get_channel(listing['channel']).fetch_message(listing['message'])
+                except discord.NotFound:
+                    logger.warning(f"The listing message for {owner} is gone, reposting it.")
+                    self.journal.record(Entry.DELETED, message=listing['message'])
+                except (AttributeError, discord.HTTPException) as ex:
+                    logger.warning(f"Couldn't find the listing message for {owner}, reposting it. Error was {ex}")
+            if msg is None:
+                await self.post_listing(partition, await partition.market.get(owner), listing['description'])
+            else:
+                self.associated_user[msg.id] = owner
+                self.associated_message[owner] = msg
+
+            remaining = None
+            if listing['deadline'] is not None:
+                remaining = max(0, listing['deadline'] - time.time())
+            self.loop.create_task(self.queue_manager(partition, owner, remaining))
+        # Departures from listings that weren't restored here are another worker's, or gone.
+        self.recently_departed.update({guest: owner for guest, owner in state['departed'].items() if owner in self.hosting})
+        logger.info(f"Restored {len(self.hosting)} listings")
+
+    # Deletes listing messages left over from before a restart (closed listings whose message
+    # never got deleted, and so on). Discord only bulk deletes messages under two weeks old, up
+    # to 100 at a time; anything older has to go one by one. Returns how many were deleted.
+    async def delete_stale_listings(self, messages):
+        by_channel = {}
+        for message, channel in messages.items():
+            by_channel.setdefault(channel, []).append(message)
+
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=13, hours=23)
+        deleted = 0
+        for channel_id, ids in by_channel.items():
+            channel = self.get_channel(channel_id)
+            if channel is None and self.workers is not None:
+                continue # most likely another worker's, and it cleans up its own
+            elif channel is None:
+                logger.warning(f"Can't see channel {channel_id} anymore; forgetting {len(ids)} listing messages in it.")
+                for message in ids:
+                    self.journal.record(Entry.DELETED, message=message)
+                continue
+
+            recent = [m for m in ids if discord.utils.snowflake_time(m) > cutoff]
+            old = [m for m in ids if m not in recent]
+            for i in range(0, len(recent), 100):
+                chunk = recent[i:i+100]
+                try:
+                    await channel.delete_messages([discord.Object(id=m) for m in chunk])
+                except discord.NotFound:
+                    # Bulk deletes fail outright if one of the messages is already gone.
+                    old.extend(chunk)
+                    continue
+                except discord.HTTPException as ex:
+                    logger.warning(f"Couldn't bulk delete {len(chunk)} listing messages in {channel_id}. Error was {ex}")
+                    continue
+                for message in chunk:
+                    self.journal.record(Entry.DELETED, message=message)
+                deleted += len(chunk)
+
+            for message in old:
+                try:
+                    await channel.get_partial_message(message).delete()
+                    deleted += 1
+                except discord.NotFound:
+                    pass
+                except discord.HTTPException as ex:
+                    logger.warning(f"Couldn't delete listing message {message}. Error was {ex}")
+                    continue
+                self.journal.record(Entry.DELETED, message=message)
+        return deleted
+
+    # Every inbound event the bot acts on comes through here.
+    def traced(self, event, user, **data):
+        if self.trace is not None:
+            self.trace.record(event, user, **data)
+        if self.metrics is not None:
+            self.metrics.events.inc(event)
+
+    # Turns metrics on (see metrics.py), including for the partitions and journal if there already are some.
+    def enable_metrics(self, metrics):
+        self.metrics = metrics
+        metrics.collectors.append(self.collect_metrics)
+        for partition in getattr(self, 'partitions', {}).values():
+            partition.market.metrics = metrics
+        if getattr(self, 'journal', None) is not None:
+            self.journal.metrics = metrics
+
+    # Copies over what's already tallied elsewhere.
+    def collect_metrics(self, metrics):
+        if getattr(self, 'deliveries', None) is None: # not ready yet
+            return
+        metrics.open_listings.clear()
+        metrics.queue_length.clear()
+        for partition in self.partitions.values():
+            queues = partition.market.queue.queues
+            metrics.open_listings.set(len(queues), partition.guild_id)
+            for owner, line in queues.items():
+                metrics.queue_length.set(len(line), partition.guild_id, owner)
+            metrics.cooldowns.set(len(partition.scheduler), partition.guild_id)
+            metrics.cache_lookups.set(partition.market.hits, partition.guild_id, 'hit')
+            metrics.cache_lookups.set(partition.market.misses, partition.guild_id, 'miss')
+        for priority, stats in self.outbound.stats().items():
+            metrics.outbound_depth.set(stats['depth'], priority)
+            metrics.outbound_sent.set(stats['sent'], priority)
+        deliveries = self.deliveries.stats()
+        metrics.deliveries_pending.set(deliveries.pop('pending'))
+        for outcome, count in deliveries.items():
+            metrics.deliveries.set(count, outcome)
+
+    def save_pauses(self, owner):
+        self.journal.record(Entry.PAUSES, owner, requested=self.requested_pauses.get(owner, 0), paused=self.is_paused.get(owner, False))
+
+    def save_deadline(self, owner):
+        remaining = self.hosting[owner].scheduler.remaining(owner)
+        self.journal.record(Entry.DEADLINE, owner, at=None if remaining is None else time.time() + remaining)
+
+    # Cuts the owner's cooldown short, journalling that there isn't one any more so that a restart
+    # doesn't resume it. Returns whether there was one to cut short.
+    def cancel_cooldown(self, partition, owner):
+        cancelled = partition.scheduler.cancel(owner)
+        self.journal.record(Entry.DEADLINE, owner, at=None)
+        return cancelled
 
-        if user == self.user or message.author != self.user:
+    async def on_raw_reaction_add(self, payload, allow_new=None):
+        # Most reactions have nothing to do with us, so weed them out using only what's in the
+        # payload. Listing messages are always ours, so there's no need to fetch the message either.
+        if payload.emoji.name != '🦝' or payload.message_id not in self.associated_user or payload.user_id == self.user.id:
+            return
+        partition = self.partitions.get(payload.guild_id)
+        if partition is None:
             return
 
-        if payload.emoji.name == '🦝':
-            logger.debug(f"{user.name} reacted with raccoon")
-            try:
-                await self.queue_user(payload.message_id, user)
-            except:
-                logger.warning(f"User {user.name} tried to queue up, but isn't allowing DMs.")
-                self.market.forfeit(user.id)
-                await message.remove_reaction('🦝', user)
+        # Take their place in line before awaiting anything, so the line is in the order the
+        # gateway delivered the reactions rather than the order some HTTP calls happened to finish.
+        # The only exception is asking the other workers, if there are any, whether the guest is in
+        # line there; they answer in the order they're asked, so that doesn't reorder anyone.
+        owner = self.associated_user[payload.message_id]
+        self.traced('react', payload.user_id, owner=owner, guild=payload.guild_id)
+        queued, size = False, None
+        elsewhere = self.workers is not None and self.line_of(payload.user_id) is None and await self.workers.in_line_elsewhere(payload.user_id)
+        if self.line_of(payload.user_id) is None and not elsewhere:
+            queued, size = partition.market.request(payload.user_id, owner)
+
+        user = await self.resolve_user(payload.user_id, getattr(payload, 'member', None))
+        logger.debug(f"{user.name} reacted with raccoon")
+        try:
+            await self.queue_user(owner, user, queued, size, partition.guild_id)
+        except:
+            logger.warning(f"User {user.name} tried to queue up, but isn't allowing DMs.")
+            if queued:
+                partition.market.forfeit(user.id)
+            await self.associated_message[owner].remove_reaction('🦝', user)
 
     async def on_raw_reaction_remove(self, payload, allow_new=None):
-        if payload.emoji.name == '🦝' and payload.message_id in self.associated_user and payload.user_id in self.market.queue.requesters:
-            user = await self.fetch_user(payload.user_id)
-            logger.debug(f"{user.name} unreacted with raccoon")
-            owner_name = self.get_user(self.associated_user[payload.message_id]).name
-            waiting_for = self.market.queue.requesters[payload.user_id]
-            if waiting_for == self.associated_user[payload.message_id] and self.market.forfeit(payload.user_id):
-                await user.send("Removed you from the queue for %s." % owner_name)
-
-    async def queue_user(self, message_id, user):
-        if message_id in self.associated_user:
-            status, size = self.market.request(user.id, self.associated_user[message_id])
-            if status:
-                owner_name = self.get_user(self.associated_user[message_id]).name
-                logger.info(f"queued {user.name} up for {owner_name}")
-
-                if size == 0:
-                    size = 1
-                interval_s = queue_interval * (size - 1) // 60
-                interval_e = queue_interval * size // 60
-                await user.send(f"Queued you up for a dodo code for {owner_name}. Estimated time: {interval_s}-{interval_e} minutes, give or take "
-                f"(it waits {queue_interval_minutes} minutes for each person before letting someone in, but the people ahead of you may finish early and let you in earlier). "
-                "If you want to queue up elsewhere, or if you have to go, just unreact and it'll free you up.\n\n"
-                "⚠️*ETIQUETTE - PLEASE READ*⚠️\n\n"
-                "In the meantime, please be aware of common courtesy--**if you leave the island, please requeue if you plan to come back for any reason!** "
-                "Also, a lot of people might be ahead of you, so **go in, do the one thing you're there for, and leave**. "
-                "If you're there to sell turnips, don't look for Saharah or shop at Nook's! And please, **DO NOT USE the minus (-) button to exit!** "
-                "There are reports that exiting via minus button can result in people getting booted without their loot getting saved, and even save corruption. Use the airport!")
-            else:
-                await user.send("It sounds like either the market is now closed, or you're in line elsewhere at the moment.")
+        partition = self.partitions.get(payload.guild_id)
+        if partition is None:
+            return
+        market = partition.market
+        if payload.emoji.name == '🦝' and payload.message_id in self.associated_user and payload.user_id in market.queue.requesters:
+            waiting_for = market.queue.requesters[payload.user_id]
+            if waiting_for == self.associated_user[payload.message_id] and market.forfeit(payload.user_id):
+                self.traced('unreact', payload.user_id, owner=waiting_for, guild=payload.guild_id)
+                user = await self.resolve_user(payload.user_id)
+                logger.debug(f"{user.name} unreacted with raccoon")
+                owner_name = self.get_user(waiting_for).name
+                await self.dm(user, "Removed you from the queue for %s." % owner_name, Priority.QUEUE_CONFIRMATION, partition.guild_id)
+
+    async def notify(self, user_ids, content, reason, guild=None):
+        if len(user_ids) == 0:
+            return
+        result = await fanout.fan_out(self, user_ids, content, guild=guild)
+        logger.info(f"Notified {len(result)} users about {reason}: {result}")
+
+    # `guild` is the server the DM is on behalf of, so that servers take turns in the outbound queue.
+    async def dm(self, user, content, priority=Priority.NOTIFICATION, guild=None):
+        if self.metrics is not None:
+            return await self.outbound.send(priority, ('dm', user.id), lambda: self.metrics.timed_send(lambda: user.send(content)), guild)
+        return await self.outbound.send(priority, ('dm', user.id), lambda: user.send(content), guild)
+
+    async def resolve_user(self, user_id, member=None):
+        # Prefer what the gateway already told us, then the local cache, and only then ask the API.
+        if member is not None:
+            return member
+        user = self.get_user(user_id)
+        if user is None:
+            user = await self.fetch_user(user_id)
+        return user
+
+    async def queue_user(self, owner, user, queued, size, guild=None):
+        if queued:
+            owner_name = self.get_user(owner).name
+            logger.info(f"queued {user.name} up for {owner_name}")
+
+            if size == 0:
+                size = 1
+            interval_s = queue_interval * (size - 1) // 60
+            interval_e = queue_interval * size // 60
+            await self.dm(user, f"Queued you up for a dodo code for {owner_name}. Estimated time: {interval_s}-{interval_e} minutes, give or take "
+            f"(it waits {queue_interval_minutes} minutes for each person before letting someone in, but the people ahead of you may finish early and let you in earlier). "
+            "If you want to queue up elsewhere, or if you have to go, just unreact and it'll free you up.\n\n"
+            "⚠️*ETIQUETTE - PLEASE READ*⚠️\n\n"
+            "In the meantime, please be aware of common courtesy--**if you leave the island, please requeue if you plan to come back for any reason!** "
+            "Also, a lot of people might be ahead of you, so **go in, do the one thing you're there for, and leave**. "
+            "If you're there to sell turnips, don't look for Saharah or shop at Nook's! And please, **DO NOT USE the minus (-) button to exit!** "
+            "There are reports that exiting via minus button can result in people getting booted without their loot getting saved, and even save corruption. Use the airport!",
+            Priority.QUEUE_CONFIRMATION, guild)
         else:
-            k = self.associated_user.keys
-            logger.info(f"{message_id} was not found in {k}")
+            await self.dm(user, "It sounds like either the market is now closed, or you're in line elsewhere at the moment.", Priority.QUEUE_CONFIRMATION, guild)
 
     async def on_disconnect(self):
         logger.warning("Lloid got disconnected.")
 
-    async def let_next_person_in(self, owner):
+    # `due` is when the cooldown that led to this ran out, if one did.
+    async def let_next_person_in(self, partition, owner, due=None):
         task = None
-        task, status = self.market.next(owner)
+        task, status = partition.market.next(owner)
         if status == turnips.Status.QUEUE_EMPTY:
             return Lloid.QueueEmpty
         elif status == turnips.Status.ALREADY_CLOSED: # Then the owner closed
@@ -334,106 +708,169 @@ Explanation:
             return Lloid.AlreadyClosed
 
         logger.info(f"Letting {self.get_user(task[0]).name} in to {task[1].name}")
-        sent = False
-        exCount = 0
-        while not sent and exCount < 3:
-            msg = None
-            try:
-                msg = await self.get_user(task[0]).send(f"⭐⭐⭐ **NOW BOARDING** ⭐⭐⭐\n\nHope you enjoy your trip to **{task[1].name}**'s island! "
-                "Be polite, observe social distancing, leave a tip if you can, and **please be responsible and message me \"__done__\" when you've left "
-                "(unless the island already has a lot of visitors inside, in which case... don't bother)**. Doing this lets the next visitor in. "
-                f"The Dodo code is **{task[1].dodo}**.")
-                sent = True
-            except discord.Forbidden:
-                guest = self.get_user(task[0]).name
-                logger.warning(f"Guest {guest} doesn't seem to be allowing DMs. Skipping them.")
-                sent = True
-            except discord.HTTPException as httpEx:
-                guest = self.get_user(task[0]).name
-                owner = task[1].name
-                exCount += 1
-                logger.warning(f"Failed to send a code for {owner}'s island to {guest}. Trying again after 1 minute. Error was {httpEx}")
-                await asyncio.sleep(60)
+        # If this fails, the delivery queue keeps trying in the background while the line moves on.
+        msg = await self.deliveries.deliver(task[0], owner, lambda: self.send_code(partition, task[0], owner))
         if msg is None:
-            logger.error("Failed to let them in!")
+            logger.warning(f"Couldn't get the code to {task[0]} on the first try")
         else:
             logger.info(f"Sent out a code, message id is {msg.id}")
-        q = self.market.queue.queues[owner]
-        logger.info(f"Remainder in queue = {len(q)}")
-        if len(q) > 0:
-            logger.info(f"looking up {q[0][0]}")
-            next_in_line = self.get_user(q[0][0])
+            if self.metrics is not None and due is not None:
+                self.metrics.dispense_delay.observe(max(0, asyncio.get_event_loop().time() - due))
+        logger.info(f"{self.get_user(task[0]).name} has departed for {task[1].name}'s island")
+        depart(self.recently_departed, task[0], owner)
+        # The warning and the listing edit go out in the background, so the cooldown starts as soon
+        # as the code is out instead of waiting on lower priority messages.
+        self.loop.create_task(self.after_departure(partition, owner, task))
+        logger.debug("should have been successful")
+        return Lloid.Successful
+
+    # Warns whoever's next in line, and takes the departed guest's reaction off the listing.
+    async def after_departure(self, partition, owner, task):
+        q = partition.market.queue.queues.get(owner)
+        listing = self.associated_message.get(owner)
+        logger.info(f"Remainder in queue = {len(q) if q is not None else 0}")
+        if q is not None and len(q) > 0:
+            logger.info(f"looking up {q.peek()}")
+            next_in_line = self.get_user(q.peek())
             if next_in_line is not None:
                 logger.info(f"Sending warning to {next_in_line.name}")
-                await next_in_line.send(f"⚠️⚠️⚠️\nYour flight to **{task[1].name}**'s island is boarding soon! "
-                f"Please have your tickets ready, we'll be calling you forward some time in the next 0-{queue_interval_minutes} minutes!")
-                if owner in self.descriptions and self.descriptions is not None and self.descriptions[owner].strip() != "":
-                    desc = self.descriptions[owner]
-                    await next_in_line.send(f"By the way, here's the current description of the island, in case you need a review or in case it's been updated since you last viewed the listing:\n\n{desc}")
-        logger.info(f"{self.get_user(task[0]).name} has departed for {task[1].name}'s island")
-        self.recently_departed[task[0]] = owner
+                try:
+                    await self.dm(next_in_line, f"⚠️⚠️⚠️\nYour flight to **{task[1].name}**'s island is boarding soon! "
+                    f"Please have your tickets ready, we'll be calling you forward some time in the next 0-{queue_interval_minutes} minutes!", Priority.BOARDING_WARNING, partition.guild_id)
+                    if owner in self.descriptions and self.descriptions is not None and self.descriptions[owner].strip() != "":
+                        desc = self.descriptions[owner]
+                        await self.dm(next_in_line, f"By the way, here's the current description of the island, in case you need a review or in case it's been updated since you last viewed the listing:\n\n{desc}", Priority.BOARDING_WARNING, partition.guild_id)
+                except discord.HTTPException as ex:
+                    logger.warning(f"Couldn't warn {next_in_line.name} that they're next. Error was {ex}")
+        if listing is None:
+            return
         try:
-            await self.associated_message[owner].remove_reaction('🦝', self.get_user(task[0]))
+            await self.outbound.send(Priority.LISTING_EDIT, ('channel', listing.channel.id), lambda: listing.remove_reaction('🦝', self.get_user(task[0])), partition.guild_id)
         except Exception as ex:
             logger.warning("Couldn't remove reaction; error: %s" % ex)
 
-        logger.debug("should have been successful")
-        return Lloid.Successful
-
-    async def reset_sleep(self, owner):
+    async def send_code(self, partition, guest, owner):
+        # Looked up fresh each time, so a retried delivery carries the host's latest dodo code.
+        turnip = await partition.market.get(owner)
+        return await self.dm(self.get_user(guest), f"⭐⭐⭐ **NOW BOARDING** ⭐⭐⭐\n\nHope you enjoy your trip to **{turnip.name}**'s island! "
+            "Be polite, observe social distancing, leave a tip if you can, and **please be responsible and message me \"__done__\" when you've left "
+            "(unless the island already has a lot of visitors inside, in which case... don't bother)**. Doing this lets the next visitor in. "
+            f"The Dodo code is **{turnip.dodo}**.", Priority.DODO_CODE, partition.guild_id)
+
+    def on_queue_event(self, partition, event, owner, guest):
+        if event == turnips.QueueEvent.OPENED:
+            self.journal.record(Entry.OPENED, owner, guild=partition.guild_id)
+        else:
+            self.journal.record(Entry[event.name], owner, guest)
+        if event == turnips.QueueEvent.CLOSED:
+            forget_departures(self.recently_departed, owner)
+        if event in (turnips.QueueEvent.REQUESTED, turnips.QueueEvent.DISPENSED, turnips.QueueEvent.CLOSED):
+            self.wake(owner)
+
+    def wake(self, owner):
+        if owner in self.wakeups:
+            self.wakeups[owner].set()
+
+    async def wait_for_activity(self, owner):
+        # Blocks until someone queues up, the host pauses or lets someone in, or the listing closes.
+        # Anything that happened since the last wait will have already set the event, so nothing is missed.
+        wakeup = self.wakeups.setdefault(owner, asyncio.Event())
+        await wakeup.wait()
+        wakeup.clear()
+
+    def remaining_wait(self, owner):
+        # Seconds until the owner's current cooldown ends, plus any pauses that are still waiting to be served.
+        partition = self.hosting.get(owner)
+        remaining = partition.scheduler.remaining(owner) if partition is not None else None
+        return int(remaining or 0) + self.requested_pauses.get(owner, 0) * queue_interval
+
+    # Returns when the cooldown ran out, by the loop's clock, or None if it was cut short.
+    async def reset_sleep(self, partition, owner, duration=None):
         logger.info("Resetting sleep")
-        if owner in self.sleepers:
-            logger.info("Cancelling current sleep")
-            self.sleepers[owner].cancel()
-        self.sleepers[owner] = self.loop.create_task(asyncio.sleep(queue_interval))
-
-        try:
-            await self.sleepers[owner]
+        if duration is None:
+            duration = queue_interval
+        self.journal.record(Entry.DEADLINE, owner, at=time.time() + duration)
+        if await partition.scheduler.wait(owner, duration):
+            self.traced('timeout', owner)
             owner_name = self.get_user(owner).name
             logger.info(f"Timeout on last visitor to {owner_name}, letting next person in.")
-        except:
-            logger.info("Sleep was cancelled")
-            pass
-
-        if owner in self.sleepers:  # not yet sure why sometimes owner is not in self.sleepers
-            del self.sleepers[owner]
-
-    async def queue_manager(self, owner):
+            return partition.scheduler.fired.pop(owner, None)
+        logger.info("Sleep was cancelled")
+        return None
+
+    async def queue_manager(self, partition, owner, resume_after=None):
+        self.wakeups.setdefault(owner, asyncio.Event())
+        due = None
+        if resume_after is not None:
+            # Picking up a cooldown that was still running when the bot went down.
+            due = await self.reset_sleep(partition, owner, resume_after)
         self.is_paused[owner] = False
         while True:
             # pauses should go here because the queue might be empty when the owner calls pause
             # if it's empty when that happens, then it never reaches the reset_sleep call at the end.
             # we can't move that reset_sleep call up here because that means it would sleep before handing
             # out the first code.
-            while owner in self.requested_pauses and self.requested_pauses[owner] > 0:
-                logger.info(f"Sleeping upon request, {self.requested_pauses[owner]}")
+            pauses = self.requested_pauses.get(owner, 0)
+            if pauses > 0:
+                logger.info(f"Sleeping upon request, {pauses}")
                 self.is_paused[owner] = True
-                self.requested_pauses[owner] -= 1
-                await self.reset_sleep(owner)
-            self.is_paused[owner] = False
-
-            status = await self.let_next_person_in(owner)
+                self.requested_pauses[owner] = 0
+                self.save_pauses(owner)
+                due = await self.reset_sleep(partition, owner, pauses * queue_interval)
+            if self.is_paused[owner]:
+                self.is_paused[owner] = False
+                self.save_pauses(owner)
+
+            status = await self.let_next_person_in(partition, owner, due)
+            due = None
             if status == Lloid.QueueEmpty:
-                # print("queue seems empty, sleeping then polling again")
-                await asyncio.sleep(poll_sleep_interval)
+                await self.wait_for_activity(owner)
                 continue
             elif status == Lloid.AlreadyClosed:
                 logger.warning("Lloid apparently closed")
                 break
 
-            print("Should reset sleep now")
-            await self.reset_sleep(owner)
+            logger.debug("Should reset sleep now")
+            due = await self.reset_sleep(partition, owner)
+        self.wakeups.pop(owner, None)
         logger.warning("Exited the loop. This can only happen if the queue was closed.")
 
+    async def weekly_reset(self):
+        # Wakes up whenever a new week starts in some timezone and clears out that timezone's old prices.
+        while True:
+            await asyncio.sleep(turnips.seconds_until_rollover() + 1)
+            await self.wipe_old_prices()
+
+    async def wipe_old_prices(self):
+        for partition in self.partitions.values():
+            wiped = await partition.market.wipe_old_prices()
+            logger.info(f"Weekly reset cleared {wiped} listings in {partition}")
+
     async def on_message(self, message):
         # Lloid should not respond to self
         if message.author == self.user:
             return
 
-        # This entire handler can be removed, but if it's defined, the line below *must* be executed
-        # otherwise commands are not processed at all.
-        await self.process_commands(message)
-        
+        if self.workers is None:
+            # This entire handler can be removed, but if it's defined, the line below *must* be executed
+            # otherwise commands are not processed at all.
+            await self.process_commands(message)
+            return
+
+        # In worker mode, the command may be about a listing or a line on another worker.
+        if message.author.bot:
+            return
+        ctx = await self.get_context(message)
+        name = ctx.command.name if ctx.command is not None else None
+        await self.workers.dispatch(message.author.id, name, message_payload(message), lambda: self.invoke(ctx),
+            message.guild is not None, ctx.view.buffer[ctx.view.index:])
+
+    # A message another worker received and handed over (see workers.py), run as if it came in here.
+    async def run_forwarded(self, data):
+        channel, _ = self._connection._get_guild_channel(data)
+        message = discord.Message(state=self._connection, channel=channel, data=data)
+        await self.invoke(await self.get_context(message))
+
 def main(): 
     parser = argparse.ArgumentParser()
     parser.add_argument('--verbose', '-v', action='count', help='Sets the verbosity level of the logger.', default=0, required=False)
@@ -457,6 +894,13 @@ def main():
     token = os.getenv("TOKEN")
     interval = os.getenv("QUEUE_INTERVAL")
     sentry_dsn = os.getenv("SENTRY_DSN")
+    dm_concurrency = os.getenv("DM_CONCURRENCY")
+    trace_file = os.getenv("TRACE_FILE")
+    metrics_port = os.getenv("METRICS_PORT")
+    admin_ids = os.getenv("ADMIN_IDS")
+    legacy_guild = os.getenv("LEGACY_GUILD_ID")
+    workers = int(os.getenv("WORKERS") or 1)
+    worker_index = os.getenv("WORKER_INDEX") # set by the supervisor for each worker it starts
 
     if not token:
         raise Exception('TOKEN env variable is not defined')
@@ -464,6 +908,9 @@ def main():
     if not os.getenv("ANNOUNCE_ID"):
         raise Exception('ANNOUNCE_ID env variable is not defined')
 
+    if workers > 1 and worker_index is None:
+        sys.exit(supervise(workers, sys.argv[1:]))
+
     if sentry_dsn:
         sentry_sdk.init(sentry_dsn)
         logger.info("Connected to Sentry")
@@ -472,8 +919,34 @@ def main():
         queue_interval = int(interval)
         logger.info(f"Set interval to {interval}")
 
-    client = Lloid()
+    if dm_concurrency:
+        fanout.concurrency_limit = int(dm_concurrency)
+        logger.info(f"Sending at most {dm_concurrency} DMs at once")
+
+    if worker_index is not None:
+        # Each worker has its own trace and metrics port: TRACE_FILE.0, METRICS_PORT + 0 and so on.
+        index = int(worker_index)
+        shard_count = int(os.getenv("SHARD_COUNT") or workers)
+        if shard_count < workers:
+            raise Exception('SHARD_COUNT must be at least WORKERS, or some workers would have nothing to do')
+        client = Lloid(shard_ids=shards_for(index, workers, shard_count), shard_count=shard_count)
+        client.workers = Workers(client, index, workers, os.getenv("WORKER_DIR"))
+        trace_file = f"{trace_file}.{index}" if trace_file else None
+        metrics_port = int(metrics_port) + index if metrics_port else None
+        logger.info(f"Worker {index} running shards {client.shard_ids} of {shard_count}")
+    else:
+        client = Lloid()
     client.initialized = False
+    if trace_file:
+        client.trace = TraceRecorder(trace_file)
+        logger.info(f"Recording a trace of inbound events to {trace_file}")
+    if metrics_port:
+        client.enable_metrics(metrics.Metrics())
+        client.metrics_port = int(metrics_port)
+    if admin_ids:
+        client.admins = {int(i) for i in admin_ids.replace(' ', '').split(',') if i != ''}
+    if legacy_guild:
+        client.legacy_guild = int(legacy_guild)
     client.run(token)
 
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+import collections
+import logging
+from datetime import timedelta
+import numpy as np
+import lloidbot.turnips as turnips
+from lloidbot.turnips import Turnip
+
+logger = logging.getLogger('lloid')
+
+# Aggregate numbers for a whole market, computed straight from the listings' packed price
+# arrays: every listing's 14 half-day prices go into one 14 x users matrix (NaN where nobody
+# declared a price), laid out so each half-day's prices are contiguous, and everything below
+# is a handful of row-wise NumPy reductions over it.
+MarketStats = collections.namedtuple('MarketStats', ['listings', 'mean', 'median', 'max', 'top'])
+
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+# Returns (listings, prices) for the given Turnips, with prices as a 14 x users float32 matrix.
+# Each Turnip's prices are already a packed C int array, so this is one join and no per-price Python.
+def price_matrix(listings):
+    listings = list(listings)
+    raw = np.ascontiguousarray(np.frombuffer(b"".join([t.prices for t in listings]), dtype=np.intc).reshape(-1, 14).T)
+    prices = raw.astype(np.float32)
+    prices[raw == Turnip.MISSING] = np.nan
+    return listings, prices
+
+# Each listing's current half-day (-1 if it has no offset), worked out once per distinct
+# offset rather than once per listing.
+def current_indices(offsets):
+    offsets = np.array(offsets, dtype=float)
+    known = ~np.isnan(offsets)
+    indices = np.full(len(offsets), -1)
+    unique, inverse = np.unique(offsets[known].astype(int), return_inverse=True)
+    lookup = np.array([turnips.intervals[turnips.compute_current_interval(int(o))[0]] for o in unique], dtype=int)
+    if len(unique) > 0:
+        indices[known] = lookup[inverse]
+    return indices
+
+# `top` only considers the listings of `open_owners`, if given, since a host who's closed up can't
+# be visited however good their price; the per-half-day aggregates cover every listing.
+def compute(listings, k=5, open_owners=None):
+    listings, prices = price_matrix(listings)
+    declared = ~np.isnan(prices)
+    counts = declared.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'): # half-days nobody has declared for yet
+        mean = np.where(declared, prices, 0).sum(axis=1, dtype=np.float64) / counts
+    median = best = np.full(14, np.nan)
+    if len(listings) > 0:
+        # NaNs sort last, so each half-day's median sits in the middle of its declared prices.
+        ordered = np.sort(prices, axis=1)
+        rows = np.arange(14)
+        median = np.where(counts > 0, (ordered[rows, np.maximum(counts - 1, 0) // 2] + ordered[rows, counts // 2]) / 2, np.nan)
+        best = np.fmax.reduce(prices, axis=1)
+
+    indices = current_indices([t.gmtoffset for t in listings])
+    now = np.full(len(listings), -np.inf, dtype=np.float32)
+    known = np.flatnonzero(indices >= 0)
+    now[known] = prices[indices[known], known]
+    now[np.isnan(now)] = -np.inf
+    if open_owners is not None:
+        now[~np.isin([t.id for t in listings], list(open_owners))] = -np.inf
+    top = []
+    if len(now) > 0:
+        candidates = np.argpartition(-now, min(k, len(now)) - 1)[:k]
+        top = [(listings[i], int(now[i])) for i in candidates[np.argsort(-now[candidates])] if now[i] != -np.inf]
+    return MarketStats(len(listings), as_list(mean), as_list(median), as_list(best), top)
+
+# Quantiles of every listing's best price, for each of the weeks in `bests` ((week, best) pairs,
+# oldest first). Returns [(week, listings, {quantile: price})].
+def week_over_week(bests):
+    if len(bests) == 0:
+        return []
+    weeks, best = np.array(bests, dtype=float).T
+    boundaries = np.flatnonzero(np.diff(weeks)) + 1
+    return [(int(w[0]), len(b), dict(zip(QUANTILES, np.quantile(b, QUANTILES).round().astype(int).tolist())))
+        for w, b in zip(np.split(weeks, boundaries), np.split(best, boundaries))]
+
+def as_list(column):
+    return [None if np.isnan(v) else round(float(v), 1) for v in column]
+
+def describe(stats, weeks):
+    names = [f"{day} {half}" for day in ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun') for half in ('AM', 'PM')]
+    lines = [f"**{stats.listings}** listings this week."]
+    for name, mean, median, best in zip(names, stats.mean, stats.median, stats.max):
+        if best is not None:
+            lines.append(f"{name}: mean {mean:.0f}, median {median:.0f}, best {best:.0f}")
+    if len(stats.top) > 0:
+        lines.append("Best prices right now: " + ", ".join(f"**{t.name}** ({price})" for t, price in stats.top))
+    for week, count, q in weeks:
+        lines.append(f"Week of {turnips.first_monday + timedelta(weeks=week)}: {count} islands, "
+            f"median best {q[0.5]}, top 10% over {q[0.9]}")
+    return "\n".join(lines)
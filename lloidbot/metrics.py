@@ -0,0 +1,260 @@
+import asyncio
+import bisect
+import functools
+import logging
+import time
+import discord
+
+logger = logging.getLogger('lloid')
+
+# Counters, gauges and histograms, exported in Prometheus' text format (over HTTP, see serve())
+# and summarised by the stats command. Metrics are off unless METRICS_PORT is set: everything
+# that records one checks for a Metrics first, so when they're off all it costs is that check.
+#
+# Values are keyed by a tuple of label values, in the order the labels were declared, eg:
+#
+#   metrics.dm_failures.inc('forbidden')
+#
+# Some of what's exported already has a tally somewhere else (the outbound queue, deliveries,
+# the listing cache); those are copied over by the collectors each time the metrics are read,
+# rather than counted twice.
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {} # label values -> value
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+    def get(self, *labels):
+        return self.values.get(labels, 0)
+
+    def clear(self):
+        self.values = {}
+
+    def total(self):
+        return sum(self.values.values())
+
+    def samples(self):
+        for labels, value in sorted(self.values.items()):
+            yield self.name, self.label_pairs(labels), value
+
+    def label_pairs(self, labels, **extra):
+        return list(zip(self.labels, labels)) + list(extra.items())
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+# Counts how many observations fell at or under each bucket's upper bound, plus their sum. The
+# default buckets suit latencies, from a fast SQLite statement up to a code stuck behind a rate limit.
+class Histogram(Metric):
+    kind = 'histogram'
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    # Each value is [counts per bucket (the last one being +Inf), sum].
+    def observe(self, value, *labels):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    # The count, sum and mean are across all labels.
+    def count(self):
+        return sum(sum(counts) for counts, _ in self.values.values())
+
+    def sum(self):
+        return sum(total for _, total in self.values.values())
+
+    def mean(self):
+        count = self.count()
+        return self.sum() / count if count > 0 else None
+
+    # The upper bound of the bucket the q-th quantile falls in, across all labels, or None if
+    # nothing's been observed. Past the last bucket, that's infinity.
+    def quantile(self, q):
+        counts = [sum(c) for c in zip(*(counts for counts, _ in self.values.values()))]
+        total = sum(counts)
+        if total == 0:
+            return None
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            seen += count
+            if seen >= q * total:
+                return bound
+        return float('inf')
+
+    def samples(self):
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield self.name + '_bucket', self.label_pairs(labels, le=format_value(bound)), cumulative
+            yield self.name + '_sum', self.label_pairs(labels), total
+            yield self.name + '_count', self.label_pairs(labels), cumulative
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+class Metrics:
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.metrics = []
+        self.collectors = [] # called with this before the metrics are read, to fill in the copied ones
+        self.last_rates = (clock(), {}) # when rates() was last asked, and the event counts then
+        self.events = self.counter('lloid_events_total', "Inbound events acted on: commands, reactions and cooldowns running out.", ('event',))
+        self.dispense_delay = self.histogram('lloid_dispense_delay_seconds', "How long after a cooldown ran out the next guest's code was sent.")
+        self.db_seconds = self.histogram('lloid_db_seconds', "Time spent running SQLite statements, commits included.", ('op',))
+        self.dm_seconds = self.histogram('lloid_dm_seconds', "How long sending a DM took, once it was out of the outbound queue.")
+        self.dm_failures = self.counter('lloid_dm_failures_total', "DMs that couldn't be sent.", ('reason',))
+        # Filled in by the collectors.
+        self.open_listings = self.gauge('lloid_open_listings', "Listings currently open.", ('guild',))
+        self.queue_length = self.gauge('lloid_queue_length', "Guests waiting in each host's line.", ('guild', 'owner'))
+        self.cooldowns = self.gauge('lloid_cooldowns', "Cooldown timers currently running.", ('guild',))
+        self.cache_lookups = self.counter('lloid_listing_lookups_total', "Listing lookups, by whether the cache had them.", ('guild', 'result'))
+        self.outbound_depth = self.gauge('lloid_outbound_depth', "Messages waiting in the outbound queue.", ('priority',))
+        self.outbound_sent = self.counter('lloid_outbound_sent_total', "Messages sent through the outbound queue.", ('priority',))
+        self.deliveries = self.counter('lloid_code_deliveries_total', "Attempts at getting a code to a guest, by outcome.", ('outcome',))
+        self.deliveries_pending = self.gauge('lloid_code_deliveries_pending', "Code deliveries waiting to be retried.")
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.add(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=Histogram.BUCKETS):
+        return self.add(Histogram(name, help, labels, buckets))
+
+    # Inbound events per second, by event, since the last time this was asked (or since the start).
+    def rates(self):
+        now = self.clock()
+        since, before = self.last_rates
+        counts = dict(self.events.values)
+        self.last_rates = (now, counts)
+        elapsed = max(now - since, 1e-9)
+        return {labels[0]: (count - before.get(labels, 0)) / elapsed for labels, count in counts.items()}
+
+    def collect(self):
+        for collector in self.collectors:
+            try:
+                collector(self)
+            except Exception:
+                logger.exception("A metrics collector failed")
+
+    def render(self):
+        self.collect()
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                label_text = ",".join(f'{k}="{escape(v)}"' for k, v in labels)
+                lines.append(f"{name}{{{label_text}}} {format_value(value)}" if label_text else f"{name} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    # Wraps a plain function that runs on the database thread so that it's timed as `op`. The
+    # timing is taken there, but if it was wrapped on the event loop it's recorded back on the
+    # loop, so that the histogram is never written to while render() is reading it.
+    def timed(self, op, fn):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                if loop is None:
+                    self.db_seconds.observe(elapsed, op)
+                else:
+                    loop.call_soon_threadsafe(self.db_seconds.observe, elapsed, op)
+        return run
+
+    # Sends a DM with `send` (as handed to the outbound dispatcher), timing it and counting failures.
+    async def timed_send(self, send):
+        started = self.clock()
+        try:
+            return await send()
+        except discord.Forbidden:
+            self.dm_failures.inc('forbidden')
+            raise
+        except discord.HTTPException:
+            self.dm_failures.inc('http')
+            raise
+        finally:
+            self.dm_seconds.observe(self.clock() - started)
+
+    # Serves the metrics at http://host:port/metrics for Prometheus to scrape. Only listens
+    # locally unless told otherwise.
+    async def serve(self, port, host='127.0.0.1'):
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info(f"Serving metrics on {host}:{port}")
+        return server
+
+    async def handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 10)
+            while (await asyncio.wait_for(reader.readline(), 10)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] in ('/', '/metrics'):
+                status, body = '200 OK', self.render().encode('utf-8')
+            else:
+                status, body = '404 Not Found', b'Not found\n'
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as ex:
+            logger.debug(f"Metrics request failed: {ex}")
+        finally:
+            writer.close()
+
+def describe_latency(histogram, scale=1, unit='s'):
+    if histogram.count() == 0:
+        return "none yet"
+    return (f"{histogram.count()}, avg {histogram.mean() * scale:.2f}{unit}, "
+        f"p50 under {histogram.quantile(0.5) * scale:g}{unit}, p99 under {histogram.quantile(0.99) * scale:g}{unit}")
+
+# A summary for the stats command. Collect first.
+def describe(metrics):
+    lines = [
+        f"**Listings:** {metrics.open_listings.total()} open, {metrics.queue_length.total()} guests in line"
+            + (f", longest line {max(metrics.queue_length.values.values())}" if len(metrics.queue_length.values) > 0 else ""),
+        f"**Codes sent after a cooldown:** {describe_latency(metrics.dispense_delay)}",
+        f"**DMs:** {describe_latency(metrics.dm_seconds)}. Failed: {metrics.dm_failures.get('forbidden')} not accepting DMs, "
+            f"{metrics.dm_failures.get('http')} other errors. Waiting to go out: {metrics.outbound_depth.total()}",
+        f"**Database:** {describe_latency(metrics.db_seconds, 1000, 'ms')}",
+    ]
+    rates = metrics.rates()
+    if len(rates) > 0:
+        lines.append("**Events/s:** " + ", ".join(f"{event} {rate:.2f}" for event, rate in sorted(rates.items())))
+    return "\n".join(lines)
@@ -0,0 +1,34 @@
+import logging
+from lloidbot.scheduler import DeadlineScheduler
+
+logger = logging.getLogger('lloid')
+
+# One server's share of the bot: the channel its listings are announced in, and its own market
+# (listings under its own chan, and its own lines) and cooldown timers. Nothing a server does
+# touches another server's partition, so a rush on one doesn't slow the others down.
+class Partition:
+    def __init__(self, guild_id, channel, market):
+        self.guild_id = guild_id
+        self.channel = channel
+        self.market = market
+        self.scheduler = DeadlineScheduler() # owner -> deadline of their current cooldown
+
+    @property
+    def chan(self):
+        return self.market.chan
+
+    def __str__(self):
+        return f"{self.guild_id} ({self.chan})"
+
+# ANNOUNCE_ID is a comma-separated list of channel ids, one per server.
+def parse_announce_ids(value):
+    ids = [int(i) for i in value.replace(' ', '').split(',') if i != '']
+    if len(ids) == 0:
+        raise ValueError("ANNOUNCE_ID doesn't contain any channel ids")
+    return ids
+
+# Which chan a server's listings are stored under: its own id, so that a server keeps its listings
+# however ANNOUNCE_ID is ordered and whichever of its channels can be seen. Listings from before
+# there were several servers are under default_chan; see LEGACY_GUILD_ID.
+def chan_for(guild_id):
+    return str(guild_id)
@@ -0,0 +1,151 @@
+import collections
+import logging
+import numpy as np
+
+logger = logging.getLogger('lloid')
+
+# Predicts which of the game's four weekly price patterns each island is on, and how high or
+# low its remaining prices can go, from the prices declared so far this week.
+#
+# Every pattern is broken down into sub-patterns (eg: "large spike starting Wednesday PM"),
+# each of which bounds the price ratio for every half-day from Monday AM to Saturday PM. Those
+# bounds are scaled by every possible Sunday buying price (90-110, which we never get to see)
+# into one table of price ranges, and a history is scored against the whole table at once:
+# every declared price falls uniformly within its range, or not at all. Decreasing runs are
+# bounded by their envelope rather than tracked step by step, so the odds are an approximation,
+# but the ranges never rule out a price the game could actually produce.
+PATTERNS = ('fluctuating', 'large spike', 'decreasing', 'small spike')
+PERIODS = 12 # Monday AM through Saturday PM; nobody buys turnips on Sunday
+BASES = np.arange(90, 111)
+PERIOD_NAMES = [f"{day} {half}" for day in ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat') for half in ('AM', 'PM')]
+
+# How likely each pattern is to follow each other pattern; rows are last week's pattern.
+TRANSITIONS = np.array([
+    [0.20, 0.30, 0.15, 0.35],
+    [0.50, 0.05, 0.20, 0.25],
+    [0.25, 0.45, 0.05, 0.25],
+    [0.45, 0.25, 0.15, 0.15],
+])
+
+def stationary(transitions):
+    # We don't know anyone's pattern from last week, so start from the long-run odds.
+    values, vectors = np.linalg.eig(transitions.T)
+    v = np.real(vectors[:, np.argmin(np.abs(values - 1))])
+    return v / v.sum()
+
+PRIOR = stationary(TRANSITIONS)
+
+Prediction = collections.namedtuple('Prediction', ['probabilities', 'low', 'high', 'consistent'])
+
+def decreasing(start_low, start_high, length, drop_low=0.03, drop_high=0.05):
+    return [(start_low - k * drop_high, start_high - k * drop_low, 0) for k in range(length)]
+
+def flat(low, high, length):
+    return [(low, high, 0)] * length
+
+# Each sub-pattern is (pattern, prior odds within the pattern, [(low ratio, high ratio, adjust)]
+# for each period), where a price is ceil(ratio * base) + adjust.
+def sub_patterns():
+    subs = []
+    for hi1 in range(7):
+        for dec1 in (2, 3):
+            for hi3 in range(7 - hi1):
+                hi2 = 7 - hi1 - hi3
+                periods = (flat(0.9, 1.4, hi1) + decreasing(0.6, 0.8, dec1, 0.04, 0.1) + flat(0.9, 1.4, hi2)
+                    + decreasing(0.6, 0.8, 5 - dec1, 0.04, 0.1) + flat(0.9, 1.4, hi3))
+                subs.append((0, 1 / 7 * 1 / 2 * 1 / (7 - hi1), periods))
+    for peak in range(1, 8):
+        periods = (decreasing(0.85, 0.9, peak) + [(0.9, 1.4, 0), (1.4, 2.0, 0), (2.0, 6.0, 0), (1.4, 2.0, 0), (0.9, 1.4, 0)]
+            + flat(0.4, 0.9, PERIODS - peak - 5))
+        subs.append((1, 1 / 7, periods))
+    subs.append((2, 1, decreasing(0.85, 0.9, PERIODS)))
+    for peak in range(8):
+        periods = (decreasing(0.4, 0.9, peak) + flat(0.9, 1.4, 2) + [(1.4, 2.0, -1), (1.4, 2.0, 0), (1.4, 2.0, -1)]
+            + decreasing(0.4, 0.9, PERIODS - peak - 5))
+        subs.append((3, 1 / 8, periods))
+    return subs
+
+def price_table(subs):
+    ratios = np.array([periods for _, _, periods in subs]) # (sub-pattern, period, 3)
+    scale = BASES[None, :, None]
+    # A hair of slack so float error never pushes a bound across an integer.
+    low = np.ceil(ratios[:, None, :, 0] * scale - 1e-6) + ratios[:, None, :, 2]
+    high = np.ceil(ratios[:, None, :, 1] * scale + 1e-6) + ratios[:, None, :, 2]
+    return low, high # (sub-pattern, base, period)
+
+SUBS = sub_patterns()
+SUB_PATTERN = np.array([pattern for pattern, _, _ in SUBS])
+SUB_PRIOR = np.array([PRIOR[pattern] * odds for pattern, odds, _ in SUBS]) / len(BASES)
+LOW, HIGH = price_table(SUBS)
+# Scoring is done in float32 to halve the memory traffic. Every declared price multiplies each
+# candidate by 64 / (size of its range) rather than 1 / size, which keeps a dozen of them well
+# clear of float32's underflow; it scales every candidate alike, so normalizing undoes it.
+WEIGHT = (64 / (HIGH - LOW + 1)).astype(np.float32)
+LOW32, HIGH32 = LOW.astype(np.float32), HIGH.astype(np.float32)
+
+# Scores a block of histories (an array of shape (users, PERIODS), with NaN for prices nobody
+# declared) against every sub-pattern and base price. Returns the pattern probabilities and the
+# low/high bounds for every period, along with whether each history fit any pattern at all.
+def predict_block(prices):
+    observed = ~np.isnan(prices)
+    posterior = np.broadcast_to(SUB_PRIOR.astype(np.float32)[None, :, None], (len(prices), len(SUBS), len(BASES))).copy()
+    for j in np.flatnonzero(observed.any(axis=0)):
+        rows = observed[:, j]
+        x = prices[rows, j, None, None].astype(np.float32)
+        fits = (x >= LOW32[None, :, :, j]) & (x <= HIGH32[None, :, :, j])
+        posterior[rows] *= fits * WEIGHT[None, :, :, j]
+
+    total = posterior.sum(axis=(1, 2))
+    consistent = total > 0
+    # A history that fits nothing (a typo, or the wrong time zone) gets the odds of an unknown island.
+    posterior[~consistent] = SUB_PRIOR[:, None]
+    posterior /= posterior.sum(axis=(1, 2), keepdims=True)
+
+    by_pattern = np.zeros((len(prices), len(PATTERNS)))
+    np.add.at(by_pattern.T, SUB_PATTERN, posterior.sum(axis=2, dtype=float).T)
+    by_pattern /= by_pattern.sum(axis=1, keepdims=True)
+
+    # Prices only go up with the base price, so each sub-pattern's range spans from its lowest
+    # possible base's low to its highest possible base's high.
+    possible = posterior > 0 # (users, sub-pattern, base)
+    any_base = possible.any(axis=2)
+    lowest = possible.argmax(axis=2)
+    highest = len(BASES) - 1 - possible[:, :, ::-1].argmax(axis=2)
+    subs = np.arange(len(SUBS))[None, :]
+    low = np.where(any_base[:, :, None], LOW[subs, lowest], np.inf).min(axis=1)
+    high = np.where(any_base[:, :, None], HIGH[subs, highest], -np.inf).max(axis=1)
+    known = observed & consistent[:, None]
+    low[known] = prices[known]
+    high[known] = prices[known]
+    return by_pattern, low, high, consistent
+
+# `histories` is a list of Turnip.history lists. Scoring happens in blocks to keep memory flat
+# however many islands there are.
+def predict_all(histories, block=256):
+    prices = np.array([[np.nan if p is None else p for p in h[:PERIODS]] for h in histories], dtype=float).reshape(-1, PERIODS)
+    results = [predict_block(prices[i:i + block]) for i in range(0, len(prices), block)]
+    if len(results) == 0:
+        return []
+    by_pattern, low, high, consistent = (np.concatenate(r) for r in zip(*results))
+    return [Prediction(dict(zip(PATTERNS, p)), l.astype(int).tolist(), h.astype(int).tolist(), bool(c))
+        for p, l, h, c in zip(by_pattern.tolist(), low, high, consistent)]
+
+def predict(history):
+    return predict_all([history])[0]
+
+# A one-line summary for listing posts: the likeliest pattern, and the best price that could
+# still come from `index` (the current period) on.
+def summary(prediction, index):
+    pattern, odds = max(prediction.probabilities.items(), key=lambda p: p[1])
+    best = max(prediction.high[index:PERIODS], default=None)
+    if best is None:
+        return f"Probably a **{pattern}** week ({odds:.0%})."
+    return f"Probably a **{pattern}** week ({odds:.0%}); could still reach **{best}**."
+
+def describe(prediction, index):
+    lines = [f"{pattern}: {odds:.0%}" for pattern, odds in sorted(prediction.probabilities.items(), key=lambda p: -p[1])]
+    if not prediction.consistent:
+        lines.append("(Your prices don't fit any known pattern, so these are just the usual odds. Double-check your time zone?)")
+    for i in range(index, PERIODS):
+        lines.append(f"{PERIOD_NAMES[i]}: {prediction.low[i]}-{prediction.high[i]}")
+    return "\n".join(lines)
@@ -42,7 +42,7 @@ class QueueManager:
     def visitor_request_queue(self, guest, owner):
         status, _ = self.market.request(guest, owner)
         if status:
-            guests_ahead = [q[0] for q in self.market.queue.queues[owner][:-1]]
+            guests_ahead = self.market.queue.queues[owner].guests()[:-1]
             return [(Action.ADDED_TO_QUEUE, guests_ahead)]
         else:
             return [(Action.NOTHING,)]
@@ -0,0 +1,111 @@
+import asyncio
+import heapq
+import itertools
+import logging
+
+logger = logging.getLogger('lloid')
+
+# Keeps track of every host's cooldown deadline in one place.
+# Deadlines live in a min-heap keyed by the loop's clock, and only a single loop timer is
+# ever armed--for whichever deadline comes first--so thousands of open islands cost one
+# timer instead of one sleeping task each. Rescheduling, extending and cancelling are
+# O(log n): superseded heap entries are left where they are and skipped when they surface.
+#
+# A coroutine waiting on a key gets True back if the deadline passed, or False if the wait
+# was cut short (by cancel(), or by the key being scheduled again). When it passed, the deadline
+# is left in `fired` for the waiter to pick up, eg: to see how late things ran after it.
+class DeadlineScheduler:
+    EPSILON = 0.001 # loop timers may fire a hair early; treat anything this close as due
+
+    def __init__(self):
+        self.heap = [] # (deadline, seq, key)
+        self.entries = {} # key -> (deadline, seq, future)
+        self.counter = itertools.count()
+        self.timer = None
+        self.timer_deadline = None
+        self.fired = {} # key -> the deadline that last passed for it
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def now(self):
+        return asyncio.get_event_loop().time()
+
+    async def wait(self, key, delay):
+        self.cancel(key)
+        future = asyncio.get_event_loop().create_future()
+        self.push(key, self.now() + delay, future)
+        try:
+            return await future
+        finally:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] is future:
+                del self.entries[key]
+                self.arm()
+
+    def extend(self, key, delay):
+        if key not in self.entries:
+            return False
+        deadline, _, future = self.entries[key]
+        self.push(key, deadline + delay, future)
+        return True
+
+    def cancel(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+        future = entry[2]
+        if not future.done():
+            future.set_result(False)
+        self.arm()
+        return True
+
+    def remaining(self, key):
+        if key not in self.entries:
+            return None
+        return max(0, self.entries[key][0] - self.now())
+
+    def push(self, key, deadline, future):
+        seq = next(self.counter)
+        self.entries[key] = (deadline, seq, future)
+        heapq.heappush(self.heap, (deadline, seq, key))
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = [(d, s, k) for k, (d, s, _) in self.entries.items()]
+            heapq.heapify(self.heap)
+        self.arm()
+
+    def is_current(self, item):
+        deadline, seq, key = item
+        entry = self.entries.get(key)
+        return entry is not None and entry[1] == seq
+
+    def arm(self):
+        while self.heap and not self.is_current(self.heap[0]):
+            heapq.heappop(self.heap)
+
+        deadline = self.heap[0][0] if self.heap else None
+        if deadline == self.timer_deadline:
+            return
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.timer_deadline = deadline
+        if deadline is not None:
+            self.timer = asyncio.get_event_loop().call_at(deadline, self.fire)
+
+    def fire(self):
+        self.timer = None
+        self.timer_deadline = None
+        now = self.now() + DeadlineScheduler.EPSILON
+        while self.heap and self.heap[0][0] <= now:
+            item = heapq.heappop(self.heap)
+            if not self.is_current(item):
+                continue
+            _, _, future = self.entries.pop(item[2])
+            if not future.done():
+                self.fired[item[2]] = item[0]
+                future.set_result(True)
+        self.arm()
@@ -0,0 +1,4 @@
+from lloidbot.simulation.clock import VirtualClock, VirtualClockLoop, InlineExecutor
+from lloidbot.simulation.transport import Transport
+from lloidbot.simulation.bot import SimulatedBot
+from lloidbot.simulation.workload import Workload, Simulation, Report, simulate
@@ -0,0 +1,26 @@
+# Plays out a turnip rush against the real queue core on a virtual clock, eg:
+#
+#   python -m lloidbot.simulation --hosts 1000 --guests 20000 --hours 4
+import argparse
+import logging
+from lloidbot.simulation.workload import Workload, simulate
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hosts', type=int, default=1000)
+    parser.add_argument('--guests', type=int, default=20000)
+    parser.add_argument('--hours', type=float, default=4.0)
+    parser.add_argument('--guilds', type=int, default=1)
+    parser.add_argument('--patience', type=float, default=60, help='Minutes a guest waits before giving up.')
+    parser.add_argument('--done-rate', type=float, default=0.6, help='Share of guests who say they are done.')
+    parser.add_argument('--pauses-per-hour', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='[%(asctime)s] %(levelname)s %(filename)s@%(lineno)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    logging.getLogger('lloid').setLevel(logging.ERROR)
+    print(simulate(Workload(hosts=args.hosts, guests=args.guests, hours=args.hours, guilds=args.guilds,
+        patience=args.patience * 60, done_rate=args.done_rate, pauses_per_hour=args.pauses_per_hour, seed=args.seed)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import logging
+from discord.ext import commands
+from lloidbot.lloidbot import Lloid, DMCommands, GeneralCommands
+from lloidbot.journal import StateJournal
+from lloidbot.partition import chan_for
+from lloidbot.storage import AsyncMarket, connect
+from lloidbot.turnips import StalkMarket
+from lloidbot.simulation.clock import InlineExecutor
+from lloidbot.simulation.fakes import FakeUser, FakeGuild, FakeChannel, FakeContext, reaction, not_found
+from lloidbot.simulation.transport import Transport
+
+logger = logging.getLogger('lloid')
+
+# Lloid with Discord taken out: users, servers and channels are fakes registered with the bot,
+# the market lives in an in-memory database, and commands and reactions are handed straight to
+# the same handlers the gateway would call, by way of the transport. Everything else (the
+# dispensing loops, cooldowns, the journal, outbound rate limiting, code delivery) is the real thing.
+class SimulatedBot(Lloid):
+    def __init__(self, loop, inbox=None, transport=None):
+        super().__init__()
+        self.loop = loop
+        self.initialized = True
+        self.inbox = inbox # called with (user, content) for everything any user is sent
+        self.transport = transport or Transport()
+        self.members = {} # user id -> FakeUser
+        self.channels = {} # channel id -> FakeChannel
+        self.bot_user = FakeUser(0, 'Lloid', self.transport)
+        self.fake_cogs = [DMCommands(self), GeneralCommands(self)]
+
+    @property
+    def user(self):
+        return self.bot_user
+
+    def get_user(self, id):
+        return self.members.get(id)
+
+    async def fetch_user(self, id):
+        def fetch():
+            if id not in self.members:
+                raise not_found('User')
+            return self.members[id]
+        return await self.transport.request('user_fetch', ('user',), fetch)
+
+    def get_channel(self, id):
+        return self.channels.get(id)
+
+    # Does what on_ready would, minus the network: one partition per server, all sharing one
+    # in-memory database the way the real ones share test.db. Servers are numbered from 1 unless
+    # `guild_ids` says otherwise. A `shared` database is a file other simulated workers use too.
+    async def start_simulation(self, guilds=1, path=':memory:', guild_ids=None, shared=False):
+        self.partitions = {}
+        self.hosting = {}
+        self.preferred_guild = {}
+        self.db = connect(path, shared)
+        executor = InlineExecutor()
+        for i, id in enumerate(guild_ids or range(1, guilds + 1)):
+            guild = FakeGuild(id, f"Server {id}")
+            channel = FakeChannel(100 + i, 'turnips', guild, self.transport)
+            self.channels[channel.id] = channel
+            self.add_partition(channel, AsyncMarket(StalkMarket(self.db, chan_for(guild.id)), executor))
+        self.journal = StateJournal(self.db)
+        self.journal.metrics = self.metrics
+        self.init_state()
+        self.transport.start()
+
+    async def stop_simulation(self):
+        self.outbound.stop()
+        self.transport.stop()
+        self.db.close()
+
+    def add_user(self, id, name, guild_id=None, accepts_dms=True):
+        user = FakeUser(id, name, self.transport, self.inbox, accepts_dms)
+        self.members[id] = user
+        for partition in self.partitions.values():
+            if guild_id is None or partition.guild_id == guild_id:
+                partition.channel.guild.members[id] = user
+        return user
+
+    # Runs a command as if `user` had DMed it, eg: await bot.command(user, 'host', 100, 'D0D0X', 0)
+    # With workers, it's run wherever the real bot would run it (see workers.py).
+    async def command(self, user, name, /, *args, **kwargs):
+        if self.workers is None:
+            return await self.run_command(user, name, *args, **kwargs)
+        payload = {'user': user.id, 'name': name, 'args': list(args), 'kwargs': kwargs}
+        rest = " ".join(str(a) for a in list(args) + list(kwargs.values()))
+        return await self.workers.dispatch(user.id, name, payload, lambda: self.run_command(user, name, *args, **kwargs), rest=rest)
+
+    async def run_forwarded(self, payload):
+        await self.run_command(self.members[payload['user']], payload['name'], *payload['args'], **payload['kwargs'])
+
+    async def run_command(self, user, name, /, *args, **kwargs):
+        for cog in self.fake_cogs:
+            command = getattr(type(cog), name, None)
+            if isinstance(command, commands.Command):
+                return await self.transport.deliver(command.callback, cog, FakeContext(user, name), *args, **kwargs)
+        raise KeyError(name)
+
+    async def react(self, user, owner):
+        await self.transport.deliver(self.on_raw_reaction_add, reaction(self.associated_message[owner], user))
+
+    async def unreact(self, user, owner):
+        await self.transport.deliver(self.on_raw_reaction_remove, reaction(self.associated_message[owner], user))
@@ -0,0 +1,71 @@
+import asyncio
+import concurrent.futures
+import selectors
+import time
+
+# A clock that only moves when it's told to.
+class VirtualClock:
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def advance(self, seconds):
+        self.now += seconds
+
+# Polls the real file descriptors (the loop's self-pipe, mostly) without ever blocking on them.
+# Whenever the loop would otherwise have gone to sleep until its next timer, the clock is moved
+# straight to that timer instead, so idle stretches cost nothing.
+class VirtualSelector(selectors.SelectSelector):
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+
+    def select(self, timeout=None):
+        ready = super().select(0)
+        if len(ready) == 0 and timeout is not None and timeout > 0:
+            self.clock.advance(timeout)
+        return ready
+
+# An event loop running on a VirtualClock. Everything that goes through the loop's clock (sleeps,
+# call_later, wait_for, the DeadlineScheduler, the dispatcher's token buckets) sees virtual time,
+# so an afternoon's worth of cooldowns plays out as fast as the code can run. Nothing ever sleeps
+# for real, so a run that has nothing left to do just skips ahead to the next timer.
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock=None):
+        self.clock = clock or VirtualClock()
+        super().__init__(VirtualSelector(self.clock))
+
+    def time(self):
+        return self.clock.now
+
+# Waits for real, but `speed` times faster than the loop's clock says it should.
+class ScaledSelector(selectors.SelectSelector):
+    def __init__(self, speed):
+        super().__init__()
+        self.speed = speed
+
+    def select(self, timeout=None):
+        return super().select(timeout / self.speed if timeout is not None else None)
+
+# An event loop whose clock runs `speed` times faster than the wall clock, starting from 0. Unlike
+# VirtualClockLoop, time keeps passing while the code runs, so work that takes too long makes
+# everything after it late, the way it would on the real bot, just sooner.
+class ScaledClockLoop(asyncio.SelectorEventLoop):
+    def __init__(self, speed):
+        self.speed = speed
+        self.started = time.monotonic()
+        super().__init__(ScaledSelector(speed))
+
+    def time(self):
+        return (time.monotonic() - self.started) * self.speed
+
+# Runs everything handed to it right away, on the calling thread. Stands in for the database
+# thread so that SQLite work happens at a deterministic point in virtual time, and so that its
+# CPU cost is counted along with everything else's.
+class InlineExecutor(concurrent.futures.Executor):
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as ex:
+            future.set_exception(ex)
+        return future
@@ -0,0 +1,166 @@
+import collections
+import itertools
+import discord
+from lloidbot.simulation.transport import http_error
+
+# Just enough of discord.py's objects for Lloid's handlers to run against. Every call that
+# would be a REST request goes through a Transport (see transport.py), so it can be made slow
+# or rate limited. Anything a user is sent (DMs, and replies to their commands) is handed to
+# `inbox`, a callable taking the user and the content, which is how a simulated user finds out
+# what happened to them.
+ids = itertools.count(1000)
+
+PartialEmoji = collections.namedtuple('PartialEmoji', ['name'])
+
+# What the gateway hands on_raw_reaction_add and on_raw_reaction_remove.
+ReactionPayload = collections.namedtuple('ReactionPayload', ['emoji', 'message_id', 'user_id', 'guild_id', 'member'])
+
+# What a command's ctx.message is looked at for.
+CommandMessage = collections.namedtuple('CommandMessage', ['author', 'guild', 'content'])
+
+def reaction(message, user, emoji='🦝'):
+    return ReactionPayload(PartialEmoji(emoji), message.id, user.id, message.channel.guild.id, None)
+
+def not_found(what):
+    return http_error(discord.NotFound, 404, 'Not Found', f"Unknown {what}")
+
+class FakeUser:
+    def __init__(self, id, name, transport, inbox=None, accepts_dms=True):
+        self.id = id
+        self.name = name
+        self.transport = transport
+        self.inbox = inbox
+        self.accepts_dms = accepts_dms
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+    async def send(self, content):
+        def send():
+            if not self.accepts_dms:
+                raise http_error(discord.Forbidden, 403, 'Forbidden', 'Cannot send messages to this user')
+            if self.inbox is not None:
+                self.inbox(self, content)
+            return FakeMessage(next(ids), None, content, self.transport)
+        return await self.transport.request('dm', ('dm', self.id), send)
+
+    def __str__(self):
+        return self.name
+
+class FakeGuild:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.members = {} # user id -> FakeUser
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+class FakeMessage:
+    def __init__(self, id, channel, content, transport):
+        self.id = id
+        self.channel = channel
+        self.content = content
+        self.transport = transport
+        self.reactions = collections.Counter()
+        self.deleted = False
+
+    def route(self):
+        return ('channel', self.channel.id if self.channel is not None else None)
+
+    def check(self):
+        if self.deleted:
+            raise not_found('Message')
+
+    async def edit(self, content=None):
+        def edit():
+            self.check()
+            if content is not None:
+                self.content = content
+            return self
+        return await self.transport.request('message_edit', self.route(), edit)
+
+    async def delete(self):
+        def delete():
+            self.check()
+            self.deleted = True
+            if self.channel is not None:
+                self.channel.messages.pop(self.id, None)
+        await self.transport.request('message_delete', self.route(), delete)
+
+    async def add_reaction(self, emoji):
+        def add():
+            self.check()
+            self.reactions[emoji] += 1
+        await self.transport.request('reaction_add', self.route(), add)
+
+    async def remove_reaction(self, emoji, user):
+        def remove():
+            self.check()
+            self.reactions[emoji] = max(0, self.reactions[emoji] - 1)
+        await self.transport.request('reaction_remove', self.route(), remove)
+
+class FakeChannel:
+    def __init__(self, id, name, guild, transport):
+        self.id = id
+        self.name = name
+        self.guild = guild
+        self.transport = transport
+        self.messages = {} # message id -> FakeMessage
+
+    async def send(self, content):
+        def send():
+            message = FakeMessage(next(ids), self, content, self.transport)
+            self.messages[message.id] = message
+            return message
+        return await self.transport.request('message_send', ('channel', self.id), send)
+
+    async def fetch_message(self, id):
+        def fetch():
+            if id not in self.messages:
+                raise not_found('Message')
+            return self.messages[id]
+        return await self.transport.request('message_fetch', ('channel', self.id), fetch)
+
+    def get_partial_message(self, id):
+        message = self.messages.get(id)
+        if message is None:
+            message = FakeMessage(id, self, None, self.transport)
+            message.deleted = True
+        return message
+
+    # Bulk delete: all or nothing, and only for 2-100 messages, like Discord's. As in discord.py,
+    # a single message is deleted on its own instead, and no messages is a no-op.
+    async def delete_messages(self, messages):
+        messages = list(messages)
+        if len(messages) == 0:
+            return
+        if len(messages) == 1:
+            return await self.get_partial_message(messages[0].id).delete()
+        if len(messages) > 100:
+            raise discord.ClientException('Can only bulk delete messages up to 100 messages')
+        def delete():
+            ids = [m.id for m in messages]
+            if any(i not in self.messages for i in ids):
+                raise not_found('Message')
+            for i in ids:
+                self.messages.pop(i).deleted = True
+        await self.transport.request('message_bulk_delete', ('channel', self.id), delete)
+
+    # Deletes up to `limit` of the newest messages that pass `check`, in bulk where it can.
+    async def purge(self, limit=100, check=None):
+        doomed = [m for m in sorted(self.messages.values(), key=lambda m: -m.id) if check is None or check(m)][:limit]
+        for i in range(0, len(doomed), 100):
+            await self.delete_messages(doomed[i:i+100])
+        return doomed
+
+# A DM command's context: replies go straight to the author.
+class FakeContext:
+    def __init__(self, author, content=''):
+        self.author = author
+        self.guild = None
+        self.message = CommandMessage(author, None, content)
+
+    async def send(self, content):
+        return await self.author.send(content)
@@ -0,0 +1,157 @@
+# Floods a handful of listings with reactions and DMs over a transport that behaves like
+# Discord's (latency, per-route and global rate limits, stray 429s), and measures how long it
+# takes codes to actually reach guests once their turn comes up, eg:
+#
+#   python -m lloidbot.simulation.load_test --hosts 10 --guests 2000 --burst 30
+import argparse
+import asyncio
+import logging
+import random
+import time
+from lloidbot import turnips
+from lloidbot.simulation.bot import SimulatedBot
+from lloidbot.simulation.clock import VirtualClockLoop
+from lloidbot.simulation.transport import Transport
+from lloidbot.simulation.workload import percentile, shutdown
+
+logger = logging.getLogger('lloid')
+
+# A transport roughly as slow and as strict as the real thing.
+def discord_like(seed=0, rate_limit_rate=0.01):
+    return Transport(latency=(0.05, 0.25), gateway_latency=(0.02, 0.1), route_rate=1.0, route_burst=5,
+        global_rate=50.0, global_burst=50, rate_limit_rate=rate_limit_rate, seed=seed)
+
+class LoadReport:
+    def __init__(self, guests, virtual, wall, confirmations, deliveries, codes, transport, outbound):
+        self.guests = guests
+        self.virtual = virtual
+        self.wall = wall
+        self.confirmations = sorted(confirmations) # seconds from reacting to being told you're queued
+        self.deliveries = sorted(deliveries) # seconds from your turn coming up to the code reaching you
+        self.codes = codes
+        self.transport = transport
+        self.outbound = outbound
+
+    @staticmethod
+    def line(name, values):
+        if len(values) == 0:
+            return f"{name}: none"
+        return f"{name}: " + ", ".join(f"p{int(p * 100)} {percentile(values, p):.2f}s" for p in (0.5, 0.9, 0.99)) + f", max {values[-1]:.2f}s"
+
+    def __str__(self):
+        lines = [
+            f"{self.codes}/{self.guests} guests got a code in {self.virtual / 60:.0f} virtual minutes ({self.wall:.1f}s)",
+            LoadReport.line("Queue confirmation", self.confirmations),
+            LoadReport.line("Code delivery", self.deliveries),
+            "REST calls:",
+        ]
+        for endpoint, stats in self.transport.items():
+            lines.append(f"  {endpoint}: {stats['requests']} requests, {stats['rate_limited']} 429s, {stats['failed']} failed, "
+                f"avg {stats['avg_latency']:.2f}s, max {stats['max_latency']:.2f}s")
+        lines.append("Outbound queue:")
+        for priority, stats in self.outbound.items():
+            if stats['sent'] > 0:
+                lines.append(f"  {priority}: {stats['sent']} sent, avg {stats['mean_latency']:.2f}s, max {stats['max_latency']:.2f}s")
+        return "\n".join(lines)
+
+class LoadTest:
+    def __init__(self, hosts=10, guests=2000, burst=30, visit=20, poll=300, no_dms=0.02, hours=4.0, transport=None, seed=0):
+        self.hosts = hosts
+        self.guests = guests
+        self.burst = burst # seconds over which every guest reacts
+        self.visit = visit # seconds each guest spends on the island before saying they're done
+        self.poll = poll # how often a waiting guest DMs queueinfo
+        self.no_dms = no_dms # share of guests who don't accept DMs
+        self.hours = hours # give up on anyone still waiting after this long
+        self.transport = transport or discord_like(seed)
+        self.random = random.Random(seed)
+        self.bot = None
+        self.reacted = {} # guest -> when they reacted
+        self.dispensed = {} # guest -> when their turn came up
+        self.confirmations = []
+        self.deliveries = []
+        self.served = {} # guest -> future resolved when they get their code
+
+    def now(self):
+        return asyncio.get_event_loop().time()
+
+    def inbox(self, user, content):
+        if content.startswith("Queued you up") and user.id in self.reacted:
+            self.confirmations.append(self.now() - self.reacted[user.id])
+        elif "NOW BOARDING" in content and user.id in self.dispensed:
+            self.deliveries.append(self.now() - self.dispensed.pop(user.id))
+            future = self.served.get(user.id)
+            if future is not None and not future.done():
+                future.set_result(True)
+
+    def on_queue_event(self, event, owner, guest):
+        if event == turnips.QueueEvent.DISPENSED:
+            self.dispensed[guest] = self.now()
+
+    async def run(self):
+        self.bot = SimulatedBot(asyncio.get_event_loop(), self.inbox, self.transport)
+        await self.bot.start_simulation()
+        for partition in self.bot.partitions.values():
+            partition.market.queue.add_listener(self.on_queue_event)
+        hosts = [self.bot.add_user(1 + i, f"host{i}") for i in range(self.hosts)]
+        guests = [self.bot.add_user(1000000 + i, f"guest{i}", accepts_dms=self.random.random() >= self.no_dms) for i in range(self.guests)]
+
+        start = self.now()
+        for i, host in enumerate(hosts):
+            await self.bot.command(host, 'host', self.random.randint(300, 600), f"D{i:04d}"[-5:], 0)
+        tasks = [asyncio.ensure_future(self.guest(guest, hosts[i % len(hosts)])) for i, guest in enumerate(guests)]
+        await asyncio.wait(tasks, timeout=self.hours * 3600)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return self.now() - start
+
+    async def guest(self, user, host):
+        await asyncio.sleep(self.random.uniform(0, self.burst))
+        served = self.served[user.id] = asyncio.get_event_loop().create_future()
+        self.reacted[user.id] = self.now()
+        await self.bot.react(user, host.id)
+        if not user.accepts_dms:
+            return
+        while not served.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(served), self.poll)
+            except asyncio.TimeoutError:
+                await self.bot.command(user, 'queueinfo')
+        await asyncio.sleep(self.visit)
+        await self.bot.command(user, 'done')
+
+def load_test(test):
+    loop = VirtualClockLoop()
+    asyncio.set_event_loop(loop)
+    try:
+        wall = time.perf_counter()
+        virtual = loop.run_until_complete(test.run())
+        wall = time.perf_counter() - wall
+        report = LoadReport(test.guests, virtual, wall, test.confirmations, test.deliveries, len(test.deliveries),
+            test.transport.stats(), test.bot.outbound.stats())
+        loop.run_until_complete(shutdown(test.bot))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+    return report
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hosts', type=int, default=10)
+    parser.add_argument('--guests', type=int, default=2000)
+    parser.add_argument('--burst', type=float, default=30, help='Seconds over which every guest reacts.')
+    parser.add_argument('--visit', type=float, default=20)
+    parser.add_argument('--poll', type=float, default=300, help='Seconds between each waiting guest DMing queueinfo.')
+    parser.add_argument('--no-dms', type=float, default=0.02, help="Share of guests who don't accept DMs.")
+    parser.add_argument('--rate-limited', type=float, default=0.01, help='Share of REST calls that get a stray 429.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='[%(asctime)s] %(levelname)s %(filename)s@%(lineno)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    logging.getLogger('lloid').setLevel(logging.ERROR)
+    print(load_test(LoadTest(hosts=args.hosts, guests=args.guests, burst=args.burst, visit=args.visit, poll=args.poll,
+        no_dms=args.no_dms, transport=discord_like(args.seed, args.rate_limited), seed=args.seed)))
+
+if __name__ == '__main__':
+    main()
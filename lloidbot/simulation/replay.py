@@ -0,0 +1,178 @@
+# Plays a trace recorded with TRACE_FILE (see trace.py) back through the bot against a fresh
+# in-memory market, either on the virtual clock (as fast as it'll go) or `speed` times faster
+# than it happened, and reports how long each kind of event took to handle and what state the
+# bot ended up in, eg:
+#
+#   python -m lloidbot.simulation.replay trace.jsonl --speed 60 --state final.json
+#
+# Timer expiries aren't fed in, since the replayed bot runs its own cooldowns; instead, the
+# number that fired is compared with the number the trace recorded.
+import argparse
+import asyncio
+import collections
+import logging
+import time
+from lloidbot import journal, trace
+from lloidbot.simulation import fakes
+from lloidbot.simulation.bot import SimulatedBot
+from lloidbot.simulation.clock import VirtualClockLoop, ScaledClockLoop
+from lloidbot.simulation.workload import percentile, shutdown
+
+logger = logging.getLogger('lloid')
+
+# Stands in for the TraceRecorder on the replayed bot, counting the events it acts on.
+class Tally:
+    def __init__(self):
+        self.counts = collections.Counter()
+
+    def record(self, event, user, **data):
+        self.counts[event] += 1
+
+class ReplayReport:
+    def __init__(self, events, span, wall, cpu, speed, latencies, skipped, failed, recorded, replayed, state):
+        self.events = events
+        self.span = span # seconds between the first and last event in the trace
+        self.wall = wall
+        self.cpu = cpu
+        self.speed = speed
+        self.latencies = {kind: sorted(values) for kind, values in latencies.items()} # event -> seconds each took to handle
+        self.skipped = skipped # reactions to listings that weren't open when they came in
+        self.failed = failed
+        self.recorded = recorded # Counter of the events in the trace
+        self.replayed = replayed # Counter of the events the replayed bot acted on
+        self.state = state # the journal's state at the end
+
+    @property
+    def guests_waiting(self):
+        return sum(len(listing['guests']) for listing in self.state['listings'].values())
+
+    def __str__(self):
+        pace = f"{self.speed:g}x" if self.speed is not None else "virtual time"
+        lines = [
+            f"Replayed {self.events} events spanning {self.span / 60:.1f} minutes in {self.wall:.1f}s at {pace} "
+                f"({self.cpu:.1f}s CPU). Skipped: {self.skipped}, failed: {self.failed}",
+            "Handling time:",
+        ]
+        for kind in trace.EVENTS:
+            values = self.latencies.get(kind)
+            if values:
+                lines.append(f"  {kind}: {len(values)}, p50 {percentile(values, 0.5) * 1000:.2f}ms, "
+                    f"p99 {percentile(values, 0.99) * 1000:.2f}ms, max {values[-1] * 1000:.2f}ms")
+        lines.append(f"Timeouts: {self.recorded['timeout']} recorded, {self.replayed['timeout']} replayed")
+        lines.append(f"Final state: {len(self.state['listings'])} listings open, {self.guests_waiting} guests in line, "
+            f"{len(self.state['departed'])} guests yet to say they're done")
+        return "\n".join(lines)
+
+class Replay:
+    def __init__(self, events, speed=None):
+        self.events = sorted(events, key=lambda e: e['t'])
+        self.speed = speed
+        self.bot = None
+        self.latencies = collections.defaultdict(list)
+        self.skipped = 0
+        self.failed = 0
+        self.hosts = {} # owner -> task replaying their latest host command
+
+    # Everyone who shows up in the trace, named after what they called themselves when hosting.
+    def users(self):
+        names = {}
+        for event in self.events:
+            names.setdefault(event['u'], f"user{event['u']}")
+            if 'owner' in event:
+                names.setdefault(event['owner'], f"user{event['owner']}")
+            if event['e'] == 'host' and event.get('name') is not None:
+                names[event['u']] = event['name']
+        return names
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        self.bot = SimulatedBot(loop)
+        guilds = sorted({e['guild'] for e in self.events if e.get('guild') is not None})
+        await self.bot.start_simulation(guild_ids=guilds or None)
+        self.bot.trace = Tally()
+        for id, name in self.users().items():
+            self.bot.add_user(id, name)
+        if len(self.events) == 0:
+            return 0
+
+        start, first = loop.time(), self.events[0]['t']
+        tasks = []
+        for event in self.events:
+            wait = start + event['t'] - first - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if event['e'] != 'timeout':
+                tasks.append(asyncio.ensure_future(self.play(event)))
+                if event['e'] == 'host':
+                    self.hosts[event['u']] = tasks[-1]
+        await asyncio.gather(*tasks)
+        return self.events[-1]['t'] - first
+
+    async def play(self, event):
+        kind, user = event['e'], self.bot.members[event['u']]
+        started = time.perf_counter()
+        try:
+            if kind == 'host':
+                self.bot.preferred_guild[user.id] = event['guild']
+                await self.bot.command(user, 'host', event['price'], event['dodo'], event['tz'], description=event.get('desc'))
+            elif kind in ('react', 'unreact'):
+                # Anyone who reacted saw the listing, so it had been posted by then.
+                if event['owner'] in self.hosts:
+                    await asyncio.wait([self.hosts[event['owner']]])
+                if not await self.bot.transport.deliver(self.reaction, kind, user, event['owner']):
+                    self.skipped += 1
+                    return
+            elif kind in trace.EVENTS:
+                await self.bot.command(user, kind)
+            else:
+                self.skipped += 1
+                return
+        except Exception:
+            logger.exception(f"Replaying {event} failed")
+            self.failed += 1
+            return
+        self.latencies[kind].append(time.perf_counter() - started)
+
+    # Whether the listing is up is only checked once the reaction's turn comes, in case the
+    # listing was closed by an event just ahead of it.
+    async def reaction(self, kind, user, owner):
+        message = self.bot.associated_message.get(owner)
+        if message is None:
+            return False
+        handler = self.bot.on_raw_reaction_add if kind == 'react' else self.bot.on_raw_reaction_remove
+        await handler(fakes.reaction(message, user))
+        return True
+
+def replay(events, speed=None):
+    loop = VirtualClockLoop() if speed is None else ScaledClockLoop(speed)
+    asyncio.set_event_loop(loop)
+    try:
+        test = Replay(events, speed)
+        wall, cpu = time.perf_counter(), time.process_time()
+        span = loop.run_until_complete(test.run())
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        report = ReplayReport(len(test.events), span, wall, cpu, speed, test.latencies, test.skipped, test.failed,
+            collections.Counter(e['e'] for e in test.events), test.bot.trace.counts, test.bot.journal.load())
+        loop.run_until_complete(shutdown(test.bot))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+    return report
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('trace', help='A trace recorded with TRACE_FILE.')
+    parser.add_argument('--speed', type=float, help='How many times faster than real time to play it back. Runs on a virtual clock if left out.')
+    parser.add_argument('--state', help='Write the final state to this file as JSON.')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='[%(asctime)s] %(levelname)s %(filename)s@%(lineno)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    logging.getLogger('lloid').setLevel(logging.ERROR)
+    report = replay(list(trace.read(args.trace)), args.speed)
+    print(report)
+    if args.state:
+        with open(args.state, 'w') as f:
+            f.write(journal.dump(report.state))
+
+if __name__ == '__main__':
+    main()
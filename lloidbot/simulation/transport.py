@@ -0,0 +1,154 @@
+import asyncio
+import collections
+import functools
+import logging
+import random
+import discord
+from lloidbot.dispatcher import TokenBucket
+
+logger = logging.getLogger('lloid')
+
+Response = collections.namedtuple('Response', ['status', 'reason'])
+
+def http_error(cls, status, reason, message=None):
+    return cls(Response(status, reason), message)
+
+# Per-endpoint tallies of what went over the fake wire.
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.rate_limited = 0 # 429s, including ones that were retried
+        self.failed = 0 # requests that raised in the end
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'rate_limited': self.rate_limited,
+            'failed': self.failed,
+            'avg_latency': self.total_latency / self.requests if self.requests > 0 else 0,
+            'max_latency': self.max_latency,
+        }
+
+# Stands in for the network between the bot and Discord, in process. Fakes make their REST calls
+# through request() and simulated users' gateway events (reactions, DMs to the bot) arrive
+# through deliver(), so both can be made slow or unreliable:
+#
+# - every REST call takes `latency` seconds (a (low, high) range) to come back;
+# - Discord's side keeps a token bucket per route, plus a global one, and answers 429 with a
+#   retry-after once one runs dry. On top of that, `rate_limit_rate` of all calls get a 429 at
+#   random, the way shared and Cloudflare limits show up. Like discord.py, the client side waits
+#   out the retry-after and tries again, giving up with an HTTPException after `max_tries`;
+# - gateway events show up `gateway_latency` seconds after they happen, in the order they happened.
+#
+# With the defaults, nothing is slow or limited and the fakes behave as if they were local.
+class Transport:
+    def __init__(self, latency=(0, 0), gateway_latency=(0, 0), route_rate=None, route_burst=5,
+            global_rate=None, global_burst=50, rate_limit_rate=0.0, retry_after=1.0, max_tries=5, seed=0):
+        self.latency = latency
+        self.gateway_latency = gateway_latency
+        self.route_rate = route_rate
+        self.route_burst = route_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst) if global_rate is not None else None
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.max_tries = max_tries
+        self.random = random.Random(seed)
+        self.buckets = {} # route -> TokenBucket
+        self.endpoints = collections.defaultdict(EndpointStats) # endpoint -> EndpointStats
+        self.events = None
+        self.gateway_task = None
+        self.last_event_at = 0
+
+    def start(self):
+        self.events = asyncio.Queue()
+        self.gateway_task = asyncio.ensure_future(self.gateway())
+
+    def stop(self):
+        if self.gateway_task is not None:
+            self.gateway_task.cancel()
+            self.gateway_task = None
+
+    def now(self):
+        return asyncio.get_event_loop().time()
+
+    def delay(self, bounds):
+        low, high = bounds
+        return low if low == high else self.random.uniform(low, high)
+
+    # Why Discord would turn a call down right now: how long to wait, or 0 if it goes through.
+    def throttle(self, route):
+        now = self.now()
+        wait = 0
+        if self.route_rate is not None:
+            bucket = self.buckets.setdefault(route, TokenBucket(self.route_rate, self.route_burst))
+            wait = max(wait, bucket.delay(now))
+        if self.global_bucket is not None:
+            wait = max(wait, self.global_bucket.delay(now))
+        if wait == 0 and self.rate_limit_rate > 0 and self.random.random() < self.rate_limit_rate:
+            wait = self.retry_after
+        if wait == 0:
+            if self.route_rate is not None:
+                self.buckets[route].take(now)
+            if self.global_bucket is not None:
+                self.global_bucket.take(now)
+        return wait
+
+    # Makes a REST call. `endpoint` names the kind of call (for the stats), `route` is what
+    # Discord rate limits it by, and `action` is a plain function that carries it out on the
+    # fakes' side, raising discord.NotFound and the like where Discord would.
+    async def request(self, endpoint, route, action):
+        stats = self.endpoints[endpoint]
+        stats.requests += 1
+        started = self.now()
+        try:
+            for attempt in range(1, self.max_tries + 1):
+                latency = self.delay(self.latency)
+                if latency > 0:
+                    await asyncio.sleep(latency)
+                wait = self.throttle(route)
+                if wait == 0:
+                    return action()
+                stats.rate_limited += 1
+                if attempt < self.max_tries:
+                    await asyncio.sleep(wait)
+            raise http_error(discord.HTTPException, 429, 'Too Many Requests', 'You are being rate limited.')
+        except Exception:
+            stats.failed += 1
+            raise
+        finally:
+            elapsed = self.now() - started
+            stats.total_latency += elapsed
+            stats.max_latency = max(stats.max_latency, elapsed)
+
+    # Hands a gateway event to `handler` after the gateway latency, and returns once the handler
+    # has run. Events start in the order they were delivered, each on its own task, the way
+    # discord.py dispatches them.
+    async def deliver(self, handler, *args, **kwargs):
+        future = asyncio.get_event_loop().create_future()
+        self.last_event_at = max(self.last_event_at, self.now() + self.delay(self.gateway_latency))
+        self.events.put_nowait((self.last_event_at, functools.partial(handler, *args, **kwargs), future))
+        return await future
+
+    async def gateway(self):
+        while True:
+            at, handler, future = await self.events.get()
+            if at > self.now():
+                await asyncio.sleep(at - self.now())
+            task = asyncio.ensure_future(handler())
+            task.add_done_callback(lambda t, future=future: Transport.settle(t, future))
+
+    @staticmethod
+    def settle(task, future):
+        if future.done():
+            return
+        if task.cancelled():
+            future.cancel()
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+
+    def stats(self):
+        return {endpoint: stats.as_dict() for endpoint, stats in sorted(self.endpoints.items())}
@@ -0,0 +1,229 @@
+import asyncio
+import bisect
+import itertools
+import logging
+import random
+import time
+from lloidbot.simulation.bot import SimulatedBot
+from lloidbot.simulation.clock import VirtualClockLoop
+
+logger = logging.getLogger('lloid')
+
+HOUR = 3600
+
+# The shape of a simulated rush. Hosts open at random over the first `open_hours` and stay open
+# for an exponentially distributed time (`host_hours` on average), asking for a pause every so
+# often. Guests turn up as a Poisson process over the whole run, each picking an open island
+# (a few popular ones get most of the traffic), and give up and unreact if they wait more than
+# `patience` seconds. Once they get a code they spend `visit` seconds on the island, and some
+# of them remember to say they're done. Hosts are spread evenly over the servers, which are
+# numbered from 1 unless `guild_ids` says otherwise.
+class Workload:
+    def __init__(self, hosts=1000, guests=20000, hours=4.0, guilds=1, open_hours=1.0, host_hours=2.0,
+            pauses_per_hour=0.3, patience=HOUR, visit=(180, 480), done_rate=0.6, popularity=1.1, seed=0, guild_ids=None):
+        self.hosts = hosts
+        self.guests = guests
+        self.hours = hours
+        self.guild_ids = list(guild_ids or range(1, guilds + 1))
+        self.guilds = len(self.guild_ids)
+        self.open_hours = open_hours
+        self.host_hours = host_hours
+        self.pauses_per_hour = pauses_per_hour
+        self.patience = patience
+        self.visit = visit
+        self.done_rate = done_rate
+        self.popularity = popularity # Zipf exponent for how guests pick islands
+        self.seed = seed
+
+def percentile(ordered, p):
+    if len(ordered) == 0:
+        return None
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+class Report:
+    def __init__(self, workload, virtual, wall, cpu, events, counts, waits, outbound):
+        self.workload = workload
+        self.virtual = virtual # seconds of simulated time
+        self.wall = wall
+        self.cpu = cpu
+        self.events = events # commands and reactions the simulated users sent
+        self.counts = counts
+        self.waits = sorted(waits) # seconds from reacting to getting the code, for everyone who got one
+        self.outbound = outbound
+
+    @property
+    def codes(self):
+        return self.counts['code']
+
+    @property
+    def throughput(self):
+        return self.codes / (self.virtual / HOUR) if self.virtual > 0 else 0
+
+    @property
+    def cpu_per_event(self):
+        return self.cpu / self.events if self.events > 0 else 0
+
+    @property
+    def speedup(self):
+        return self.virtual / self.wall if self.wall > 0 else float('inf')
+
+    def wait(self, p):
+        return percentile(self.waits, p)
+
+    def __str__(self):
+        w = self.workload
+        lines = [
+            f"{w.hosts} hosts, {w.guests} guests over {self.virtual / HOUR:.1f} virtual hours "
+                f"in {self.wall:.1f}s ({self.speedup:.0f}x real time)",
+            f"Codes sent: {self.codes} ({self.throughput:.0f}/hour). "
+                f"Gave up: {self.counts['gave_up']}, host closed: {self.counts['closed']}, "
+                f"turned away: {self.counts['turned_away']}, no island open: {self.counts['no_host']}, "
+                f"still waiting: {self.counts['waiting']}",
+        ]
+        if len(self.waits) > 0:
+            lines.append("Wait for a code: " + ", ".join(f"p{int(p * 100)} {self.wait(p) / 60:.1f} min" for p in (0.5, 0.9, 0.99))
+                + f", max {self.waits[-1] / 60:.1f} min")
+        lines.append(f"CPU: {self.cpu:.2f}s for {self.events} events ({self.cpu_per_event * 1e6:.0f} us/event), "
+            f"{sum(s['sent'] for s in self.outbound.values())} messages sent")
+        return "\n".join(lines)
+
+class Simulation:
+    def __init__(self, workload, path=':memory:', shared=False):
+        self.workload = workload
+        self.path = path
+        self.shared = shared
+        self.random = random.Random(workload.seed)
+        self.loop = None
+        self.bot = None
+        self.open = set() # owners with a listing up
+        self.outcomes = {} # guest -> future resolved with what happened to their spot in line
+        self.counts = {k: 0 for k in ('code', 'gave_up', 'closed', 'turned_away', 'no_host', 'waiting')}
+        self.waits = []
+        self.events = 0
+        # Hosts are ranked by popularity; guests pick by rank with Zipf odds.
+        weights = [1 / (rank + 1) ** workload.popularity for rank in range(workload.hosts)]
+        self.cumulative = list(itertools.accumulate(weights))
+
+    def now(self):
+        return self.loop.time()
+
+    # Everything a user is sent ends up here. Only the messages that settle a guest's wait matter.
+    def inbox(self, user, content):
+        future = self.outcomes.get(user.id)
+        if future is None or future.done():
+            return
+        if "NOW BOARDING" in content:
+            future.set_result('code')
+        elif "closed up" in content:
+            future.set_result('closed')
+        elif "in line elsewhere" in content:
+            future.set_result('turned_away')
+
+    async def run(self):
+        w = self.workload
+        self.loop = asyncio.get_event_loop()
+        self.bot = SimulatedBot(self.loop, self.inbox)
+        await self.bot.start_simulation(path=self.path, guild_ids=w.guild_ids, shared=self.shared)
+        hosts = [self.bot.add_user(1 + i, f"host{i}", w.guild_ids[i % len(w.guild_ids)]) for i in range(w.hosts)]
+        guests = [self.bot.add_user(1000000 + i, f"guest{i}") for i in range(w.guests)]
+
+        start = self.now()
+        end = start + w.hours * HOUR
+        tasks = [asyncio.ensure_future(self.host(user, end)) for user in hosts]
+        arrivals = sorted(self.random.uniform(0, w.hours * HOUR) for _ in guests)
+        tasks += [asyncio.ensure_future(self.guest(user, start + at)) for user, at in zip(guests, arrivals)]
+        await asyncio.sleep(end - start)
+
+        self.counts['waiting'] = sum(1 for f in self.outcomes.values() if not f.done())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return self.now() - start
+
+    async def command(self, user, name, *args, **kwargs):
+        self.events += 1
+        await self.bot.command(user, name, *args, **kwargs)
+
+    async def host(self, user, end):
+        w = self.workload
+        await asyncio.sleep(self.random.uniform(0, w.open_hours * HOUR))
+        closes_at = min(end, self.now() + self.random.expovariate(1 / (w.host_hours * HOUR)))
+        partition = self.bot.partitions[w.guild_ids[(user.id - 1) % len(w.guild_ids)]]
+        self.bot.preferred_guild[user.id] = partition.guild_id
+        dodo = "".join(self.random.choice("ABCDEFGHJKLMNPQRSTUVWXY0123456789") for _ in range(5))
+        await self.command(user, 'host', self.random.randint(30, 600), dodo, self.random.randint(-11, 12))
+        self.open.add(user.id)
+        try:
+            while True:
+                pause_in = self.random.expovariate(w.pauses_per_hour / HOUR) if w.pauses_per_hour > 0 else float('inf')
+                if self.now() + pause_in >= closes_at:
+                    break
+                await asyncio.sleep(pause_in)
+                await self.command(user, 'pause')
+            await asyncio.sleep(max(0, closes_at - self.now()))
+        finally:
+            self.open.discard(user.id)
+        if closes_at < end:
+            await self.command(user, 'close')
+
+    def pick_host(self):
+        if len(self.open) == 0:
+            return None
+        for _ in range(20):
+            owner = 1 + bisect.bisect(self.cumulative, self.random.random() * self.cumulative[-1])
+            if owner in self.open:
+                return owner
+        return self.random.choice(sorted(self.open))
+
+    async def guest(self, user, arrives_at):
+        w = self.workload
+        await asyncio.sleep(arrives_at - self.now())
+        owner = self.pick_host()
+        if owner is None:
+            self.counts['no_host'] += 1
+            return
+        outcome = self.outcomes[user.id] = self.loop.create_future()
+        requested = self.now()
+        self.events += 1
+        await self.bot.react(user, owner)
+        try:
+            result = await asyncio.wait_for(asyncio.shield(outcome), w.patience)
+        except asyncio.TimeoutError:
+            outcome.cancel()
+            self.counts['gave_up'] += 1
+            if owner in self.bot.associated_message:
+                self.events += 1
+                await self.bot.unreact(user, owner)
+            return
+        self.counts[result] += 1
+        if result != 'code':
+            return
+        self.waits.append(self.now() - requested)
+        await asyncio.sleep(self.random.uniform(*w.visit))
+        if self.random.random() < w.done_rate:
+            await self.command(user, 'done')
+
+# Runs the workload on a fresh virtual-clock loop and returns a Report. The database is in memory
+# unless `path` says otherwise; see start_simulation for `shared`.
+def simulate(workload, path=':memory:', shared=False):
+    loop = VirtualClockLoop()
+    asyncio.set_event_loop(loop)
+    simulation = Simulation(workload, path, shared)
+    try:
+        wall, cpu = time.perf_counter(), time.process_time()
+        virtual = loop.run_until_complete(simulation.run())
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        outbound = simulation.bot.outbound.stats()
+        loop.run_until_complete(shutdown(simulation.bot))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+    return Report(workload, virtual, wall, cpu, simulation.events, simulation.counts, simulation.waits, outbound)
+
+# Stops the dispensing loops and everything else still running, then the bot.
+async def shutdown(bot):
+    tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await bot.stop_simulation()
@@ -0,0 +1,94 @@
+import asyncio
+import functools
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from lloidbot.turnips import StalkMarket, Status, Turnip
+
+logger = logging.getLogger('lloid')
+
+# A connection to the database at `path`. A `shared` database is one that other processes write
+# to as well (see workers.py): it's switched to WAL so that they don't block each other's reads,
+# and a write that finds the database locked waits its turn for longer before giving up.
+def connect(path, shared=False):
+    db = sqlite3.connect(path, check_same_thread=False, timeout=30 if shared else 5)
+    if shared:
+        db.execute("pragma journal_mode=wal")
+        db.execute("pragma synchronous=normal")
+    return db
+
+# Wraps a StalkMarket so that everything which touches SQLite runs on a dedicated database
+# thread instead of on the event loop. A slow commit or fsync then only holds up the coroutine
+# that's waiting for it, rather than every timer, reaction and DM the bot is handling.
+#
+# The queues and the listing cache live in memory and are only ever touched from the event
+# loop: only the database work is handed to the thread, and the cache is updated with what it
+# returns once it's back on the loop. Anything that isn't overridden here is passed straight
+# through to the wrapped market.
+class AsyncMarket:
+    def __init__(self, market, executor):
+        self.market = market
+        self.executor = executor
+        self.metrics = None # times everything run on the database thread, if set
+
+    @staticmethod
+    async def open(path, chan=None, adopt=None, shared=False):
+        db, executor = await AsyncMarket.connect(path, shared)
+        return await AsyncMarket.on(db, executor, chan, adopt)
+
+    # A connection (see connect) and the database thread to use it from, for opening markets on.
+    @staticmethod
+    async def connect(path, shared=False):
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='lloid-db')
+        db = await asyncio.get_event_loop().run_in_executor(executor, connect, path, shared)
+        return db, executor
+
+    @staticmethod
+    async def on(db, executor, chan=None, adopt=None):
+        market = await asyncio.get_event_loop().run_in_executor(executor, StalkMarket, db, chan, adopt)
+        return AsyncMarket(market, executor)
+
+    # Another partition of the same table (see StalkMarket), sharing this one's connection and
+    # database thread.
+    async def partition(self, chan, adopt=None):
+        market = await self.run(StalkMarket, self.market.db, chan, adopt)
+        partition = AsyncMarket(market, self.executor)
+        partition.metrics = self.metrics
+        return partition
+
+    def __getattr__(self, name):
+        return getattr(self.market, name)
+
+    async def run(self, fn, *args, **kwargs):
+        call = functools.partial(fn, *args, **kwargs)
+        if self.metrics is not None:
+            call = self.metrics.timed(getattr(fn, '__name__', 'run'), call)
+        return await asyncio.get_event_loop().run_in_executor(self.executor, call)
+
+    # Like StalkMarket.get, but a cache miss is looked up on the database thread.
+    async def get(self, idx, chan=None):
+        turnip = self.market.cached(idx, chan or self.market.chan)
+        if turnip is not None:
+            self.market.hits += 1
+            return turnip
+        self.market.misses += 1
+        turnip = await self.run(self.market.load, idx, chan)
+        return self.market.cache(turnip) if isinstance(turnip, Turnip) else turnip
+
+    async def declare(self, idx, name, price, dodo=None, tz=None, description=None, chan=None):
+        current = await self.get(idx, chan)
+        status, turnip = await self.run(self.market.write, idx, name, price, dodo, tz, description, chan, current)
+        if status != Status.SUCCESS:
+            return status
+
+        self.market.cache(turnip)
+        return self.market.queue.new_queue(idx)
+
+    async def wipe_old_prices(self):
+        wiped = await self.run(self.market.wipe, list(self.market.queue.queues))
+        self.market.forget_prices(wiped)
+        return len(wiped)
+
+    async def close_db(self):
+        await self.run(self.market.db.close)
+        self.executor.shutdown(wait=False)
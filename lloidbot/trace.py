@@ -0,0 +1,41 @@
+import json
+import logging
+import time
+
+logger = logging.getLogger('lloid')
+
+# An append-only record of every inbound event the bot acted on, so that a rush that went wrong
+# can be played back later (see simulation/replay.py) instead of pieced together from the logs.
+# One compact JSON object per line:
+#
+#   {"t":1712345678.901,"e":"host","u":123,"guild":1,"name":"Nook","price":150,"dodo":"D0D0X","tz":8,"desc":null}
+#   {"t":1712345679.120,"e":"react","u":456,"owner":123,"guild":1}
+#
+# `t` is when it happened, `e` what happened and `u` who did it (for timeouts, the host whose
+# cooldown ran out). Events are host, close, done, next, pause, react, unreact and timeout.
+EVENTS = ('host', 'close', 'done', 'next', 'pause', 'react', 'unreact', 'timeout')
+
+class TraceRecorder:
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self.file = open(path, 'a', buffering=1, encoding='utf-8') # line buffered, so a crash loses at most the last event
+        self.recorded = 0
+
+    def record(self, event, user, **data):
+        self.file.write(json.dumps({'t': round(self.clock(), 3), 'e': event, 'u': user, **data}, separators=(',', ':')) + "\n")
+        self.recorded += 1
+
+    def close(self):
+        self.file.close()
+
+# Yields the events in a trace. A line cut short by a crash is skipped rather than failing the whole read.
+def read(path):
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if line.strip() == "":
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping unreadable line {number} of {path}")
@@ -1,8 +1,12 @@
 import sqlite3
-from datetime import datetime, timedelta
+from array import array
+from datetime import datetime, timedelta, date
 import queue
 import logging
 import enum
+import json
+import time
+from lloidbot.guest_queue import GuestQueue
 
 logger = logging.getLogger('lloid')
 
@@ -26,9 +30,33 @@ intervals = {
 def current_datetime(offset):
     return datetime.utcnow() + timedelta(hours=offset)
 
-def compute_current_interval(offset):
-    local = current_datetime(offset)
+# The columns that make up a Turnip, in the order Turnip.from_row expects them.
+listing_columns = "chan, id, nick, dodo, utcoffset, description, latest_time, val1a, val1b, val2a, val2b, val3a, val3b, val4a, val4b, val5a, val5b, val6a, val6b, val7a, val7b"
+
+price_columns = listing_columns.split(", ")[7:]
+
+# Anything declared without saying which channel it belongs to goes here.
+default_chan = 'global'
+
+# Weeks are numbered from the Monday the Unix epoch falls in, since prices reset on Mondays.
+first_monday = date(1970, 1, 5)
+all_offsets = range(-12, 15)
 
+def week_number(local):
+    return (local.date() - first_monday).days // 7
+
+# Seconds until the next week starts in whichever of the given offsets gets there first.
+def seconds_until_rollover(offsets=all_offsets):
+    soonest = None
+    for offset in offsets:
+        local = current_datetime(offset)
+        monday = datetime.combine(local.date(), datetime.min.time()) + timedelta(days=7 - local.weekday())
+        remaining = (monday - local).total_seconds()
+        if soonest is None or remaining < soonest:
+            soonest = remaining
+    return soonest
+
+def interval_at(local):
     day_of_week = local.weekday() + 1
     interval = "a"
     #if day_of_week >= 7 or day_of_week <= 0:
@@ -37,7 +65,44 @@ def compute_current_interval(offset):
         interval = "b"
     return str(day_of_week) + interval, local.weekday()*2
 
+# Remembers the current interval for each offset along with the (UTC) half-day it's good for,
+# so that pricing a whole board of listings is mostly dict lookups. An entry is recomputed as
+# soon as the clock leaves its half-day in either direction, which keeps it honest under
+# freezegun as well as in real time.
+class IntervalClock:
+    half_day = 12 * 60 * 60
+
+    def __init__(self):
+        self.intervals = {} # offset -> (interval, index, valid from, valid until)
+
+    def interval(self, offset):
+        now = time.time()
+        entry = self.intervals.get(offset)
+        if entry is not None and entry[2] <= now < entry[3]:
+            return entry[0], entry[1]
+
+        local = current_datetime(offset)
+        start = local.replace(hour=0 if local.hour < 12 else 12, minute=0, second=0, microsecond=0)
+        valid_from = now - (local - start).total_seconds()
+        interval, index = interval_at(local)
+        self.intervals[offset] = (interval, index, valid_from, valid_from + IntervalClock.half_day)
+        return interval, index
+
+clock = IntervalClock()
+
+def compute_current_interval(offset):
+    return clock.interval(offset)
+
+# A single user's listing. Since every known listing is kept in memory, this is kept small:
+# there's no per-instance __dict__, and the 14 half-day prices are packed into a fixed-width
+# array, with missing prices stored as a sentinel value. Reading `history` still gives the
+# familiar list of ints and Nones.
 class Turnip:
+    __slots__ = ('chan', 'id', 'name', 'dodo', 'gmtoffset', 'description', 'latest_time', 'prices')
+
+    MISSING = -2**31
+    MAX_PRICE = 2**31 - 1 # real prices top out in the hundreds, but placeholder prices can be anything that fits
+
     def __init__(self, chan, idx, name, dodo, gmtoffset, description, latest_time, history):
         self.chan = chan
         self.id = idx
@@ -48,51 +113,138 @@ class Turnip:
         self.latest_time = latest_time
         self.history = history
 
+    @property
+    def history(self):
+        return [None if p == Turnip.MISSING else p for p in self.prices]
+
+    @history.setter
+    def history(self, history):
+        prices = array('i', [Turnip.MISSING]) * len(intervals)
+        for i, p in enumerate(history[:len(intervals)]):
+            if p is not None:
+                prices[i] = int(p)
+        self.prices = prices
+
+    def price_at(self, index):
+        p = self.prices[index]
+        return None if p == Turnip.MISSING else p
+
     def clone(self):
-        return Turnip(self.chan, self.id, self.name, self.dodo, self.gmtoffset, self.description, self.latest_time, self.history)
+        t = Turnip(self.chan, self.id, self.name, self.dodo, self.gmtoffset, self.description, self.latest_time, ())
+        t.prices = array('i', self.prices)
+        return t
+
+    def key(self):
+        return (self.chan, self.id, self.name, self.dodo, self.gmtoffset, self.description, self.prices.tobytes())
 
-    def equals(self, t):
-        return self.chan == t.chan and self.id == t.id and self.name == t.name and \
-               self.dodo == t.dodo and self.gmtoffset == t.gmtoffset and \
-               self.description == t.description and self.history == t.history
+    def __eq__(self, t):
+        if not isinstance(t, Turnip):
+            return NotImplemented
+        return self.key() == t.key()
+
+    def __hash__(self):
+        return hash(self.key())
     
     def current_time(self):
         return current_datetime(self.gmtoffset)
 
     def current_price(self):
         interval, _ = compute_current_interval(self.gmtoffset)
-        return self.history[intervals[interval]]
+        return self.price_at(intervals[interval])
 
     def __str__(self):
         return "%s - %s - %s - %s - %s - %s" % (self.chan, self.name, self.dodo, self.gmtoffset, self.description, self.history)
     
     @staticmethod
     def from_row(row):
-        return Turnip(row[0], row[1], row[2], row[3], row[4], row[5], row[6], list(row[7:]))
-
+        return Turnip(row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7:])
+
+# Listings are cached in memory and written through on every change, so the only time the
+# database is read is on a cold start (or for rows that something else wrote behind our back).
+#
+# A market given a chan is one server's partition of the table: it only reads and writes the
+# listings under that chan, and has queues of its own. Several partitions can share a connection.
+#
+# `adopt` names another chan whose listings (and archived weekly bests) are moved under this
+# one on startup, eg: to hand a single-server deployment's listings to that server's partition.
+# Listings this chan already has for the same users are kept, and the others are left behind.
 class StalkMarket:
-    def __init__(self, db: sqlite3.Connection):
+    def __init__(self, db: sqlite3.Connection, chan=None, adopt=None):
         self.db = db
+        self.chan = chan
+        self.adopt = adopt
+        self.listings = {} # (chan, id) -> Turnip
+        self.listing_chans = {} # id -> chan, for lookups that don't specify a channel
+        self.hits = 0
+        self.misses = 0
         self.db_init()
         self.queue = Queue(self)
 
     def db_init(self):
         self.db.execute("""create table if not exists turnips(chan, id, nick, dodo, utcoffset, description, latest_time, val1a, val1b, val2a, val2b, val3a, val3b, val4a, val4b, val5a, val5b, val6a, val6b, val7a, val7b,
-                primary key(chan, id))""")
+                latest_week integer, primary key(chan, id))""")
+
+        columns = [c[1] for c in self.db.execute("pragma table_info(turnips)").fetchall()]
+        if 'latest_week' not in columns:
+            # Tables created before weeks were tracked: derive them from the local date in latest_time.
+            self.db.execute("alter table turnips add column latest_week integer")
+            self.db.execute("update turnips set latest_week = cast((julianday(substr(latest_time, 1, 10)) - julianday(?)) as integer) / 7 "
+                "where latest_time is not null", (first_monday.isoformat(),))
+        self.db.execute("create index if not exists turnips_week on turnips(utcoffset, latest_week)")
+        # Lookups that don't name a chan (see get) would otherwise scan the whole table.
+        self.db.execute("create index if not exists turnips_id on turnips(id)")
+        # Each listing's best price of every finished week, kept for comparing weeks.
+        self.db.execute("create table if not exists turnip_weeks(chan, id, week integer, best integer, primary key(chan, id, week))")
+        # Rows with no channel can never conflict on (chan, id), so give them the default one.
+        self.db.execute("update or ignore turnips set chan=? where chan is null", (default_chan,))
+        if self.adopt is not None and self.chan is not None and self.adopt != self.chan:
+            moved = self.db.execute("update or ignore turnips set chan=? where chan=?", (self.chan, self.adopt)).rowcount
+            self.db.execute("update or ignore turnip_weeks set chan=? where chan=?", (self.chan, self.adopt))
+            left = self.db.execute("select count(*) from turnips where chan=?", (self.adopt,)).fetchone()[0]
+            if moved > 0 or left > 0:
+                logger.warning(f"Moved {moved} listings from {self.adopt} to {self.chan}; {left} already had a listing there and were left behind")
+
+        # Last week's prices aren't wiped here: whoever opens the market does that once the listings
+        # still open from before a restart are known, so that their dodo codes survive the wipe.
+        self.db.commit()
 
-        self.wipe_old_prices()
+        for t in self.get_all(self.chan):
+            self.cache(t)
 
-        self.db.commit()
+    def cache(self, turnip):
+        self.listings[(turnip.chan, turnip.id)] = turnip
+        self.listing_chans.setdefault(turnip.id, turnip.chan)
+        return turnip
+
+    def cached(self, idx, chan=None):
+        if chan is None:
+            if idx not in self.listing_chans:
+                return None
+            chan = self.listing_chans[idx]
+        return self.listings.get((chan, idx))
 
     def has_listing(self, author):
         return author in self.queue.queues
 
     def get(self, idx, chan=None):
+        chan = chan or self.chan
+        turnip = self.cached(idx, chan)
+        if turnip is not None:
+            self.hits += 1
+            return turnip
+        self.misses += 1
+        turnip = self.load(idx, chan)
+        return self.cache(turnip) if isinstance(turnip, Turnip) else turnip
+
+    # Reads a listing straight from the database, leaving the cache alone, so that it can be run
+    # on the database thread (see storage.AsyncMarket) while the cache stays on the event loop.
+    def load(self, idx, chan=None):
+        chan = chan or self.chan
         results = None
         if chan is not None:
-            results = self.db.execute("select chan, id, nick, dodo, utcoffset, description, latest_time, val1a, val1b, val2a, val2b, val3a, val3b, val4a, val4b, val5a, val5b, val6a, val6b, val7a, val7b from turnips where chan=? and id=?", (chan,idx)).fetchall()
+            results = self.db.execute("select " + listing_columns + " from turnips where chan=? and id=?", (chan,idx)).fetchall()
         else:
-            results = self.db.execute("select chan, id, nick, dodo, utcoffset, description, latest_time, val1a, val1b, val2a, val2b, val3a, val3b, val4a, val4b, val5a, val5b, val6a, val6b, val7a, val7b from turnips where id=?", (idx,)).fetchall()
+            results = self.db.execute("select " + listing_columns + " from turnips where id=?", (idx,)).fetchall()
 
         if results is None:
             return []
@@ -117,13 +269,35 @@ class StalkMarket:
         return self.queue.close(owner)
 
     def declare(self, idx, name, price, dodo=None, tz=None, description=None, chan=None):
-        turnip = self.get(idx, chan)
-        if tz is None: 
-            if turnip is None or turnip.gmtoffset is None:
-                return Status.TIMEZONE_REQUIRED
-            tz = turnip.gmtoffset
+        status, _ = self.save(idx, name, price, dodo, tz, description, chan)
+        if status != Status.SUCCESS:
+            return status
+
+        return self.queue.new_queue(idx)
 
-        interval, _ = compute_current_interval(tz)
+    # Writes the listing to the database and the cache without touching the queues.
+    # Returns the status along with the listing as it now stands.
+    def save(self, idx, name, price, dodo=None, tz=None, description=None, chan=None):
+        status, turnip = self.write(idx, name, price, dodo, tz, description, chan, self.get(idx, chan))
+        return status, self.cache(turnip) if turnip is not None else None
+
+    # The database half of save, given the listing as it stood (`turnip`, or None if there wasn't
+    # one). Touches neither the queues nor the cache, so that it can be run on the database thread.
+    # This is a single upsert: anything left out of the declaration (dodo, timezone, a blank
+    # description) keeps its stored value.
+    def write(self, idx, name, price, dodo=None, tz=None, description=None, chan=None, turnip=None):
+        chan = chan or self.chan
+        if chan is None:
+            chan = turnip.chan if turnip is not None else default_chan
+
+        if tz is None:
+            if turnip is None or turnip.gmtoffset is None:
+                return Status.TIMEZONE_REQUIRED, None
+            interval, _ = compute_current_interval(turnip.gmtoffset)
+            latest_time = current_datetime(turnip.gmtoffset)
+        else:
+            interval, _ = compute_current_interval(tz)
+            latest_time = current_datetime(tz)
         #if interval == '7a' or interval == '7b':
         #    return Status.ITS_SUNDAY
 
@@ -131,21 +305,20 @@ class StalkMarket:
 
         if dodo is None:
             if turnip is None or turnip.gmtoffset is None:
-                return Status.DODO_REQUIRED
-            dodo = turnip.dodo
-
-        if turnip is None:
-            self.db.execute("replace into turnips(chan, id, nick, dodo," + field + ", utcoffset, description, latest_time) values"
-                    " (?,?,?,?,?,?,?,?)", (chan, idx, name, dodo, price, tz, description, current_datetime(tz)))
-        else:
-            if description is None or description.strip() == "":
-                description = turnip.description
-            self.db.execute("update turnips set " + field + "=?, dodo=?, utcoffset=?, description=?, latest_time=? where id=? ", 
-                (price, dodo, tz, description, current_datetime(tz), idx))
-
+                return Status.DODO_REQUIRED, None
+
+        row = self.db.execute("insert into turnips(chan, id, nick, dodo, utcoffset, description, latest_time, latest_week, " + field + ") "
+            "values (?,?,?,?,?,?,?,?,?) "
+            "on conflict(chan, id) do update set " + field + "=excluded." + field + ", "
+            "dodo=coalesce(excluded.dodo, turnips.dodo), "
+            "utcoffset=coalesce(excluded.utcoffset, turnips.utcoffset), "
+            "description=coalesce(nullif(trim(excluded.description), ''), turnips.description), "
+            "latest_time=excluded.latest_time, latest_week=excluded.latest_week "
+            "returning " + listing_columns,
+            (chan, idx, name, dodo, tz, description, str(latest_time), week_number(latest_time), price)).fetchone()
         self.db.commit()
 
-        return self.queue.new_queue(idx)
+        return Status.SUCCESS, Turnip.from_row(row)
 
     def exists(self, user, chan=None):
         r = self.get_all(chan)
@@ -157,25 +330,61 @@ class StalkMarket:
     def get_all(self, chan=None):
         results = None
         if chan is not None:
-            results = self.db.execute("select chan, id, nick, dodo, utcoffset, description, latest_time, val1a, val1b, val2a, val2b, val3a, val3b, val4a, val4b, val5a, val5b, val6a, val6b, val7a, val7b from turnips where chan=?", (chan,)).fetchall()
+            results = self.db.execute("select " + listing_columns + " from turnips where chan=?", (chan,)).fetchall()
         else:
-            results = self.db.execute("select chan, id, nick, dodo, utcoffset, description, latest_time, val1a, val1b, val2a, val2b, val3a, val3b, val4a, val4b, val5a, val5b, val6a, val6b, val7a, val7b from turnips ").fetchall()
+            results = self.db.execute("select " + listing_columns + " from turnips ").fetchall()
 
         if results is None:
             return []
         else:
             return [Turnip.from_row(r) for r in results]
 
+    # Clears last week's prices (and dodo codes, which will have long expired) with one
+    # UPDATE per timezone offset, using the (utcoffset, latest_week) index to find stale rows.
+    # Wiped rows are moved into the current week so they aren't matched again. Each listing's
+    # best price of the week is archived into turnip_weeks first. Hosts whose listing is still
+    # open across the rollover keep their dodo code, since guests in line are still being sent it.
     def wipe_old_prices(self):
-        # day = 24 * 60 * 60 # seconds
-        # week = 7 * day
-        turnips = self.get_all()
-        for t in turnips:
-            latest = datetime.strptime(t.latest_time, "%Y-%m-%d %H:%M:%S.%f")
-            if latest.weekday() > current_datetime(t.gmtoffset).weekday() or (current_datetime(t.gmtoffset) - latest).days > 6:
-                print ("wiping")
-                self.db.execute("update turnips set val1a=NULL, val1b=NULL, val2a=NULL, val2b=NULL, val3a=NULL, val3b=NULL, val4a=NULL, val4b=NULL, val5a=NULL, val5b=NULL, val6a=NULL, val6b=NULL, val7a=NULL, val7b=NULL, dodo=NULL where id=?", (t.id,) )
+        wiped = self.wipe(list(self.queue.queues))
+        self.forget_prices(wiped)
+        return len(wiped)
+
+    # The database half of wipe_old_prices, leaving the cache alone so that it can be run on the
+    # database thread. `open_owners` are the ids whose dodo codes to keep. Returns the (chan, id,
+    # dodo) of every listing it wiped.
+    def wipe(self, open_owners=()):
+        partition, args = ("", ()) if self.chan is None else (" and chan=?", (self.chan,))
+        offsets = [r[0] for r in self.db.execute("select distinct utcoffset from turnips where utcoffset is not null" + partition, args).fetchall()]
+        wiped = []
+        for offset in offsets:
+            week = week_number(current_datetime(offset))
+            self.db.execute("insert or replace into turnip_weeks(chan, id, week, best) "
+                "select chan, id, latest_week, max(" + ", ".join(f"coalesce({c}, 0)" for c in price_columns) + ") from turnips "
+                "where utcoffset=? and latest_week<?" + partition + " and coalesce(" + ", ".join(price_columns) + ") is not null",
+                (offset, week) + args)
+            wiped += self.db.execute("update turnips set val1a=NULL, val1b=NULL, val2a=NULL, val2b=NULL, val3a=NULL, val3b=NULL, val4a=NULL, val4b=NULL, "
+                "val5a=NULL, val5b=NULL, val6a=NULL, val6b=NULL, val7a=NULL, val7b=NULL, latest_week=?, "
+                "dodo=case when id in (select value from json_each(?)) then dodo end "
+                "where utcoffset=? and latest_week<?" + partition + " returning chan, id, dodo",
+                (week, json.dumps(list(open_owners)), offset, week) + args).fetchall()
         self.db.commit()
+        if len(wiped) > 0:
+            logger.info(f"Wiped last week's prices for {len(wiped)} listings")
+        return [tuple(row) for row in wiped]
+
+    # Brings the cache in line with a wipe.
+    def forget_prices(self, wiped):
+        for chan, idx, dodo in wiped:
+            if (chan, idx) in self.listings:
+                t = self.listings[(chan, idx)].clone()
+                t.history = [None]*14
+                t.dodo = dodo
+                self.listings[(chan, idx)] = t
+
+    # (week, best price) for every listing's archived weeks since `since`, oldest first.
+    def weekly_bests(self, since):
+        partition, args = ("", ()) if self.chan is None else (" and chan=?", (self.chan,))
+        return self.db.execute("select week, best from turnip_weeks where week>=?" + partition + " order by week", (since,) + args).fetchall()
 
 class Status(enum.Enum):
     SUCCESS = 0
@@ -188,20 +397,47 @@ class Status(enum.Enum):
     ALREADY_OPEN = 7
     QUEUE_EMPTY = 8
 
+# Changes to the queues that listeners registered with Queue.add_listener get told about.
+# Each one is delivered as listener(event, owner, guest), with guest being None for events
+# that concern the whole line.
+class QueueEvent(enum.Enum):
+    OPENED = 0
+    REQUESTED = 1
+    FORFEITED = 2
+    DISPENSED = 3
+    CLOSED = 4
+
 class Queue:
     def __init__(self, market):
         self.market = market
         self.queues = {}
         self.requesters = {} # person requesting access -> owner they're requesting for
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def notify(self, event, owner, guest=None):
+        for listener in self.listeners:
+            listener(event, owner, guest)
     
     def new_queue(self, owner):
         if owner in self.queues:
             return Status.ALREADY_OPEN
 
-        self.queues[owner] = []
+        self.queues[owner] = GuestQueue(owner)
+        self.notify(QueueEvent.OPENED, owner)
 
         return Status.SUCCESS
 
+    # Puts a line back the way it was (eg: after a restart) without telling the listeners.
+    def restore(self, owner, guests):
+        if owner not in self.queues:
+            self.queues[owner] = GuestQueue(owner)
+        for guest in guests:
+            if guest not in self.requesters and self.queues[owner].append(guest):
+                self.requesters[guest] = owner
+
     def request(self, guest, owner):
         if guest in self.requesters:
             return False
@@ -209,23 +445,33 @@ class Queue:
         
         if owner not in self.queues:
             return False
-        self.queues[owner] += [(guest, owner)]
+        self.queues[owner].append(guest)
+        self.notify(QueueEvent.REQUESTED, owner, guest)
 
         return True
 
     def forfeit(self, guest):
         if guest not in self.requesters:
             return False
-        owner = self.requesters[guest]
-
-        while owner in self.queues and (guest, owner) in self.queues[owner]:
-            self.queues[owner].remove( (guest, owner) )
+        owner = self.requesters.pop(guest)
 
-        while guest in self.requesters:
-            del self.requesters[guest]
+        if owner in self.queues and self.queues[owner].remove(guest):
+            self.notify(QueueEvent.FORFEITED, owner, guest)
 
         return True
 
+    # Returns (owner, number of guests ahead, size of the line) for a queued guest, or None
+    # if they aren't waiting in any line.
+    def position(self, guest):
+        owner = self.requesters.get(guest)
+        if owner not in self.queues:
+            return None
+        q = self.queues[owner]
+        ahead = q.position(guest)
+        if ahead is None:
+            return None
+        return owner, ahead, len(q)
+
     def next(self, owner):
         t = self.market.get(owner)
         name = "???"
@@ -239,32 +485,22 @@ class Queue:
             return None, Status.QUEUE_EMPTY
         
         logger.info(f"{name}'s queue has content")
-        q = self.queues[owner].pop(0)
-
-        if q is None:
-            logger.info(f"{name}'s queue had [None] in it, so start the closing procedure")
-            return None, Status.ALREADY_CLOSED
-        guest, _ = q
+        guest, _ = self.queues[owner].popleft()
 
         if guest in self.requesters:
             del self.requesters[guest]
+        self.notify(QueueEvent.DISPENSED, owner, guest)
 
         logger.info(f"returning {name}'s next guest'")
-        return (guest, self.market.get(owner)), Status.SUCCESS
+        return (guest, t), Status.SUCCESS
 
     def close(self, owner):
         if owner not in self.queues:
             return None, Status.ALREADY_CLOSED
-        q = self.queues[owner]
-        remaining = [qq[0] for qq in q]
-
-        while len(q) > 0:
-            g, _ = q.pop(0)
-            while g in self.requesters:
-                del self.requesters[g]
+        remaining = self.queues.pop(owner).clear()
 
-        self.queues[owner] += [None]
-        del self.queues[owner]
+        for g in remaining:
+            self.requesters.pop(g, None)
+        self.notify(QueueEvent.CLOSED, owner)
 
         return remaining, Status.SUCCESS
-    
\ No newline at end of file
@@ -0,0 +1,304 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+logger = logging.getLogger('lloid')
+
+# Worker mode: instead of one process doing everything, the bot runs as WORKERS processes. Each
+# one connects to its own share of the gateway shards, so a server belongs to whichever worker has
+# its shard, and that worker owns the server's partition: its lines, cooldowns and dispensing
+# loops. Everything a server does (reactions on its listings, its timers, the codes it hands out)
+# happens in that worker alone. They all share the one SQLite database, in WAL mode.
+#
+# Commands are the exception, since DMs all arrive on shard 0 and a user isn't tied to any one
+# server. Whichever worker a command comes in on asks the others (over a Unix socket each, one
+# JSON object per line) what they know about the user, and hands the message to the worker that
+# has their listing, their spot in line and so on. A guest can only wait in one line, so before
+# queueing someone a worker checks that none of the others has them in line already. Two
+# reactions on different workers' servers at the very same moment can still both get through.
+
+# Which shard a server's events come in on, the way Discord assigns them.
+def shard_of(guild_id, shard_count):
+    return (guild_id >> 22) % shard_count
+
+def shards_for(worker, workers, shard_count):
+    return [shard for shard in range(shard_count) if shard % workers == worker]
+
+# The commands that can be about a listing or line on another worker. The others (stats, and
+# market in a server) are always answered where they came in.
+ROUTED = {'queueinfo', 'market', 'close', 'done', 'next', 'pause', 'host', 'predict', 'server'}
+
+# What a worker knows about the user, for picking where their command runs.
+def claim(bot, user):
+    if getattr(bot, 'deliveries', None) is None: # not ready yet
+        return {'hosting': False, 'line': False, 'departed': False, 'preferred': False, 'guilds': []}
+    return {
+        'hosting': user in bot.hosting,
+        'line': bot.line_of(user) is not None,
+        'departed': user in bot.recently_departed,
+        'preferred': bot.preferred_guild.get(user) in bot.partitions,
+        'guilds': [[p.guild_id, p.channel.guild.name] for p in bot.mutual_partitions(user)],
+    }
+
+# Which worker should run the command, given the claims of every worker that answered (worker ->
+# claim). `rest` is whatever followed the command's name. None means it doesn't matter, so it runs
+# wherever it came in; that's also where the user is told if they need to pick a server.
+def pick(command, claims, in_guild=False, rest=''):
+    def first(key):
+        return next((w for w in sorted(claims) if claims[w][key]), None)
+
+    if in_guild and command != 'queueinfo':
+        return None
+    if command in ('close', 'next', 'pause'):
+        return first('hosting')
+    elif command == 'done':
+        return first('departed')
+    elif command == 'queueinfo':
+        return first('line')
+    elif command == 'server':
+        name = rest.strip().lower()
+        return next((w for w in sorted(claims) if any(n.lower() == name for _, n in claims[w]['guilds'])), None)
+    elif command in ('host', 'predict', 'market'):
+        for key in ('hosting', 'preferred'):
+            if first(key) is not None:
+                return first(key)
+        sharing = [w for w in sorted(claims) if len(claims[w]['guilds']) > 0]
+        return sharing[0] if len(sharing) == 1 else None
+    return None
+
+# The parts of a gateway MESSAGE_CREATE that discord.py needs to build the message again on
+# another worker (see Lloid.run_forwarded).
+def message_payload(message):
+    author = message.author
+    data = {
+        'id': str(message.id),
+        'channel_id': str(message.channel.id),
+        'author': {'id': str(author.id), 'username': author.name, 'discriminator': author.discriminator,
+            'global_name': author.global_name, 'avatar': None, 'bot': author.bot},
+        'content': message.content,
+        'timestamp': message.created_at.isoformat(),
+        'edited_timestamp': None,
+        'tts': False,
+        'mention_everyone': False,
+        'mentions': [],
+        'mention_roles': [],
+        'attachments': [],
+        'embeds': [],
+        'pinned': False,
+        'type': 0,
+    }
+    if message.guild is not None:
+        data['guild_id'] = str(message.guild.id)
+    return data
+
+class WorkerError(Exception):
+    pass
+
+# This worker's end of the IPC: a server the others connect to, and a connection to each of them.
+class Workers:
+    def __init__(self, bot, index, count, directory, timeout=10):
+        self.bot = bot
+        self.index = index
+        self.count = count
+        self.directory = directory # where the sockets live, one per worker
+        self.timeout = timeout
+        self.server = None
+        self.serving = {} # task answering a connection from another worker -> its writer
+        self.peers = {} # worker -> future of the writer for our connection to it
+        self.pending = {} # request id -> (worker, future of the reply)
+        self.ids = itertools.count()
+        self.forwarded = set() # commands other workers handed us that are still running
+
+    def path(self, worker):
+        return os.path.join(self.directory, f"worker-{worker}.sock")
+
+    def owns(self, guild_id):
+        return shard_of(guild_id, self.bot.shard_count) in self.bot.shard_ids
+
+    async def start(self):
+        path = self.path(self.index)
+        if os.path.exists(path):
+            os.remove(path)
+        self.server = await asyncio.start_unix_server(self.serve, path)
+        logger.info(f"Worker {self.index} of {self.count} listening on {path}")
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        for peer in list(self.peers.values()):
+            if peer.done() and peer.exception() is None:
+                peer.result().close()
+        self.peers.clear()
+        for writer in self.serving.values():
+            writer.close()
+        await asyncio.gather(*self.serving, return_exceptions=True)
+        if os.path.exists(self.path(self.index)):
+            os.remove(self.path(self.index))
+
+    # Requests on a connection are answered one at a time, in the order they were sent.
+    async def serve(self, reader, writer):
+        task = asyncio.current_task()
+        self.serving[task] = writer
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = json.loads(line)
+                try:
+                    reply = {'result': await self.handle(request['method'], **request['args'])}
+                except Exception as ex:
+                    logger.exception(f"Worker {self.index} couldn't handle {request['method']}")
+                    reply = {'error': f"{type(ex).__name__}: {ex}"}
+                reply['id'] = request['id']
+                writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            del self.serving[task]
+            writer.close()
+
+    async def handle(self, method, **args):
+        if method == 'claim':
+            return claim(self.bot, args['user'])
+        elif method == 'in_line':
+            return self.bot.line_of(args['user']) is not None
+        elif method == 'forget_preference':
+            self.bot.preferred_guild.pop(args['user'], None)
+            return None
+        elif method == 'run':
+            # Only acknowledged here: the command itself can take a while, and the requests behind
+            # it on this connection shouldn't have to wait for it.
+            self.bot.remember_remote_guilds(args['user'], args['others'])
+            task = asyncio.ensure_future(self.bot.run_forwarded(args['payload']))
+            self.forwarded.add(task)
+            task.add_done_callback(self.forwarded.discard)
+            return None
+        raise WorkerError(f"Unknown method {method}")
+
+    async def connection(self, worker):
+        if worker not in self.peers:
+            self.peers[worker] = asyncio.ensure_future(self.connect(worker))
+        try:
+            return await self.peers[worker]
+        except OSError:
+            self.peers.pop(worker, None)
+            raise
+
+    async def connect(self, worker):
+        reader, writer = await asyncio.open_unix_connection(self.path(worker))
+        asyncio.ensure_future(self.read_replies(worker, reader))
+        return writer
+
+    async def read_replies(self, worker, reader):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = json.loads(line)
+                _, future = self.pending.pop(reply['id'], (None, None))
+                if future is None or future.done():
+                    continue
+                if 'error' in reply:
+                    future.set_exception(WorkerError(reply['error']))
+                else:
+                    future.set_result(reply['result'])
+        except ConnectionError:
+            pass
+        finally:
+            self.peers.pop(worker, None)
+            for id, (w, future) in list(self.pending.items()):
+                if w == worker:
+                    del self.pending[id]
+                    if not future.done():
+                        future.set_exception(WorkerError(f"Lost the connection to worker {worker}"))
+
+    async def call(self, worker, method, **args):
+        if worker == self.index:
+            return await self.handle(method, **args)
+        writer = await self.connection(worker)
+        id = next(self.ids)
+        future = asyncio.get_event_loop().create_future()
+        self.pending[id] = (worker, future)
+        writer.write(json.dumps({'id': id, 'method': method, 'args': args}).encode() + b'\n')
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            self.pending.pop(id, None)
+
+    # Asks every worker, this one included. Workers that can't be reached are left out.
+    async def ask_all(self, method, **args):
+        answers = await asyncio.gather(*(self.call(w, method, **args) for w in range(self.count)), return_exceptions=True)
+        results = {}
+        for worker, answer in enumerate(answers):
+            if isinstance(answer, Exception):
+                logger.warning(f"Worker {worker} didn't answer {method}: {answer!r}")
+            else:
+                results[worker] = answer
+        return results
+
+    async def in_line_elsewhere(self, user):
+        others = [w for w in range(self.count) if w != self.index]
+        answers = await asyncio.gather(*(self.call(w, 'in_line', user=user) for w in others), return_exceptions=True)
+        return any(answer is True for answer in answers)
+
+    # Works out where the user's command should run. Returns the worker, and the servers the user
+    # shares with the bot on every other worker, so that whoever runs it knows what it can't see.
+    async def route(self, user, command, in_guild=False, rest=''):
+        if command not in ROUTED or (in_guild and command != 'queueinfo'):
+            return self.index, []
+        claims = await self.ask_all('claim', user=user)
+        target = pick(command, claims, in_guild, rest)
+        if command == 'server' and target is not None:
+            # Their pick replaces whatever they picked on other workers before.
+            for worker, answer in claims.items():
+                if worker != target and answer['preferred']:
+                    await self.call(worker, 'forget_preference', user=user)
+        if target is None:
+            target = self.index
+        others = [guild for worker, answer in sorted(claims.items()) if worker != target for guild in answer['guilds']]
+        return target, others
+
+    # Runs the user's command here by calling `run`, or hands `payload` to the worker it belongs on.
+    async def dispatch(self, user, command, payload, run, in_guild=False, rest=''):
+        target, others = await self.route(user, command, in_guild, rest)
+        if target == self.index:
+            self.bot.remember_remote_guilds(user, others)
+            return await run()
+        logger.debug(f"Handing {command} from {user} to worker {target}")
+        try:
+            await self.call(target, 'run', user=user, others=others, payload=payload)
+        except (OSError, asyncio.TimeoutError, WorkerError) as ex:
+            logger.error(f"Couldn't hand {command} from {user} to worker {target}: {ex!r}")
+
+# Starts `count` workers running this same command, each told which one it is, and waits on them.
+# If one of them exits, the rest are stopped too, so that whatever runs the bot can restart it.
+def supervise(count, argv):
+    directory = tempfile.mkdtemp(prefix='lloid-workers-')
+    processes = [subprocess.Popen([sys.executable, '-m', 'lloidbot'] + argv,
+        env=dict(os.environ, WORKER_INDEX=str(i), WORKER_DIR=directory)) for i in range(count)]
+    logger.info(f"Started {count} workers, talking over sockets in {directory}")
+    try:
+        while all(p.poll() is None for p in processes):
+            time.sleep(1)
+        worker, stopped = next((i, p) for i, p in enumerate(processes) if p.poll() is not None)
+        logger.error(f"Worker {worker} exited with status {stopped.returncode}; stopping the others.")
+        return stopped.returncode or 1
+    finally:
+        for p in processes:
+            if p.poll() is None:
+                p.terminate()
+        for p in processes:
+            p.wait()
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,74 @@
+import unittest
+import asyncio
+import discord
+from unittest import mock
+from lloidbot.delivery import DeliveryQueue
+
+def http_error(cls, status):
+    return cls(mock.Mock(status=status, reason=''), '')
+
+class FlakySender:
+    def __init__(self, failures, error=None):
+        self.failures = failures
+        self.error = error or http_error(discord.HTTPException, 500)
+        self.calls = 0
+
+    async def send(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return f"message {self.calls}"
+
+class TestDeliveryQueue(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.deliveries = DeliveryQueue(max_attempts=3, base_delay=0.01, max_delay=0.02)
+
+    async def settle(self):
+        while self.deliveries.pending:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.01)
+
+    async def test_first_try(self):
+        sender = FlakySender(0)
+        assert await self.deliveries.deliver(100, 1, sender.send) == "message 1"
+        assert [a.outcome for a in self.deliveries.attempts] == ['sent']
+
+    async def test_failure_is_retried_in_background(self):
+        sender = FlakySender(2)
+        assert await self.deliveries.deliver(100, 1, sender.send) is None
+        assert (100, 1) in self.deliveries.pending
+
+        await self.settle()
+        assert sender.calls == 3
+        assert [(a.attempt, a.outcome) for a in self.deliveries.attempts] == [(1, 'failed'), (2, 'failed'), (3, 'sent')]
+        assert self.deliveries.stats() == {'pending': 0, 'failed': 2, 'sent': 1}
+
+    async def test_gives_up(self):
+        sender = FlakySender(10)
+        await self.deliveries.deliver(100, 1, sender.send)
+        await self.settle()
+        assert sender.calls == 3
+        assert self.deliveries.attempts[-1].outcome == 'gave_up'
+
+    async def test_forbidden_is_not_retried(self):
+        sender = FlakySender(1, http_error(discord.Forbidden, 403))
+        assert await self.deliveries.deliver(100, 1, sender.send) is None
+        assert not self.deliveries.pending
+        assert sender.calls == 1
+        assert self.deliveries.attempts[-1].outcome == 'forbidden'
+
+    async def test_closing_cancels_retries(self):
+        sender = FlakySender(1)
+        await self.deliveries.deliver(100, 1, sender.send)
+        self.deliveries.cancel_owner(1)
+        await asyncio.sleep(0.05)
+        assert sender.calls == 1
+
+    def test_backoff_grows_and_is_capped(self):
+        deliveries = DeliveryQueue(base_delay=10, max_delay=60)
+        for attempt, cap in ((1, 10), (2, 20), (3, 40), (4, 60), (8, 60)):
+            delay = deliveries.backoff(attempt)
+            assert cap / 2 <= delay <= cap, (attempt, delay)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import asyncio
+from lloidbot.dispatcher import OutboundDispatcher, Priority, TokenBucket
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst_then_throttle(self):
+        bucket = TokenBucket(rate=2.0, capacity=3)
+        for _ in range(3):
+            assert bucket.delay(0) == 0
+            bucket.take(0)
+        assert bucket.delay(0) == 0.5
+        assert bucket.delay(0.5) == 0
+        assert bucket.is_full(10)
+
+    def test_rounding_error_still_counts_as_a_token(self):
+        bucket = TokenBucket(rate=50.0, capacity=50)
+        bucket.tokens = 1 - 1e-12
+        bucket.updated = 2120.0
+        assert bucket.delay(2120.0) == 0
+
+class TestOutboundDispatcher(unittest.IsolatedAsyncioTestCase):
+    async def asyncTearDown(self):
+        self.dispatcher.stop()
+
+    def start(self, **kwargs):
+        self.dispatcher = OutboundDispatcher(**kwargs)
+        self.dispatcher.start()
+        self.sent = []
+
+    def action(self, label):
+        async def send():
+            self.sent.append(label)
+            return label
+        return send
+
+    async def test_higher_priority_goes_first(self):
+        self.start(workers=1)
+        sends = [
+            self.dispatcher.send(Priority.LISTING_EDIT, ('channel', 1), self.action('edit')),
+            self.dispatcher.send(Priority.QUEUE_CONFIRMATION, ('dm', 2), self.action('confirmation')),
+            self.dispatcher.send(Priority.DODO_CODE, ('dm', 3), self.action('code')),
+            self.dispatcher.send(Priority.BOARDING_WARNING, ('dm', 4), self.action('warning')),
+        ]
+        results = await asyncio.gather(*sends)
+        assert results == ['edit', 'confirmation', 'code', 'warning']
+        assert self.sent == ['code', 'warning', 'confirmation', 'edit'], self.sent
+
+    async def test_throttled_route_doesnt_block_others(self):
+        self.start(workers=1, route_rate=10.0, route_burst=1)
+        first = self.dispatcher.send(Priority.DODO_CODE, ('dm', 1), self.action('first'))
+        second = self.dispatcher.send(Priority.DODO_CODE, ('dm', 1), self.action('second'))
+        other = self.dispatcher.send(Priority.QUEUE_CONFIRMATION, ('dm', 2), self.action('other'))
+        await asyncio.gather(first, second, other)
+        assert self.sent == ['first', 'other', 'second'], self.sent
+
+    async def test_servers_take_turns(self):
+        self.start(workers=1)
+        busy = [self.dispatcher.send(Priority.NOTIFICATION, ('dm', 100 + i), self.action(f'busy{i}'), guild=1) for i in range(4)]
+        quiet = self.dispatcher.send(Priority.NOTIFICATION, ('dm', 200), self.action('quiet'), guild=2)
+        await asyncio.gather(*busy, quiet)
+        assert self.sent == ['busy0', 'quiet', 'busy1', 'busy2', 'busy3'], self.sent
+        assert self.dispatcher.last_round == {}
+
+    async def test_errors_reach_the_caller(self):
+        self.start()
+        async def fail():
+            raise ValueError("nope")
+        with self.assertRaises(ValueError):
+            await self.dispatcher.send(Priority.DODO_CODE, ('dm', 1), fail)
+        assert await self.dispatcher.send(Priority.DODO_CODE, ('dm', 1), self.action('ok')) == 'ok'
+
+    async def test_stats(self):
+        self.start()
+        await self.dispatcher.send(Priority.DODO_CODE, ('dm', 1), self.action('code'))
+        stats = self.dispatcher.stats()
+        assert stats['DODO_CODE']['sent'] == 1
+        assert stats['DODO_CODE']['depth'] == 0
+        assert stats['LISTING_EDIT']['sent'] == 0
+
+if __name__ == '__main__':
+    unittest.main()
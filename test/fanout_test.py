@@ -0,0 +1,67 @@
+import unittest
+import asyncio
+import discord
+from unittest import mock
+from lloidbot.fanout import fan_out
+
+class FakeUser:
+    def __init__(self, bot, user_id, error=None):
+        self.bot = bot
+        self.id = user_id
+        self.error = error
+
+    async def send(self, content):
+        self.bot.in_flight += 1
+        self.bot.peak = max(self.bot.peak, self.bot.in_flight)
+        await asyncio.sleep(0.01)
+        self.bot.in_flight -= 1
+        if self.error is not None:
+            raise self.error
+        self.bot.received.append((self.id, content))
+
+class FakeBot:
+    def __init__(self):
+        self.users = {}
+        self.received = []
+        self.in_flight = 0
+        self.peak = 0
+
+    async def dm(self, user, content, guild=None):
+        return await user.send(content)
+
+    async def resolve_user(self, user_id):
+        if user_id not in self.users:
+            raise discord.NotFound(mock.Mock(status=404, reason='Not Found'), 'Unknown User')
+        return self.users[user_id]
+
+def http_error(cls, status):
+    return cls(mock.Mock(status=status, reason=''), '')
+
+class TestFanOut(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.bot = FakeBot()
+        for u in range(100, 120):
+            self.bot.users[u] = FakeUser(self.bot, u)
+
+    async def test_everyone_gets_the_message(self):
+        result = await fan_out(self.bot, list(range(100, 120)), 'hello')
+        assert len(result.sent) == 20
+        assert len(result) == 20
+        assert sorted(self.bot.received) == [(u, 'hello') for u in range(100, 120)]
+
+    async def test_concurrency_is_bounded(self):
+        await fan_out(self.bot, list(range(100, 120)), 'hello', concurrency=4)
+        assert self.bot.peak == 4, self.bot.peak
+
+    async def test_failures_are_isolated(self):
+        self.bot.users[101].error = http_error(discord.Forbidden, 403)
+        self.bot.users[102].error = http_error(discord.HTTPException, 500)
+
+        result = await fan_out(self.bot, [100, 101, 102, 103, 999], 'hello')
+        assert result.sent == [100, 103], result.sent
+        assert result.forbidden == [101]
+        assert sorted(result.failed) == [102, 999]
+        assert str(result) == "2 sent, 1 not accepting DMs, 2 failed"
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+from lloidbot.guest_queue import GuestQueue
+
+owner = 1
+
+class TestGuestQueue(unittest.TestCase):
+    def setUp(self):
+        self.q = GuestQueue(owner)
+
+    def test_append_preserves_order(self):
+        for g in (100, 101, 102):
+            assert self.q.append(g)
+
+        assert len(self.q) == 3
+        assert list(self.q) == [(100, owner), (101, owner), (102, owner)]
+        assert self.q.guests() == [100, 101, 102]
+
+    def test_append_rejects_duplicates(self):
+        assert self.q.append(100)
+        assert not self.q.append(100)
+        assert len(self.q) == 1
+
+    def test_popleft(self):
+        self.q.append(100)
+        self.q.append(101)
+
+        assert self.q.popleft() == (100, owner)
+        assert self.q.popleft() == (101, owner)
+        assert self.q.popleft() is None
+
+    def test_remove_from_middle(self):
+        for g in (100, 101, 102):
+            self.q.append(g)
+
+        assert self.q.remove(101)
+        assert not self.q.remove(101)
+        assert 101 not in self.q
+        assert 100 in self.q
+        assert self.q.guests() == [100, 102]
+
+    def test_peek(self):
+        assert self.q.peek() is None
+        self.q.append(100)
+        self.q.append(101)
+        assert self.q.peek() == 100
+        assert len(self.q) == 2
+
+    def test_requeue_goes_to_the_back(self):
+        for g in (100, 101, 102):
+            self.q.append(g)
+
+        self.q.remove(100)
+        self.q.append(100)
+        assert self.q.guests() == [101, 102, 100]
+
+    def test_position(self):
+        for g in (100, 101, 102, 103):
+            self.q.append(g)
+
+        assert self.q.position(100) == 0
+        assert self.q.position(103) == 3
+        assert self.q.position(999) is None
+
+        self.q.remove(101)
+        assert self.q.position(102) == 1
+        assert self.q.position(103) == 2
+
+        self.q.popleft()
+        assert self.q.position(102) == 0
+        assert self.q.position(103) == 1
+
+    def test_position_survives_compaction(self):
+        # Churn through far more sequence numbers than the initial capacity so the
+        # ranks get compacted several times, then check against a plain list.
+        expected = []
+        for g in range(1000):
+            self.q.append(g)
+            expected.append(g)
+            if g % 3 == 0:
+                self.q.remove(g - 1)
+                if g - 1 in expected:
+                    expected.remove(g - 1)
+            if g % 5 == 0:
+                self.q.popleft()
+                expected.pop(0)
+
+        assert self.q.guests() == expected
+        for i, g in enumerate(expected):
+            assert self.q.position(g) == i, (g, self.q.position(g), i)
+
+    def test_clear(self):
+        for g in (100, 101, 102):
+            self.q.append(g)
+
+        assert self.q.clear() == [100, 101, 102]
+        assert len(self.q) == 0
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import unittest
+import asyncio
+import os
+import sqlite3
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from lloidbot import journal
+from lloidbot.journal import StateJournal, Entry
+
+class TestStateJournal(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(":memory:", check_same_thread=False)
+        self.journal = StateJournal(self.db)
+
+    def tearDown(self):
+        self.db.close()
+
+    def record_sample(self):
+        j = self.journal
+        j.record(Entry.OPENED, 1, guild=700)
+        j.record(Entry.POSTED, 1, message=500, channel=600)
+        j.record(Entry.REQUESTED, 1, 100)
+        j.record(Entry.REQUESTED, 1, 101)
+        j.record(Entry.REQUESTED, 1, 102)
+        j.record(Entry.FORFEITED, 1, 101)
+        j.record(Entry.DISPENSED, 1, 100)
+        j.record(Entry.PAUSES, 1, requested=2, paused=True)
+        j.record(Entry.DEADLINE, 1, at=1234.5)
+        j.record(Entry.DESCRIPTION, 1, text="no running")
+        j.record(Entry.OPENED, 2)
+        j.record(Entry.REQUESTED, 2, 200)
+        j.record(Entry.CLOSED, 2)
+
+    def test_replay(self):
+        self.record_sample()
+        state = self.journal.load()
+
+        assert list(state['listings']) == [1], state
+        listing = state['listings'][1]
+        assert list(listing['guests']) == [102], listing
+        assert listing['guild'] == 700
+        assert listing['message'] == 500 and listing['channel'] == 600
+        assert listing['requested_pauses'] == 2 and listing['paused']
+        assert listing['deadline'] == 1234.5
+        assert listing['description'] == "no running"
+        assert state['departed'] == {100: 1}, state
+
+        self.journal.record(Entry.DONE, guest=100)
+        assert self.journal.load()['departed'] == {}
+
+    def test_tracks_listing_messages(self):
+        self.record_sample()
+        self.journal.record(Entry.OPENED, 2)
+        self.journal.record(Entry.POSTED, 2, message=501, channel=600)
+        self.journal.record(Entry.CLOSED, 2)
+        assert self.journal.load()['messages'] == {500: 600, 501: 600}
+
+        self.journal.record(Entry.DELETED, message=501)
+        self.journal.compact()
+        assert self.journal.load()['messages'] == {500: 600}
+
+    def test_empty(self):
+        state = self.journal.load()
+        assert state == {'listings': {}, 'departed': {}, 'messages': {}}, state
+
+    def test_compact(self):
+        self.record_sample()
+        before = self.journal.load()
+        self.journal.compact()
+
+        assert self.db.execute("select count(*) from journal").fetchone()[0] == 0
+        assert self.journal.load() == before
+
+        self.journal.record(Entry.REQUESTED, 1, 103)
+        assert list(self.journal.load()['listings'][1]['guests']) == [102, 103]
+
+    def test_compacts_automatically(self):
+        self.journal = StateJournal(self.db, compact_every=5)
+        self.record_sample()
+
+        assert self.db.execute("select count(*) from journal").fetchone()[0] < 5
+        assert list(self.journal.load()['listings'][1]['guests']) == [102]
+
+    def test_survives_reopening(self):
+        self.record_sample()
+        self.journal.compact()
+        self.journal.record(Entry.REQUESTED, 1, 103)
+
+        state = StateJournal(self.db).load()
+        assert list(state['listings'][1]['guests']) == [102, 103], state
+
+    def test_writes_on_executor(self):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            self.journal = StateJournal(self.db, executor)
+            self.record_sample()
+        assert list(self.journal.load()['listings'][1]['guests']) == [102]
+
+    def test_departures_are_forgotten_on_close(self):
+        self.record_sample()
+        self.journal.record(Entry.CLOSED, 1)
+        assert self.journal.load()['departed'] == {}
+
+    def test_departures_are_capped(self):
+        departed = {}
+        for guest in range(journal.DEPARTED_LIMIT + 10):
+            journal.depart(departed, guest, 1)
+        journal.depart(departed, 10, 2) # sent somewhere else since, so remembered as recent
+        assert len(departed) == journal.DEPARTED_LIMIT
+        assert 9 not in departed
+        assert list(departed)[-1] == 10 and departed[10] == 2
+
+class TestBatchedCommits(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.db.close()
+        os.remove(self.path)
+
+    async def settle(self):
+        await asyncio.get_event_loop().run_in_executor(self.executor, lambda: None)
+
+    def committed(self):
+        other = sqlite3.connect(self.path)
+        try:
+            return other.execute("select count(*) from journal").fetchone()[0]
+        finally:
+            other.close()
+
+    async def test_commits_after_a_delay(self):
+        j = StateJournal(self.db, self.executor, commit_delay=0.05)
+        for guest in range(5):
+            j.record(Entry.REQUESTED, 1, guest)
+        await self.settle()
+        assert self.committed() == 0
+        await asyncio.sleep(0.1)
+        await self.settle()
+        assert self.committed() == 5
+
+    async def test_commits_every_n_writes(self):
+        j = StateJournal(self.db, self.executor, commit_every=3, commit_delay=60)
+        for guest in range(4):
+            j.record(Entry.REQUESTED, 1, guest)
+        await self.settle()
+        assert self.committed() == 3
+        j.flush()
+        await self.settle()
+        assert self.committed() == 4
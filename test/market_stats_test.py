@@ -0,0 +1,78 @@
+import unittest
+import math
+import random
+import time
+import freezegun
+from datetime import datetime
+from lloidbot import market_stats
+from lloidbot.turnips import Turnip
+
+# Monday, 10:20 UTC
+monday_morning = datetime(2020, 3, 23, 10, 20)
+
+def listing(idx, offset, history):
+    return Turnip('global', idx, f"host{idx}", 'DODOX', offset, None, None, history + [None] * (14 - len(history)))
+
+class TestMarketStats(unittest.TestCase):
+    def test_per_interval(self):
+        stats = market_stats.compute([
+            listing(1, 0, [100, 110, 120]),
+            listing(2, 0, [90, None, 60]),
+            listing(3, 0, [50, 130]),
+            listing(4, 0, [None, 140]),
+        ])
+        assert stats.listings == 4
+        assert stats.mean[:3] == [80.0, 126.7, 90.0], stats.mean
+        assert stats.median[:3] == [90.0, 130.0, 90.0], stats.median
+        assert stats.max[:3] == [100.0, 140.0, 120.0], stats.max
+        assert stats.mean[3:] == [None] * 11
+
+    @freezegun.freeze_time(monday_morning)
+    def test_top_right_now(self):
+        stats = market_stats.compute([
+            listing(1, 0, [100, 500]), # Monday AM here
+            listing(2, 13, [90, 300]), # Monday PM here
+            listing(3, -11, [None, None]), # still Sunday, nothing to sell
+            listing(4, 0, [200]),
+            listing(5, None, [999]),
+        ], k=2)
+        assert [(t.id, price) for t, price in stats.top] == [(2, 300), (4, 200)], stats.top
+
+    @freezegun.freeze_time(monday_morning)
+    def test_top_only_names_open_listings(self):
+        listings = [listing(1, 0, [100, 500]), listing(2, 0, [90, 300]), listing(3, 0, [80, 200])]
+        stats = market_stats.compute(listings, open_owners={2, 3})
+        assert stats.listings == 3
+        assert stats.max[1] == 500.0
+        assert [(t.id, price) for t, price in stats.top] == [(2, 90), (3, 80)], stats.top
+        assert market_stats.compute(listings, open_owners=set()).top == []
+
+    def test_empty_market(self):
+        stats = market_stats.compute([])
+        assert stats.listings == 0
+        assert stats.top == []
+        assert stats.max == [None] * 14
+
+    def test_matches_a_plain_computation(self):
+        listings = [listing(i, 0, [random.choice([None, random.randint(30, 600)]) for _ in range(12)]) for i in range(1000)]
+        stats = market_stats.compute(listings)
+        for j in range(12):
+            column = sorted(t.history[j] for t in listings if t.history[j] is not None)
+            middle = len(column) // 2
+            median = column[middle] if len(column) % 2 == 1 else (column[middle - 1] + column[middle]) / 2
+            assert math.isclose(stats.mean[j], round(sum(column) / len(column), 1), abs_tol=0.1)
+            assert stats.median[j] == median
+            assert stats.max[j] == column[-1]
+
+    def test_week_over_week(self):
+        weeks = market_stats.week_over_week([(10, 100), (10, 200), (10, 300), (11, 500)])
+        assert [(w, n) for w, n, _ in weeks] == [(10, 3), (11, 1)]
+        assert weeks[0][2][0.5] == 200
+        assert weeks[1][2][0.9] == 500
+        assert market_stats.week_over_week([]) == []
+
+    def test_large_market(self):
+        listings = [listing(i, random.randint(-12, 14), [random.randint(30, 600) for _ in range(12)]) for i in range(100000)]
+        start = time.perf_counter()
+        market_stats.compute(listings)
+        assert time.perf_counter() - start < 1
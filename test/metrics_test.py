@@ -0,0 +1,172 @@
+import unittest
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import discord
+from lloidbot.metrics import Metrics, Histogram, describe
+from lloidbot.simulation.transport import http_error
+from lloidbot.storage import AsyncMarket
+from lloidbot.turnips import StalkMarket
+from lloidbot.journal import StateJournal, Entry
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.now = 100.0
+        self.metrics = Metrics(clock=lambda: self.now)
+
+    def test_counter(self):
+        c = self.metrics.counter('lloid_things_total', "Things.", ('kind',))
+        c.inc('a')
+        c.inc('a')
+        c.inc('b', amount=5)
+        assert c.get('a') == 2
+        assert c.get('c') == 0
+        assert c.total() == 7
+
+    def test_histogram(self):
+        h = Histogram('lloid_latency_seconds', "Latency.", buckets=(0.1, 1, 10))
+        for value in (0.05, 0.1, 0.5, 0.7, 5, 100):
+            h.observe(value)
+        assert h.count() == 6
+        assert abs(h.sum() - 106.35) < 1e-9
+        assert h.quantile(0.3) == 0.1
+        assert h.quantile(0.5) == 1
+        assert h.quantile(0.8) == 10
+        assert h.quantile(1) == float('inf')
+        assert Histogram('empty', "Nothing.").quantile(0.5) is None
+
+    def test_render(self):
+        c = self.metrics.counter('lloid_things_total', "Things.", ('kind',))
+        c.inc('say "hi"')
+        h = self.metrics.histogram('lloid_latency_seconds', "Latency.", buckets=(0.5, 1))
+        h.observe(0.25)
+        h.observe(2)
+        text = self.metrics.render()
+        assert '# TYPE lloid_things_total counter\n' in text
+        assert 'lloid_things_total{kind="say \\"hi\\""} 1\n' in text
+        assert '# TYPE lloid_latency_seconds histogram\n' in text
+        assert 'lloid_latency_seconds_bucket{le="0.5"} 1\n' in text
+        assert 'lloid_latency_seconds_bucket{le="1"} 1\n' in text
+        assert 'lloid_latency_seconds_bucket{le="+Inf"} 2\n' in text
+        assert 'lloid_latency_seconds_sum 2.25\n' in text
+        assert 'lloid_latency_seconds_count 2\n' in text
+
+    def test_collectors_run_before_rendering(self):
+        def collect(metrics):
+            metrics.open_listings.set(3, 1)
+        self.metrics.collectors.append(collect)
+        assert 'lloid_open_listings{guild="1"} 3\n' in self.metrics.render()
+
+    def test_failing_collector_doesnt_break_the_rest(self):
+        def broken(metrics):
+            raise ValueError("oops")
+        self.metrics.collectors.append(broken)
+        with self.assertLogs('lloid', level='ERROR'):
+            assert '# TYPE lloid_events_total counter' in self.metrics.render()
+
+    def test_rates(self):
+        self.metrics.events.inc('react', amount=10)
+        self.now += 5
+        assert self.metrics.rates() == {'react': 2.0}
+        self.metrics.events.inc('react')
+        self.metrics.events.inc('done', amount=2)
+        self.now += 1
+        assert self.metrics.rates() == {'react': 1.0, 'done': 2.0}
+
+    def test_timed(self):
+        assert self.metrics.timed('add', lambda a, b: a + b)(1, 2) == 3
+        assert self.metrics.db_seconds.count() == 1
+        assert ('add',) in self.metrics.db_seconds.values
+
+    def test_timed_send_counts_failures(self):
+        async def refused():
+            self.now += 0.5
+            raise http_error(discord.Forbidden, 403, 'Forbidden', 'Cannot send messages to this user')
+        with self.assertRaises(discord.Forbidden):
+            asyncio.run(self.metrics.timed_send(refused))
+        assert self.metrics.dm_failures.get('forbidden') == 1
+        assert self.metrics.dm_seconds.sum() == 0.5
+
+    def test_describe(self):
+        self.metrics.open_listings.set(2, 1)
+        self.metrics.queue_length.set(4, 1, 10)
+        self.metrics.queue_length.set(1, 1, 11)
+        self.metrics.dispense_delay.observe(0.3)
+        self.metrics.events.inc('react')
+        text = describe(self.metrics)
+        assert "**Listings:** 2 open, 5 guests in line, longest line 4" in text, text
+        assert "**Codes sent after a cooldown:** 1, avg 0.30s, p50 under 0.5s" in text, text
+        assert "**Database:** none yet" in text, text
+        assert "react" in text, text
+
+class TestMetricsEndpoint(unittest.IsolatedAsyncioTestCase):
+    async def fetch(self, port, path):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        return response.decode()
+
+    async def test_serves_metrics(self):
+        metrics = Metrics()
+        metrics.events.inc('host')
+        server = await metrics.serve(0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            response = await self.fetch(port, '/metrics')
+            assert response.startswith("HTTP/1.1 200 OK\r\n"), response
+            assert 'text/plain; version=0.0.4' in response
+            assert 'lloid_events_total{event="host"} 1\n' in response
+
+            response = await self.fetch(port, '/nope')
+            assert response.startswith("HTTP/1.1 404"), response
+        finally:
+            server.close()
+            await server.wait_closed()
+
+class TestDatabaseTimings(unittest.IsolatedAsyncioTestCase):
+    async def test_market_and_journal_writes_are_timed(self):
+        metrics = Metrics()
+        executor = ThreadPoolExecutor(max_workers=1)
+        db = sqlite3.connect(':memory:', check_same_thread=False)
+        market = AsyncMarket(StalkMarket(db), executor)
+        market.metrics = metrics
+        await market.declare(1, 'Nook', 100, 'D0D0X', 0)
+        journal = StateJournal(db, executor)
+        journal.metrics = metrics
+        journal.record(Entry.OPENED, 1)
+        journal.flush()
+        await market.run(lambda: None) # the journal write is queued ahead of this
+        assert set(metrics.db_seconds.values) == {('load',), ('write',), ('<lambda>',), ('journal',)}, metrics.db_seconds.values
+        executor.shutdown()
+        db.close()
+
+    async def test_timings_are_recorded_on_the_loop(self):
+        metrics = Metrics()
+        observed = []
+        observe = metrics.db_seconds.observe
+        def record(value, *labels):
+            observed.append(threading.current_thread())
+            observe(value, *labels)
+        metrics.db_seconds.observe = record
+        executor = ThreadPoolExecutor(max_workers=1)
+        db = sqlite3.connect(':memory:', check_same_thread=False)
+        market = AsyncMarket(StalkMarket(db), executor)
+        market.metrics = metrics
+        journal = StateJournal(db, executor)
+        journal.metrics = metrics
+        journal.record(Entry.OPENED, 1)
+        journal.flush()
+        await market.run(lambda: None)
+        assert observed == [threading.current_thread()] * 2, observed
+        executor.shutdown()
+        db.close()
+
+    async def test_nothing_is_timed_without_metrics(self):
+        executor = ThreadPoolExecutor(max_workers=1)
+        market = AsyncMarket(StalkMarket(sqlite3.connect(':memory:', check_same_thread=False)), executor)
+        assert market.metrics is None
+        assert await market.run(lambda: 42) == 42
+        executor.shutdown()
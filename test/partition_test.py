@@ -0,0 +1,15 @@
+import unittest
+from lloidbot.partition import parse_announce_ids, chan_for
+
+class TestPartition(unittest.TestCase):
+    def test_parse_announce_ids(self):
+        assert parse_announce_ids("123") == [123]
+        assert parse_announce_ids("123, 456,789,") == [123, 456, 789]
+
+    def test_parse_requires_an_id(self):
+        with self.assertRaises(ValueError):
+            parse_announce_ids(" , ")
+
+    def test_chan_is_the_guild_id(self):
+        assert chan_for(123) == '123'
+        assert chan_for(456) == '456'
@@ -0,0 +1,85 @@
+import unittest
+import math
+import time
+import random
+from lloidbot import prediction
+from lloidbot.prediction import predict, predict_all, PATTERNS
+
+def ceil(x):
+    return math.ceil(x - 1e-6)
+
+# Generates a week the way the game does, for a given base price.
+def large_spike(base, peak):
+    prices, rate = [], 0.9
+    for _ in range(peak):
+        prices.append(ceil(rate * base))
+        rate -= 0.04
+    for r in (1.2, 1.7, 5.5, 1.7, 1.2):
+        prices.append(ceil(r * base))
+    return prices + [ceil(0.6 * base)] * (12 - len(prices))
+
+def decreasing(base):
+    rate, prices = 0.88, []
+    for _ in range(12):
+        prices.append(ceil(rate * base))
+        rate -= 0.035
+    return prices
+
+class TestPrediction(unittest.TestCase):
+    def test_no_prices_gives_the_usual_odds(self):
+        p = predict([None] * 14)
+        assert abs(sum(p.probabilities.values()) - 1) < 1e-6
+        assert abs(p.probabilities['fluctuating'] - prediction.PRIOR[0]) < 1e-6
+        assert p.consistent
+
+    def test_large_spike(self):
+        week = large_spike(100, 3)
+        p = predict(week[:6] + [None] * 8)
+        assert p.consistent
+        assert p.probabilities['large spike'] > 0.99, p.probabilities
+        assert p.low[5] == p.high[5] == week[5]
+        for i in range(6, 12):
+            assert p.low[i] <= week[i] <= p.high[i], (i, p.low[i], week[i], p.high[i])
+
+    def test_decreasing(self):
+        week = decreasing(105)
+        p = predict(week[:8] + [None] * 6)
+        assert max(p.probabilities, key=p.probabilities.get) == 'decreasing', p.probabilities
+        for i in range(8, 12):
+            assert p.low[i] <= week[i] <= p.high[i]
+
+    def test_ranges_contain_the_actual_week(self):
+        for base in (90, 100, 110):
+            for peak in range(1, 8):
+                week = large_spike(base, peak)
+                for known in range(12):
+                    p = predict(week[:known] + [None] * (14 - known))
+                    assert p.consistent, (base, peak, known)
+                    assert all(p.low[i] <= week[i] <= p.high[i] for i in range(12)), (base, peak, known)
+
+    def test_impossible_prices(self):
+        p = predict([999, 10] + [None] * 12)
+        assert not p.consistent
+        assert p.low[0] != 999
+
+    def test_batches_match_single_predictions(self):
+        histories = [large_spike(100, 2)[:4] + [None] * 10, decreasing(95)[:5] + [None] * 9, [None] * 14]
+        batched = predict_all(histories * 200, block=64)
+        assert len(batched) == 600
+        for i, h in enumerate(histories):
+            single = predict(h)
+            assert batched[i].low == single.low and batched[i].high == single.high
+            for pattern in PATTERNS:
+                assert abs(batched[i].probabilities[pattern] - single.probabilities[pattern]) < 1e-6
+
+    def test_thousands_of_users(self):
+        histories = [[random.randint(60, 130) for _ in range(4)] + [None] * 10 for _ in range(2000)]
+        start = time.perf_counter()
+        assert len(predict_all(histories)) == 2000
+        assert time.perf_counter() - start < 5
+
+    def test_describe(self):
+        text = prediction.describe(predict(decreasing(100)[:2] + [None] * 12), 2)
+        assert text.splitlines()[0].startswith('decreasing') or 'decreasing' in text
+        assert 'Tue AM' in text and 'Mon PM' not in text
+        assert 'Sat PM' in text
@@ -47,7 +47,7 @@ class TestQueueManager(unittest.TestCase):
         assert turnip.current_price() == 150
 
         t = self.market.get(alice.id)
-        assert turnip.equals(t), f"{turnip} | {t}"
+        assert turnip == t, f"{turnip} | {t}"
 
     @freezegun.freeze_time(tuesday_morning)
     def test_declare_new_price_updates_listing(self):
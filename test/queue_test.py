@@ -1,6 +1,6 @@
 import unittest
 import sqlite3
-from lloidbot.turnips import Status, Turnip, StalkMarket
+from lloidbot.turnips import Status, Turnip, StalkMarket, QueueEvent
 from datetime import datetime
 from unittest import mock 
 import freezegun
@@ -80,6 +80,20 @@ class TestQueue(unittest.TestCase):
         assert fourth == 4
 
 
+    @freezegun.freeze_time(tuesday_morning)
+    def test_position(self):
+        self.insert_sample_rows()
+        self.market.request(100, bella.id)
+        self.market.request(101, bella.id)
+        self.market.request(102, bella.id)
+
+        assert self.market.queue.position(102) == (bella.id, 2, 3)
+        self.market.forfeit(101)
+        assert self.market.queue.position(102) == (bella.id, 1, 2)
+        self.market.next(bella.id)
+        assert self.market.queue.position(102) == (bella.id, 0, 1)
+        assert self.market.queue.position(100) is None
+
     @freezegun.freeze_time(tuesday_morning)
     def test_close(self):
         self.insert_sample_rows()
@@ -163,6 +177,44 @@ class TestQueue(unittest.TestCase):
         assert status
         assert remaining == 2
 
+    @freezegun.freeze_time(tuesday_morning)
+    def test_listeners_are_notified(self):
+        events = []
+        self.market.queue.add_listener(lambda event, owner, guest: events.append((event, owner, guest)))
+
+        self.market.declare(bella.id, bella.name, 100, bella.dodo, bella.gmtoffset)
+        self.market.request(100, bella.id)
+        self.market.request(101, bella.id)
+        self.market.request(102, bella.id)
+        self.market.forfeit(101)
+        self.market.next(bella.id)
+        self.market.close(bella.id)
+
+        assert events == [
+            (QueueEvent.OPENED, bella.id, None),
+            (QueueEvent.REQUESTED, bella.id, 100),
+            (QueueEvent.REQUESTED, bella.id, 101),
+            (QueueEvent.REQUESTED, bella.id, 102),
+            (QueueEvent.FORFEITED, bella.id, 101),
+            (QueueEvent.DISPENSED, bella.id, 100),
+            (QueueEvent.CLOSED, bella.id, None),
+        ], events
+
+    def test_restore(self):
+        self.insert_sample_rows()
+        self.market.close(bella.id)
+        events = []
+        self.market.queue.add_listener(lambda event, owner, guest: events.append((event, owner, guest)))
+
+        self.market.queue.restore(bella.id, [102, 100])
+        assert events == [], events
+        assert self.market.queue.queues[bella.id].guests() == [102, 100]
+        ok, _ = self.market.request(100, alice.id)
+        assert not ok
+
+        n, _ = self.market.next(bella.id)
+        assert n[0] == 102
+
     @freezegun.freeze_time(tuesday_morning)
     def test_wont_accept_dupe_request(self):
         self.market.declare(alice.id, alice.name, 150, alice.dodo, alice.gmtoffset)
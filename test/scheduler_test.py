@@ -0,0 +1,87 @@
+import unittest
+import asyncio
+from lloidbot.scheduler import DeadlineScheduler
+
+class TestDeadlineScheduler(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.scheduler = DeadlineScheduler()
+
+    async def test_wait_times_out(self):
+        assert await self.scheduler.wait(1, 0.01)
+        assert 1 not in self.scheduler
+        assert self.scheduler.timer is None
+
+    async def test_passed_deadline_is_left_for_the_waiter(self):
+        deadline = asyncio.get_event_loop().time() + 0.01
+        assert await self.scheduler.wait(1, 0.01)
+        assert abs(self.scheduler.fired[1] - deadline) < 0.005
+
+        task = asyncio.ensure_future(self.scheduler.wait(2, 10))
+        await asyncio.sleep(0)
+        self.scheduler.cancel(2)
+        assert not await task
+        assert 2 not in self.scheduler.fired
+
+    async def test_deadlines_fire_in_order(self):
+        fired = []
+        async def wait(key, delay):
+            await self.scheduler.wait(key, delay)
+            fired.append(key)
+
+        await asyncio.gather(wait(1, 0.3), wait(2, 0.1), wait(3, 0.2))
+        assert fired == [2, 3, 1], fired
+
+    async def test_cancel_cuts_wait_short(self):
+        task = asyncio.ensure_future(self.scheduler.wait(1, 10))
+        await asyncio.sleep(0)
+        assert 1 in self.scheduler
+
+        assert self.scheduler.cancel(1)
+        assert not await task
+        assert not self.scheduler.cancel(1)
+        assert self.scheduler.timer is None
+
+    async def test_extend(self):
+        task = asyncio.ensure_future(self.scheduler.wait(1, 0.01))
+        await asyncio.sleep(0)
+        assert self.scheduler.extend(1, 10)
+        assert self.scheduler.remaining(1) > 9
+
+        await asyncio.sleep(0.03)
+        assert not task.done()
+        self.scheduler.cancel(1)
+        assert not await task
+
+    async def test_extend_unknown_key(self):
+        assert not self.scheduler.extend(1, 10)
+        assert self.scheduler.remaining(1) is None
+
+    async def test_rescheduling_cuts_previous_wait_short(self):
+        first = asyncio.ensure_future(self.scheduler.wait(1, 10))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(self.scheduler.wait(1, 0.01))
+
+        assert not await first
+        assert await second
+
+    async def test_only_one_timer_armed(self):
+        tasks = [asyncio.ensure_future(self.scheduler.wait(k, 10 + k)) for k in range(100)]
+        await asyncio.sleep(0)
+        assert len(self.scheduler) == 100
+        assert self.scheduler.timer_deadline == self.scheduler.entries[0][0]
+
+        for k in range(100):
+            self.scheduler.cancel(k)
+        await asyncio.gather(*tasks)
+        assert self.scheduler.timer is None
+
+    async def test_cancelled_waiter_is_forgotten(self):
+        task = asyncio.ensure_future(self.scheduler.wait(1, 10))
+        await asyncio.sleep(0)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        assert 1 not in self.scheduler
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,380 @@
+import unittest
+import asyncio
+import time
+import discord
+from lloidbot.simulation import VirtualClockLoop, SimulatedBot, Workload, simulate, Transport
+from lloidbot.simulation.clock import ScaledClockLoop
+from lloidbot.metrics import Metrics
+from lloidbot.simulation.fakes import FakeGuild, FakeChannel
+from lloidbot.simulation.load_test import LoadTest, load_test, discord_like
+from lloidbot.simulation.replay import Tally, replay
+from lloidbot.simulation.workload import shutdown
+
+class TestVirtualClockLoop(unittest.TestCase):
+    def setUp(self):
+        self.loop = VirtualClockLoop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def test_sleeps_take_no_real_time(self):
+        started = time.perf_counter()
+        self.loop.run_until_complete(asyncio.sleep(3600))
+        assert self.loop.time() >= 3600
+        assert time.perf_counter() - started < 1
+
+    def test_timers_fire_in_order(self):
+        fired = []
+        async def sleep(delay):
+            await asyncio.sleep(delay)
+            fired.append((delay, self.loop.time()))
+
+        self.loop.run_until_complete(asyncio.gather(sleep(600), sleep(60), sleep(3600)))
+        assert [d for d, _ in fired] == [60, 600, 3600], fired
+        assert all(abs(d - t) < 1e-6 for d, t in fired), fired
+
+class TestScaledClockLoop(unittest.TestCase):
+    def test_sleeps_are_sped_up(self):
+        loop = ScaledClockLoop(100)
+        try:
+            started = time.perf_counter()
+            loop.run_until_complete(asyncio.sleep(10))
+            assert loop.time() >= 10
+            assert time.perf_counter() - started < 1
+        finally:
+            loop.close()
+
+class TestTransport(unittest.TestCase):
+    def setUp(self):
+        self.loop = VirtualClockLoop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def test_latency(self):
+        transport = Transport(latency=(0.5, 0.5))
+        assert self.loop.run_until_complete(transport.request('dm', ('dm', 1), lambda: 'sent')) == 'sent'
+        assert self.loop.time() == 0.5
+        assert transport.stats()['dm']['avg_latency'] == 0.5
+
+    def test_rate_limited_calls_are_retried(self):
+        transport = Transport(route_rate=1.0, route_burst=2)
+        async def burst():
+            return await asyncio.gather(*[transport.request('dm', ('dm', 1), lambda: 'sent') for _ in range(4)])
+
+        assert self.loop.run_until_complete(burst()) == ['sent'] * 4
+        stats = transport.stats()['dm']
+        assert stats['rate_limited'] > 0 and stats['failed'] == 0, stats
+        assert self.loop.time() >= 2
+
+    def test_gives_up_after_max_tries(self):
+        transport = Transport(rate_limit_rate=1.0, max_tries=3)
+        with self.assertRaises(discord.HTTPException) as raised:
+            self.loop.run_until_complete(transport.request('dm', ('dm', 1), lambda: 'sent'))
+        assert raised.exception.status == 429
+        assert transport.stats()['dm'] == {'requests': 1, 'rate_limited': 3, 'failed': 1, 'avg_latency': 2.0, 'max_latency': 2.0}
+
+    def test_gateway_keeps_order(self):
+        transport = Transport(gateway_latency=(0.01, 1))
+        seen = []
+        async def handler(i):
+            seen.append(i)
+            return i
+
+        async def run():
+            transport.start()
+            results = await asyncio.gather(*[transport.deliver(handler, i) for i in range(20)])
+            transport.stop()
+            return results
+
+        assert self.loop.run_until_complete(run()) == list(range(20))
+        assert seen == list(range(20))
+
+    def test_channel_endpoints(self):
+        channel = FakeChannel(1, 'turnips', FakeGuild(1, 'Server'), Transport())
+        async def run():
+            messages = [await channel.send(f"listing {i}") for i in range(3)]
+            assert (await channel.fetch_message(messages[0].id)).content == "listing 0"
+            with self.assertRaises(discord.NotFound):
+                await channel.delete_messages([messages[0], channel.get_partial_message(12345)])
+            assert len(channel.messages) == 3 # all or nothing
+            await channel.delete_messages(messages[:2])
+            with self.assertRaises(discord.NotFound):
+                await channel.fetch_message(messages[0].id)
+            with self.assertRaises(discord.NotFound):
+                await messages[1].edit(content="too late")
+            await channel.delete_messages([messages[2]]) # a single message is deleted on its own
+            with self.assertRaises(discord.NotFound):
+                await channel.delete_messages([messages[2]])
+            last = await channel.send("listing 3")
+            assert await channel.purge() == [last]
+            assert len(channel.messages) == 0
+
+        self.loop.run_until_complete(run())
+
+class TestSimulatedBot(unittest.TestCase):
+    def setUp(self):
+        self.loop = VirtualClockLoop()
+        asyncio.set_event_loop(self.loop)
+        self.inbox = []
+        self.bot = SimulatedBot(self.loop, lambda user, content: self.inbox.append((user.id, content, self.loop.time())))
+        self.loop.run_until_complete(self.bot.start_simulation())
+        self.host = self.bot.add_user(1, 'Nook')
+        self.guests = [self.bot.add_user(10 + i, f'guest{i}') for i in range(3)]
+
+    def tearDown(self):
+        async def stop():
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.bot.stop_simulation()
+        self.loop.run_until_complete(stop())
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def codes(self):
+        return [(user, at) for user, content, at in self.inbox if "NOW BOARDING" in content]
+
+    def test_line_is_served_in_order(self):
+        async def run():
+            await self.bot.command(self.host, 'host', 100, 'D0D0X', 0)
+            for guest in self.guests:
+                await self.bot.react(guest, self.host.id)
+            await asyncio.sleep(3 * 600 + 1)
+
+        self.loop.run_until_complete(run())
+        codes = self.codes()
+        assert [user for user, _ in codes] == [g.id for g in self.guests], codes
+        # The first guest gets in right away, and everyone after waits out a cooldown.
+        assert [round(at - codes[0][1]) for _, at in codes] == [0, 600, 1200], codes
+
+    def test_done_lets_the_next_guest_in(self):
+        async def run():
+            await self.bot.command(self.host, 'host', 100, 'D0D0X', 0)
+            await self.bot.react(self.guests[0], self.host.id)
+            await self.bot.react(self.guests[1], self.host.id)
+            await asyncio.sleep(60)
+            await self.bot.command(self.guests[0], 'done')
+            await asyncio.sleep(1)
+
+        self.loop.run_until_complete(run())
+        codes = self.codes()
+        assert [user for user, _ in codes] == [self.guests[0].id, self.guests[1].id], codes
+        assert round(codes[1][1] - codes[0][1]) == 60, codes
+
+    def test_cooldown_doesnt_wait_for_the_listing_edit(self):
+        async def run():
+            await self.bot.command(self.host, 'host', 100, 'D0D0X', 0)
+            async def stuck(emoji, user):
+                await asyncio.sleep(3600)
+            self.bot.associated_message[self.host.id].remove_reaction = stuck
+            await self.bot.react(self.guests[0], self.host.id)
+            await self.bot.react(self.guests[1], self.host.id)
+            await asyncio.sleep(60)
+            await self.bot.command(self.guests[0], 'done')
+            await asyncio.sleep(1)
+
+        self.loop.run_until_complete(run())
+        codes = self.codes()
+        assert [user for user, _ in codes] == [self.guests[0].id, self.guests[1].id], codes
+        assert round(codes[1][1] - codes[0][1]) == 60, codes
+
+    def test_cutting_a_cooldown_short_is_journalled(self):
+        async def run():
+            await self.bot.command(self.host, 'host', 100, 'D0D0X', 0)
+            await self.bot.react(self.guests[0], self.host.id)
+            await asyncio.sleep(60)
+            assert self.bot.journal.load()['listings'][self.host.id]['deadline'] is not None
+            await self.bot.command(self.guests[0], 'done')
+            await asyncio.sleep(1)
+            assert self.bot.journal.load()['listings'][self.host.id]['deadline'] is None
+
+            await self.bot.react(self.guests[1], self.host.id)
+            await asyncio.sleep(60)
+            await self.bot.command(self.host, 'next')
+            await asyncio.sleep(1)
+            assert self.bot.journal.load()['listings'][self.host.id]['deadline'] is None
+
+        self.loop.run_until_complete(run())
+
+    def test_placeholder_prices_are_posted_as_given(self):
+        async def run():
+            await self.bot.command(self.host, 'host', 99999, 'D0D0X', 0)
+            assert "selling for **99999**" in self.bot.associated_message[self.host.id].content
+            await self.bot.command(self.host, 'host', 10**10, 'D0D0X', 0)
+
+        self.loop.run_until_complete(run())
+        assert any("a bit much" in content for _, content, _ in self.inbox), self.inbox
+        assert self.loop.run_until_complete(self.bot.partitions[next(iter(self.bot.partitions))].market.get(self.host.id)).current_price() == 99999
+
+    def test_close_notifies_the_line(self):
+        async def run():
+            await self.bot.command(self.host, 'host', 100, 'D0D0X', 0)
+            for guest in self.guests:
+                await self.bot.react(guest, self.host.id)
+            await asyncio.sleep(1)
+            await self.bot.command(self.host, 'close')
+            await asyncio.sleep(1)
+
+        self.loop.run_until_complete(run())
+        told = [user for user, content, _ in self.inbox if "closed up" in content]
+        assert sorted(told) == [g.id for g in self.guests[1:]], told
+        assert self.host.id not in self.bot.hosting
+
+    def test_guest_without_dms_is_dropped(self):
+        guest = self.bot.add_user(99, 'shy', accepts_dms=False)
+        async def run():
+            await self.bot.command(self.host, 'host', 100, 'D0D0X', 0)
+            await self.bot.react(self.guests[0], self.host.id)
+            await self.bot.react(guest, self.host.id)
+            await asyncio.sleep(1)
+
+        self.loop.run_until_complete(run())
+        assert guest.id not in self.bot.partitions[1].market.queue.requesters
+        assert self.bot.transport.stats()['dm']['failed'] == 1
+
+    def test_inbound_events_are_traced(self):
+        self.bot.trace = Tally()
+        async def run():
+            await self.bot.command(self.host, 'host', 100, 'D0D0X', 0)
+            await self.bot.react(self.guests[0], self.host.id)
+            await self.bot.react(self.guests[1], self.host.id)
+            await self.bot.command(self.guests[0], 'done')
+            await asyncio.sleep(601)
+            await self.bot.command(self.host, 'close')
+
+        self.loop.run_until_complete(run())
+        assert self.bot.trace.counts == {'host': 1, 'react': 2, 'done': 1, 'timeout': 1, 'close': 1}, self.bot.trace.counts
+
+    def test_metrics(self):
+        metrics = Metrics(clock=self.loop.time)
+        self.bot.enable_metrics(metrics)
+        self.bot.admins = {self.host.id}
+        async def run():
+            await self.bot.command(self.host, 'host', 100, 'D0D0X', 0)
+            for guest in self.guests:
+                await self.bot.react(guest, self.host.id)
+            await asyncio.sleep(601)
+            metrics.collect()
+            await self.bot.command(self.host, 'stats')
+            await self.bot.command(self.guests[0], 'stats')
+
+        self.loop.run_until_complete(run())
+        assert metrics.events.get('host') == 1
+        assert metrics.events.get('react') == 3
+        assert metrics.events.get('timeout') == 1
+        # The first guest got in right away; the second once the cooldown ran out.
+        assert metrics.dispense_delay.count() == 1
+        assert metrics.dispense_delay.quantile(1) <= 0.0005
+        assert metrics.dm_seconds.count() > 0
+        assert metrics.db_seconds.count() > 0
+        assert metrics.open_listings.get(1) == 1
+        assert metrics.queue_length.get(1, self.host.id) == 1
+        assert metrics.cooldowns.get(1) == 1
+        assert metrics.outbound_sent.get('DODO_CODE') == 2
+        assert metrics.deliveries.get('sent') == 2
+
+        replies = [content for user, content, _ in self.inbox if user in (self.host.id, self.guests[0].id)][-2:]
+        assert "**Listings:** 1 open, 1 guests in line" in replies[0], replies
+        assert "only for the people running me" in replies[1], replies
+
+class TestSimulate(unittest.TestCase):
+    def test_small_rush(self):
+        report = simulate(Workload(hosts=20, guests=300, hours=1, seed=1))
+        assert report.virtual >= 3600
+        assert report.codes > 0
+        assert len(report.waits) == report.codes
+        assert report.waits == sorted(report.waits)
+        assert report.wait(0.5) <= report.wait(0.99)
+        assert report.events >= report.codes
+        assert report.cpu_per_event > 0
+        assert report.speedup > 1
+        assert "Codes sent" in str(report)
+
+    def test_same_seed_same_outcome(self):
+        a = simulate(Workload(hosts=10, guests=100, hours=1, seed=7))
+        b = simulate(Workload(hosts=10, guests=100, hours=1, seed=7))
+        assert a.counts == b.counts
+        assert a.waits == b.waits
+
+class TestLoadTest(unittest.TestCase):
+    def test_flood(self):
+        test = LoadTest(hosts=3, guests=100, burst=10, visit=5, poll=60, no_dms=0.1, transport=discord_like(seed=1))
+        report = load_test(test)
+        shy = sum(1 for g in test.bot.members.values() if not g.accepts_dms)
+        assert report.codes == 100 - shy, (report.codes, shy)
+        assert len(report.deliveries) == report.codes
+        # Codes go out first, so they shouldn't wait on anything but the network and their own DM route.
+        assert report.deliveries[-1] < 10, report.deliveries[-1]
+        assert report.transport['dm']['requests'] > 100
+        assert "Code delivery" in str(report)
+
+class TestReplay(unittest.TestCase):
+    def event(self, t, kind, user, **data):
+        return dict(t=1000.0 + t, e=kind, u=user, **data)
+
+    def test_replays_a_trace(self):
+        events = [
+            self.event(0, 'host', 1, guild=5, name='Nook', price=100, dodo='D0D0X', tz=0, desc="no running"),
+            self.event(1, 'react', 10, owner=1, guild=5),
+            self.event(2, 'react', 11, owner=1, guild=5),
+            self.event(3, 'react', 12, owner=1, guild=5),
+            self.event(4, 'react', 13, owner=2, guild=5), # nobody called 2 is hosting
+            self.event(30, 'done', 10),
+            self.event(40, 'unreact', 12, owner=1, guild=5),
+            self.event(630, 'timeout', 1),
+        ]
+        report = replay(events)
+        assert report.events == len(events)
+        assert report.span == 630
+        assert report.skipped == 1
+        assert report.failed == 0
+        assert {kind: len(v) for kind, v in report.latencies.items()} == {'host': 1, 'react': 3, 'done': 1, 'unreact': 1}
+        assert report.recorded['timeout'] == 1
+        assert report.replayed['timeout'] == 1
+        # 10 went in and said they were done, then 11 went in after the cooldown and hasn't yet.
+        assert list(report.state['listings']) == [1]
+        assert report.state['listings'][1]['guild'] == 5
+        assert report.state['listings'][1]['guests'] == {}
+        assert report.state['departed'] == {11: 1}
+        assert "Final state: 1 listings open" in str(report)
+
+    def test_replaying_what_was_recorded(self):
+        loop = VirtualClockLoop()
+        asyncio.set_event_loop(loop)
+        try:
+            bot = SimulatedBot(loop)
+            loop.run_until_complete(bot.start_simulation())
+            recorded = []
+            bot.trace = Tally()
+            bot.trace.record = lambda event, user, **data: recorded.append(dict(t=loop.time(), e=event, u=user, **data))
+            host = bot.add_user(1, 'Nook')
+            guests = [bot.add_user(10 + i, f'guest{i}') for i in range(4)]
+            async def run():
+                await bot.command(host, 'host', 100, 'D0D0X', 0)
+                for guest in guests:
+                    await bot.react(guest, host.id)
+                await asyncio.sleep(700)
+                await bot.command(host, 'next')
+                await asyncio.sleep(10)
+            loop.run_until_complete(run())
+            state = bot.journal.load()
+            loop.run_until_complete(shutdown(bot))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+        report = replay(recorded)
+        # Everything but the ids of the listing messages, which are whatever the fakes hand out,
+        # and cooldown deadlines, which are wall clock times.
+        for s in (state, report.state):
+            s['messages'] = len(s['messages'])
+            for listing in s['listings'].values():
+                listing['message'] = listing['deadline'] = None
+        assert report.state == state, (report.state, state)
+        assert report.replayed == report.recorded
@@ -0,0 +1,71 @@
+import unittest
+import threading
+from lloidbot.storage import AsyncMarket
+from lloidbot.turnips import Status
+
+class TestAsyncMarket(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.market = await AsyncMarket.open(":memory:")
+        self.threads = set()
+        self.market.db.set_trace_callback(lambda _: self.threads.add(threading.current_thread().name))
+
+    async def asyncTearDown(self):
+        await self.market.close_db()
+
+    async def test_declare_runs_on_db_thread(self):
+        status = await self.market.declare(1, 'Alice', 150, 'ALICE', 0)
+        assert status == Status.SUCCESS, status
+        assert self.threads, "nothing was written"
+        assert all(t.startswith('lloid-db') for t in self.threads), self.threads
+        assert threading.current_thread().name not in self.threads
+
+    async def test_declare_opens_queue(self):
+        await self.market.declare(1, 'Alice', 150, 'ALICE', 0)
+        assert self.market.has_listing(1)
+        assert (await self.market.get(1)).current_price() == 150
+
+        status = await self.market.declare(1, 'Alice', 200)
+        assert status == Status.ALREADY_OPEN, status
+        assert (await self.market.get(1)).current_price() == 200
+
+    async def test_declare_reports_missing_info(self):
+        status = await self.market.declare(1, 'Alice', 150, 'ALICE')
+        assert status == Status.TIMEZONE_REQUIRED
+        assert not self.market.has_listing(1)
+
+    async def test_cache_misses_are_looked_up_on_db_thread(self):
+        await self.market.declare(1, 'Alice', 150, 'ALICE', 0)
+        self.market.listings.clear()
+        self.market.listing_chans.clear()
+        self.threads.clear()
+
+        turnip = await self.market.get(1)
+        assert turnip.current_price() == 150
+        assert all(t.startswith('lloid-db') for t in self.threads), self.threads
+        assert self.market.cached(1, self.market.chan) is turnip
+        assert await self.market.get(2) is None
+
+    async def test_wipe_updates_cache_on_the_loop(self):
+        await self.market.declare(1, 'Alice', 150, 'ALICE', 0)
+        self.market.db.execute("update turnips set latest_week = latest_week - 1")
+        assert await self.market.wipe_old_prices() == 1
+        assert all(p is None for p in (await self.market.get(1)).history)
+
+    async def test_queue_operations_pass_through(self):
+        await self.market.declare(1, 'Alice', 150, 'ALICE', 0)
+        status, size = self.market.request(100, 1)
+        assert status
+        assert size == 1
+
+    async def test_partitions_share_the_db_thread(self):
+        nookmart = await self.market.partition('nookmart')
+        await nookmart.declare(1, 'Alice', 90, 'XDODO', 0)
+
+        assert nookmart.executor is self.market.executor
+        assert (await nookmart.get(1)).chan == 'nookmart'
+        assert nookmart.has_listing(1)
+        assert not self.market.has_listing(1)
+        assert all(t.startswith('lloid-db') for t in self.threads), self.threads
+
+if __name__ == '__main__':
+    unittest.main()
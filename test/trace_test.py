@@ -0,0 +1,47 @@
+import unittest
+import os
+import tempfile
+from lloidbot.trace import TraceRecorder, read
+
+class TestTraceRecorder(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+        self.now = 1000.0
+        self.recorder = TraceRecorder(self.path, clock=lambda: self.now)
+
+    def tearDown(self):
+        self.recorder.close()
+        os.remove(self.path)
+
+    def test_round_trip(self):
+        self.recorder.record('host', 1, guild=7, name="Nook", price=150, dodo='D0D0X', tz=8, desc=None)
+        self.now = 1001.2341
+        self.recorder.record('react', 2, owner=1, guild=7)
+        assert self.recorder.recorded == 2
+
+        events = list(read(self.path))
+        assert events == [
+            {'t': 1000.0, 'e': 'host', 'u': 1, 'guild': 7, 'name': "Nook", 'price': 150, 'dodo': 'D0D0X', 'tz': 8, 'desc': None},
+            {'t': 1001.234, 'e': 'react', 'u': 2, 'owner': 1, 'guild': 7},
+        ], events
+
+    def test_lines_are_compact(self):
+        self.recorder.record('done', 2)
+        with open(self.path) as f:
+            assert f.read() == '{"t":1000.0,"e":"done","u":2}\n'
+
+    def test_appends_to_an_existing_trace(self):
+        self.recorder.record('next', 1)
+        self.recorder.close()
+        self.recorder = TraceRecorder(self.path, clock=lambda: self.now)
+        self.recorder.record('close', 1)
+        assert [e['e'] for e in read(self.path)] == ['next', 'close']
+
+    def test_truncated_line_is_skipped(self):
+        self.recorder.record('next', 1)
+        self.recorder.file.write('{"t":1000.0,"e":"clo')
+        self.recorder.close()
+        with self.assertLogs('lloid', level='WARNING'):
+            events = list(read(self.path))
+        assert [e['e'] for e in events] == ['next']
@@ -1,9 +1,11 @@
 import unittest
-from lloidbot.turnips import Turnip, StalkMarket, Status
+from lloidbot.turnips import Turnip, StalkMarket, Status, IntervalClock, seconds_until_rollover
+from lloidbot import turnips
 import sqlite3
 from datetime import datetime
 from unittest import mock 
 import freezegun
+import tracemalloc
 
 alice = Turnip('global', 1, 'Alice', 'ALICE', 0, 'I am Alice', None, [None]*14)
 bella = Turnip('nookmart', 2, 'Bella', 'BELLA', 5, 'I am Bella', None, [None]*14)
@@ -40,17 +42,17 @@ class TestTurnips(unittest.TestCase):
 
         t = self.market.get_all()
         assert len(t) == 2, t
-        assert t[0].equals(alice), "%s did not equal %s" % (t[0], alice) 
-        assert t[1].equals(bella), "%s did not equal %s" % (t[1], bella)
+        assert t[0] == alice, "%s did not equal %s" % (t[0], alice) 
+        assert t[1] == bella, "%s did not equal %s" % (t[1], bella)
 
     def test_get_by_id(self):
         self.insert_sample_rows()
 
         t = self.market.get(alice.id)
-        assert t.equals(alice), f"{t} | {alice}"
+        assert t == alice, f"{t} | {alice}"
 
         t = self.market.get(bella.id)
-        assert t.equals(bella), f"{t} | {bella}"
+        assert t == bella, f"{t} | {bella}"
 
     @freezegun.freeze_time(tuesday_morning)
     def test_insert_new(self):
@@ -168,5 +170,291 @@ class TestTurnips(unittest.TestCase):
         result = self.market.declare(alice.id, alice.name, 150)
         assert result == Status.SUCCESS
 
+    @freezegun.freeze_time(tuesday_morning)
+    def test_declared_listings_are_served_from_cache(self):
+        self.market.declare(alice.id, alice.name, 150, alice.dodo, alice.gmtoffset, "old description")
+
+        statements = []
+        self.db.set_trace_callback(statements.append)
+        self.market.declare(alice.id, alice.name, 200, 'XDODO')
+        t = self.market.get(alice.id)
+        self.db.set_trace_callback(None)
+
+        assert not [st for st in statements if st.lower().startswith("select")], statements
+        assert t.current_price() == 200
+        assert t.dodo == 'XDODO'
+        assert t.description == "old description"
+        assert self.market.misses == 1
+
+    def test_lookups_without_chan_use_an_index(self):
+        plan = self.db.execute("explain query plan select " + turnips.listing_columns + " from turnips where id=?", (alice.id,)).fetchall()
+        assert any('turnips_id' in row[-1] for row in plan), plan
+
+    @freezegun.freeze_time(tuesday_morning)
+    def test_cache_is_warmed_on_startup(self):
+        self.market.declare(alice.id, alice.name, 150, alice.dodo, alice.gmtoffset)
+
+        market = StalkMarket(self.db)
+        t = market.get(alice.id)
+        assert t.current_price() == 150
+        assert market.hits == 1
+        assert market.misses == 0
+
+    @freezegun.freeze_time(tuesday_morning)
+    def test_cached_listing_is_not_mutated_by_declare(self):
+        self.market.declare(alice.id, alice.name, 150, alice.dodo, alice.gmtoffset)
+        before = self.market.get(alice.id)
+        self.market.declare(alice.id, alice.name, 200)
+
+        assert before.current_price() == 150
+        assert self.market.get(alice.id).current_price() == 200
+
+    @freezegun.freeze_time(tuesday_morning)
+    def test_declare_is_a_single_statement(self):
+        self.market.declare(alice.id, alice.name, 150, alice.dodo, alice.gmtoffset)
+
+        statements = []
+        self.db.set_trace_callback(statements.append)
+        self.market.declare(alice.id, alice.name, 200)
+        self.db.set_trace_callback(None)
+
+        writes = [st for st in statements if st.lower().startswith(("insert", "update", "replace"))]
+        assert len(writes) == 1, statements
+
+    @freezegun.freeze_time(tuesday_morning)
+    def test_declare_only_updates_its_own_channel(self):
+        self.market.declare(alice.id, alice.name, 150, alice.dodo, alice.gmtoffset, chan='global')
+        self.market.declare(alice.id, alice.name, 90, 'XDODO', alice.gmtoffset, chan='nookmart')
+        self.market.declare(alice.id, alice.name, 200, chan='nookmart')
+
+        assert self.market.get(alice.id, 'global').current_price() == 150
+        assert self.market.get(alice.id, 'global').dodo == alice.dodo
+        assert self.market.get(alice.id, 'nookmart').current_price() == 200
+        assert self.market.get(alice.id, 'nookmart').dodo == 'XDODO'
+
+    @freezegun.freeze_time(tuesday_morning)
+    def test_partitions_only_see_their_own_listings(self):
+        global_market = StalkMarket(self.db, 'global')
+        nookmart = StalkMarket(self.db, 'nookmart')
+        global_market.declare(alice.id, alice.name, 150, alice.dodo, alice.gmtoffset)
+        nookmart.declare(alice.id, alice.name, 90, 'XDODO', alice.gmtoffset)
+        nookmart.declare(bella.id, bella.name, 100, bella.dodo, bella.gmtoffset)
+
+        assert global_market.get(alice.id).current_price() == 150
+        assert nookmart.get(alice.id).current_price() == 90
+        assert global_market.get(bella.id) is None
+        assert global_market.has_listing(alice.id) and not global_market.has_listing(bella.id)
+        assert nookmart.has_listing(bella.id)
+
+        # a fresh partition only warms its own listings
+        assert len(StalkMarket(self.db, 'nookmart').listings) == 2
+        assert len(StalkMarket(self.db, 'global').listings) == 1
+
+    def test_partitions_only_wipe_their_own_listings(self):
+        global_market = StalkMarket(self.db, 'global')
+        nookmart = StalkMarket(self.db, 'nookmart')
+        with freezegun.freeze_time(saturday_evening):
+            global_market.declare(alice.id, alice.name, 150, alice.dodo, alice.gmtoffset)
+            nookmart.declare(bella.id, bella.name, 100, bella.dodo, alice.gmtoffset)
+        global_market.close(alice.id)
+        nookmart.close(bella.id)
+
+        with freezegun.freeze_time(datetime(2020, 3, 30, 2, 0)):
+            assert nookmart.wipe_old_prices() == 1
+        assert nookmart.get(bella.id).dodo is None
+        assert global_market.get(alice.id).dodo == alice.dodo
+
+    def test_wipe_old_prices(self):
+        with freezegun.freeze_time(saturday_evening):
+            self.market.declare(alice.id, alice.name, 150, alice.dodo, alice.gmtoffset)
+            self.market.declare(bella.id, bella.name, 100, bella.dodo, -5, chan='nookmart')
+        self.market.close(alice.id)
+        self.market.close(bella.id)
+
+        # Monday morning for Alice, but still Sunday evening for Bella
+        with freezegun.freeze_time(datetime(2020, 3, 30, 2, 0)):
+            assert self.market.wipe_old_prices() == 1
+            assert self.market.wipe_old_prices() == 0
+
+        t = self.market.get(alice.id)
+        assert t.history == [None]*14, t.history
+        assert t.dodo is None
+        t = self.db.execute("select dodo, val6b from turnips where id=?", (alice.id,)).fetchone()
+        assert t == (None, None), t
+
+        t = self.market.get(bella.id)
+        assert t.dodo == bella.dodo
+        assert t.history[11] == 100
+
+        with freezegun.freeze_time(datetime(2020, 3, 30, 6, 0)):
+            assert self.market.wipe_old_prices() == 1
+        assert self.market.get(bella.id).dodo is None
+
+    def test_wipe_keeps_dodo_codes_of_open_listings(self):
+        with freezegun.freeze_time(saturday_evening):
+            self.market.declare(alice.id, alice.name, 150, alice.dodo, alice.gmtoffset)
+            self.market.declare(bella.id, bella.name, 100, bella.dodo, alice.gmtoffset)
+        self.market.close(bella.id)
+
+        with freezegun.freeze_time(datetime(2020, 3, 30, 2, 0)):
+            assert self.market.wipe_old_prices() == 2
+        t = self.market.get(alice.id)
+        assert t.history == [None]*14, t.history
+        assert t.dodo == alice.dodo
+        assert self.db.execute("select dodo from turnips where id=?", (alice.id,)).fetchone() == (alice.dodo,)
+        assert self.market.get(bella.id).dodo is None
+
+    def test_reopening_after_the_rollover_keeps_dodo_codes(self):
+        with freezegun.freeze_time(sunday_evening):
+            self.market.declare(alice.id, alice.name, 150, alice.dodo, alice.gmtoffset)
+
+        # Down across the rollover: the listing is still open in the journal, so its line is
+        # restored before last week's prices are wiped.
+        with freezegun.freeze_time(datetime(2020, 3, 30, 0, 30)):
+            market = StalkMarket(self.db)
+            assert market.get(alice.id).dodo == alice.dodo
+            market.queue.restore(alice.id, {})
+            assert market.wipe_old_prices() == 1
+        t = market.get(alice.id)
+        assert t.dodo == alice.dodo
+        assert t.history == [None]*14, t.history
+
+    def test_adopting_legacy_listings(self):
+        with freezegun.freeze_time(tuesday_morning):
+            self.market.declare(alice.id, alice.name, 150, alice.dodo, alice.gmtoffset)
+            self.market.declare(bella.id, bella.name, 100, bella.dodo, bella.gmtoffset)
+            self.market.declare(bella.id, bella.name, 90, 'NEWER', bella.gmtoffset, chan='123')
+        self.db.execute("insert into turnip_weeks(chan, id, week, best) values ('global', 1, 10, 300)")
+
+        with self.assertLogs('lloid', level='WARNING'):
+            market = StalkMarket(self.db, '123', adopt='global')
+        assert market.cached(alice.id).chan == '123'
+        assert market.get(alice.id).dodo == alice.dodo
+        assert market.get(bella.id).dodo == 'NEWER' # the server's own listing wins
+        assert market.weekly_bests(10) == [(10, 300)]
+        assert StalkMarket(self.db, 'global').get_all('global')[0].id == bella.id
+
+        # Nothing left to move the next time round.
+        assert StalkMarket(self.db, '123', adopt='global').get(alice.id).chan == '123'
+        assert StalkMarket(self.db, '456').get(alice.id) is None
+
+    def test_wipe_archives_best_prices(self):
+        with freezegun.freeze_time(tuesday_morning):
+            self.market.declare(alice.id, alice.name, 150, alice.dodo, alice.gmtoffset)
+            self.market.declare(bella.id, bella.name, 100, bella.dodo, alice.gmtoffset, chan='nookmart')
+        with freezegun.freeze_time(saturday_evening):
+            self.market.declare(alice.id, alice.name, 180, alice.dodo, alice.gmtoffset)
+            week = turnips.week_number(datetime.utcnow())
+
+        with freezegun.freeze_time(datetime(2020, 3, 30, 2, 0)):
+            assert self.market.wipe_old_prices() == 2
+        assert sorted(self.market.weekly_bests(week)) == [(week, 100), (week, 180)]
+        assert self.market.weekly_bests(week + 1) == []
+        assert StalkMarket(self.db, 'nookmart').weekly_bests(week) == [(week, 100)]
+
+    def test_wipe_with_old_schema(self):
+        db = sqlite3.connect(":memory:")
+        db.execute("""create table turnips(chan, id, nick, dodo, utcoffset, description, latest_time, val1a, val1b, val2a, val2b, val3a, val3b, val4a, val4b, val5a, val5b, val6a, val6b, val7a, val7b,
+                primary key(chan, id))""")
+        db.execute("insert into turnips(chan, id, nick, dodo, utcoffset, latest_time, val2a) values ('global', 1, 'Alice', 'ALICE', 0, '2020-03-24 10:20:00.000001', 150)")
+
+        with freezegun.freeze_time(tuesday_evening):
+            market = StalkMarket(db)
+            assert market.get(alice.id).history[2] == 150
+            week = db.execute("select latest_week from turnips").fetchone()[0]
+            assert week == 2620, week
+
+        with freezegun.freeze_time(datetime(2020, 3, 30, 2, 0)):
+            assert market.wipe_old_prices() == 1
+        assert market.get(alice.id).history[2] is None
+        db.close()
+
+    def test_seconds_until_rollover(self):
+        # 11pm on Sunday in GMT+14 is 9am on Sunday in UTC
+        with freezegun.freeze_time(datetime(2020, 3, 29, 9, 0)):
+            assert seconds_until_rollover() == 60 * 60
+            assert seconds_until_rollover([0]) == 15 * 60 * 60
+
+class TestIntervalClock(unittest.TestCase):
+    def setUp(self):
+        self.clock = IntervalClock()
+
+    def test_matches_uncached_computation(self):
+        for moment in (tuesday_morning, tuesday_evening, wednesday_early, saturday_end, sunday_evening):
+            with freezegun.freeze_time(moment):
+                for offset in range(-12, 15):
+                    expected = turnips.interval_at(turnips.current_datetime(offset))
+                    assert self.clock.interval(offset) == expected, (moment, offset)
+
+    def test_cached_within_half_day(self):
+        with freezegun.freeze_time(tuesday_morning) as frozen:
+            assert self.clock.interval(0) == ("2a", 2)
+            with mock.patch.object(turnips, 'current_datetime', side_effect=AssertionError("recomputed")):
+                frozen.tick(60 * 60)
+                assert self.clock.interval(0) == ("2a", 2)
+
+    def test_invalidated_at_boundary(self):
+        with freezegun.freeze_time(datetime(2020, 3, 24, 11, 59, 59)) as frozen:
+            assert self.clock.interval(0) == ("2a", 2)
+            frozen.tick(1)
+            assert self.clock.interval(0) == ("2b", 2)
+            frozen.tick(12 * 60 * 60)
+            assert self.clock.interval(0) == ("3a", 4)
+
+    def test_invalidated_when_clock_goes_backwards(self):
+        with freezegun.freeze_time(tuesday_evening):
+            assert self.clock.interval(0) == ("2b", 2)
+        with freezegun.freeze_time(tuesday_morning):
+            assert self.clock.interval(0) == ("2a", 2)
+
+class TestTurnip(unittest.TestCase):
+    def test_history_round_trips_missing_prices(self):
+        t = Turnip('global', 1, 'Alice', 'ALICE', 0, None, None, [None, 90, None, 150] + [None]*10)
+        assert t.history == [None, 90, None, 150] + [None]*10
+        assert t.price_at(1) == 90
+        assert t.price_at(0) is None
+
+    def test_short_history_is_padded(self):
+        t = Turnip('global', 1, 'Alice', 'ALICE', 0, None, None, [None]*12)
+        assert t.history == [None]*14
+
+    def test_placeholder_prices_are_kept(self):
+        t = Turnip('global', 1, 'Alice', 'ALICE', 0, None, None, [99999, Turnip.MAX_PRICE] + [None]*12)
+        assert t.history[:2] == [99999, Turnip.MAX_PRICE]
+        with self.assertRaises(OverflowError):
+            t.history = [Turnip.MAX_PRICE + 1]
+
+    def test_equality_and_hash(self):
+        t = alice.clone()
+        assert t == alice
+        assert hash(t) == hash(alice)
+        assert len({t, alice}) == 1
+
+        t.history = [100] + [None]*13
+        assert t != alice
+        assert alice.history == [None]*14
+
+    def test_no_instance_dict(self):
+        assert not hasattr(alice, '__dict__')
+
+    def test_memory_per_listing(self):
+        n = 10000
+        ids = list(range(10**9, 10**9 + n))
+        history = [None, 90, 85, 80, 120, 150, 400, 200, 90, 70, None, None, None, None]
+
+        tracemalloc.start()
+        try:
+            before, _ = tracemalloc.get_traced_memory()
+            listings = [Turnip('global', i, 'Alice', 'ALICE', 0, None, '2020-03-24 10:20:00', history) for i in ids]
+            after, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        per_listing = (after - before) / n
+        # Measured at about 240 bytes on CPython 3.11 (including the list slot holding each listing),
+        # versus about 320 when Turnip had a __dict__ and kept its history in a list.
+        assert per_listing < 270, f"{per_listing:.0f} bytes per listing"
+        assert len(listings) == n
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
@@ -0,0 +1,134 @@
+import unittest
+import asyncio
+import os
+import shutil
+import tempfile
+from lloidbot.simulation import SimulatedBot
+from lloidbot.workers import Workers, shard_of, shards_for, pick
+
+A = 1 # a server on shard 0 of 2
+B = 1 << 22 # and one on shard 1
+
+def nobody():
+    return {'hosting': False, 'line': False, 'departed': False, 'preferred': False, 'guilds': []}
+
+class TestRouting(unittest.TestCase):
+    def test_shards_are_dealt_out_to_workers(self):
+        assert shard_of(A, 2) == 0 and shard_of(B, 2) == 1
+        assert shards_for(0, 2, 5) == [0, 2, 4]
+        assert shards_for(1, 2, 5) == [1, 3]
+
+    def test_commands_go_where_the_user_is(self):
+        claims = {0: nobody(), 1: dict(nobody(), hosting=True, guilds=[[B, 'Bells']])}
+        assert pick('close', claims) == 1
+        assert pick('host', claims) == 1
+        assert pick('done', claims) is None
+        claims[0]['departed'] = True
+        assert pick('done', claims) == 0
+
+    def test_hosts_in_several_servers_are_asked_where_they_are(self):
+        claims = {0: dict(nobody(), guilds=[[A, 'Nooks']]), 1: dict(nobody(), guilds=[[B, 'Bells']])}
+        assert pick('host', claims) is None
+        assert pick('server', claims, rest=' bells') == 1
+        claims[1]['preferred'] = True
+        assert pick('host', claims) == 1
+
+    def test_only_queueinfo_leaves_a_server(self):
+        claims = {0: nobody(), 1: dict(nobody(), line=True, hosting=True)}
+        assert pick('queueinfo', claims, in_guild=True) == 1
+        assert pick('market', claims, in_guild=True) is None
+        assert pick('market', claims) == 1
+
+# Two workers in one process, one per server, talking over the real sockets and sharing a
+# database file. Runs on a real clock, so nothing here waits out a cooldown.
+class TestWorkers(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.directory = tempfile.mkdtemp()
+        self.inbox = []
+        self.bots = []
+        for index, guild in enumerate((A, B)):
+            bot = SimulatedBot(self.loop, lambda user, content: self.inbox.append((user.id, content)))
+            bot.workers = Workers(bot, index, 2, self.directory)
+            self.loop.run_until_complete(bot.start_simulation(path=os.path.join(self.directory, 'test.db'), guild_ids=[guild], shared=True))
+            self.loop.run_until_complete(bot.workers.start())
+            self.bots.append(bot)
+
+    def tearDown(self):
+        async def stop():
+            for bot in self.bots:
+                await bot.workers.stop()
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for bot in self.bots:
+                await bot.stop_simulation()
+        self.loop.run_until_complete(stop())
+        asyncio.set_event_loop(None)
+        self.loop.close()
+        shutil.rmtree(self.directory)
+
+    # A user of both workers who's a member of the given servers, as seen by each worker.
+    def add_user(self, id, name, *guilds):
+        return [bot.add_user(id, name, guild_id=next((g for g in guilds if g in bot.partitions), 0)) for bot in self.bots]
+
+    def said_to(self, user):
+        return [content for id, content in self.inbox if id == user]
+
+    async def until(self, condition):
+        for _ in range(200):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        raise AssertionError("timed out")
+
+    def test_dms_are_handled_by_the_worker_with_the_server(self):
+        host = self.add_user(1, 'Nook', B)
+        guest = self.add_user(10, 'guest', B)
+        async def run():
+            # Everything's DMed to worker 0, the way DMs all come in on shard 0.
+            await self.bots[0].command(host[0], 'host', 100, 'D0D0X', 0)
+            await self.until(lambda: 1 in self.bots[1].associated_message)
+            assert 1 not in self.bots[0].hosting
+            await self.bots[1].react(guest[1], 1)
+            await self.until(lambda: any("NOW BOARDING" in m for m in self.said_to(10)))
+            await self.bots[0].command(guest[0], 'done')
+            await self.until(lambda: 10 not in self.bots[1].recently_departed)
+            await self.bots[0].command(host[0], 'close')
+            await self.until(lambda: 1 not in self.bots[1].hosting)
+        self.loop.run_until_complete(run())
+        assert self.bots[1].journal.load()['listings'] == {}
+
+    def test_hosts_in_both_servers_pick_one(self):
+        host = self.add_user(1, 'Nook', A, B)
+        async def run():
+            await self.bots[0].command(host[0], 'host', 100, 'D0D0X', 0)
+            asked = self.said_to(1)[-1]
+            assert "Server 1" in asked and f"Server {B}" in asked, asked
+            await self.bots[0].command(host[0], 'server', name=f"Server {B}")
+            await self.until(lambda: 1 in self.bots[1].preferred_guild)
+            await self.bots[0].command(host[0], 'host', 100, 'D0D0X', 0)
+            await self.until(lambda: 1 in self.bots[1].associated_message)
+            # Changing their mind takes the old pick away.
+            await self.bots[0].command(host[0], 'server', name="Server 1")
+            assert self.bots[0].preferred_guild[1] == A
+            assert 1 not in self.bots[1].preferred_guild
+        self.loop.run_until_complete(run())
+        assert 1 not in self.bots[0].hosting
+
+    def test_a_guest_only_waits_in_one_line(self):
+        hosts = [self.add_user(1, 'Nook', A), self.add_user(2, 'Isabelle', B)]
+        first, guest = self.add_user(10, 'first', A, B), self.add_user(11, 'guest', A, B)
+        async def run():
+            await self.bots[0].command(hosts[0][0], 'host', 100, 'D0D0X', 0)
+            await self.bots[1].command(hosts[1][1], 'host', 100, 'D0D0X', 0)
+            await self.bots[0].react(first[0], 1)
+            await self.until(lambda: any("NOW BOARDING" in m for m in self.said_to(10)))
+            await self.bots[0].react(guest[0], 1) # waits out the first guest's visit
+            await self.bots[1].react(guest[1], 2)
+            await self.until(lambda: any("in line elsewhere" in m for m in self.said_to(11)))
+        self.loop.run_until_complete(run())
+        assert self.bots[0].line_of(11) is not None
+        assert self.bots[1].line_of(11) is None